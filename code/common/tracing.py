@@ -0,0 +1,242 @@
+"""
+Tracing of the pipelines across the orchestrator and the services. The trace context is propagated
+to the services in the W3C `traceparent` header, and the spans are written as OTLP/JSON lines, which
+trace viewers load offline (e.g. through the `otlpjsonfile` receiver of the OpenTelemetry collector).
+This module is copied into the images of the orchestrator and of the services by their pre.sh.
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+# Directory of the span files, one per service, tracing is disabled when empty
+TRACES_DIR = os.environ.get("TRACES_DIR", "./traces/")
+# Size (in bytes) of a span file before it is rotated, the previous file is kept with a `.1` suffix
+TRACES_MAX_BYTES = int(os.environ.get("TRACES_MAX_BYTES", str(64 * 1024 ** 2)))
+# Number of buffered spans written at once, when no request span ended or flush was called before
+TRACES_BATCH_SIZE = int(os.environ.get("TRACES_BATCH_SIZE", "256"))
+
+# Span kinds and status codes of the OTLP format
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# Span of the running code, parent of the spans it starts
+current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str] | None:
+    """
+    Read the trace context sent by the caller.
+    :param header: the `traceparent` header, e.g. `00-<trace id>-<parent span id>-01`
+    :type header: str | None
+    :return: the trace id and the id of the parent span, None if the header is missing or invalid
+    :rtype: tuple[str, str] | None
+    """
+    match = TRACEPARENT.match(header.strip().lower()) if header else None
+    return (match.group(1), match.group(2)) if match else None
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:
+    """
+    A timed operation of a trace, recorded by its tracer once ended.
+    """
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_id: str | None, kind: int,
+                 attributes: dict | None = None, start_time: float | None = None):
+        """
+        Constructor.
+        :param tracer: the tracer recording the span
+        :type tracer: Tracer
+        :param name: the name of the span
+        :type name: str
+        :param trace_id: the id of the trace
+        :type trace_id: str
+        :param parent_id: the id of the parent span, None for the root span of the trace
+        :type parent_id: str | None
+        :param kind: the kind of span (KIND_INTERNAL, KIND_SERVER or KIND_CLIENT)
+        :type kind: int
+        :param attributes: the attributes of the span
+        :type attributes: dict | None
+        :param start_time: the start time (in seconds since the epoch), now by default
+        :type start_time: float | None
+        """
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_time = start_time if start_time is not None else time.time()
+        self.end_time = None
+        self.status = STATUS_OK
+        self.message = None
+
+    @property
+    def traceparent(self) -> str:
+        """
+        The `traceparent` header making this span the parent of the spans of the callee.
+        """
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self, error: BaseException | None = None, end_time: float | None = None):
+        if self.end_time is not None:
+            return
+        self.end_time = end_time if end_time is not None else time.time()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.message = str(error) or type(error).__name__
+        self.tracer.record(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(int(self.start_time * 1e9)),
+            "endTimeUnixNano": str(int(self.end_time * 1e9)),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status},
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        if self.message is not None:
+            span["status"]["message"] = self.message
+        return span
+
+
+class Tracer:
+    """
+    Creates the spans of a service and buffers the ended ones until they are written to its span file,
+    which happens when a request (server span) ends, when the buffer is full, or when `flush` is called.
+    """
+
+    def __init__(self, service_name: str, directory: str = TRACES_DIR, max_bytes: int = TRACES_MAX_BYTES,
+                 batch_size: int = TRACES_BATCH_SIZE):
+        """
+        Constructor.
+        :param service_name: the name of the service, in the resource of the spans
+        :type service_name: str
+        :param directory: the directory of the span file, spans are not written when empty
+        :type directory: str
+        :param max_bytes: the size (in bytes) of the span file before it is rotated
+        :type max_bytes: int
+        :param batch_size: the number of buffered spans written without waiting for a request to end
+        :type batch_size: int
+        """
+        self.service_name = service_name
+        self.path = os.path.join(directory, f"{service_name}.jsonl") if directory else None
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.buffer: list[Span] = []
+        if self.path is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def start_span(self, name: str, kind: int = KIND_INTERNAL, traceparent: str | None = None,
+                   trace_id: str | None = None, attributes: dict | None = None,
+                   start_time: float | None = None) -> Span:
+        """
+        Start a span, child of the span sent by the caller in `traceparent`, or else of the current span.
+        Without either, the span starts the trace `trace_id` (or a new trace).
+        :param name: the name of the span
+        :type name: str
+        :param kind: the kind of span (KIND_INTERNAL, KIND_SERVER or KIND_CLIENT)
+        :type kind: int
+        :param traceparent: the `traceparent` header of the caller, if any
+        :type traceparent: str | None
+        :param trace_id: the id of the trace of a root span
+        :type trace_id: str | None
+        :param attributes: the attributes of the span
+        :type attributes: dict | None
+        :param start_time: the start time (in seconds since the epoch), now by default
+        :type start_time: float | None
+        :return: the span, which must be ended
+        :rtype: Span
+        """
+        context = parse_traceparent(traceparent)
+        parent = current_span.get()
+        if context is not None:
+            trace_id, parent_id = context
+        elif parent is not None and trace_id is None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = trace_id or new_trace_id(), None
+        return Span(self, name, trace_id, parent_id, kind, attributes, start_time)
+
+    @contextlib.contextmanager
+    def span(self, name: str, kind: int = KIND_INTERNAL, traceparent: str | None = None,
+             trace_id: str | None = None, attributes: dict | None = None, start_time: float | None = None):
+        """
+        Run a block in a span, which is the current span within the block. The span is marked as
+        failed if the block raises an exception. The arguments are the ones of `start_span`.
+        :return: the span
+        :rtype: ContextManager[Span]
+        """
+        span = self.start_span(name, kind, traceparent, trace_id, attributes, start_time)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        finally:
+            current_span.reset(token)
+            span.end()
+
+    def record(self, span: Span):
+        if self.path is None:
+            return
+        with self.lock:
+            self.buffer.append(span)
+            full = len(self.buffer) >= self.batch_size
+        if full or span.kind == KIND_SERVER:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered spans to the span file, as one OTLP/JSON export request.
+        """
+        with self.lock:
+            spans, self.buffer = self.buffer, []
+            if not spans:
+                return
+            request = {"resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "mlodimage"}, "spans": [span.to_otlp() for span in spans]}],
+            }]}
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(request) + "\n")
+            except OSError as e:
+                print("Error while writing the spans:", e)
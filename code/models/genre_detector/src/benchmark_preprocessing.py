@@ -0,0 +1,125 @@
+"""
+Microbenchmark of the preprocessing of a clip, as done for every request of the genre detection service
+and for every sample of the training: resampling and mel spectrogram, with the transforms built for
+every clip (before they were cached) and with the cached transforms of AudioUtils.
+
+Run from the genre_detector folder: python src/benchmark_preprocessing.py --clips 50
+"""
+
+import argparse
+import statistics
+import time
+import torch
+import torchaudio
+import yaml
+
+from model.audio_utils import AudioUtils
+
+AUDIO_PARAMS = yaml.safe_load(open("params.yaml"))['audio']
+
+
+def preprocess_uncached(audio):
+    """
+    Preprocess a clip building the transforms, as AudioUtils did before caching them.
+    :param audio: the audio, composed of the signal and the sample rate
+    :type audio: Tuple[torch.Tensor, int]
+    :return: the mel spectrogram
+    :rtype: torch.Tensor
+    """
+    signal, sample_rate = AudioUtils.rechannel(audio, AUDIO_PARAMS['nb_channels'])
+    if sample_rate != AUDIO_PARAMS['sample_rate']:
+        signal = torchaudio.transforms.Resample(sample_rate, AUDIO_PARAMS['sample_rate'])(signal)
+    audio = AudioUtils.pad_truncate((signal, AUDIO_PARAMS['sample_rate']), AUDIO_PARAMS['audio_duration'])
+    mel_spectrogram = torchaudio.transforms.MelSpectrogram(audio[1], n_fft=2048, hop_length=None, n_mels=64)(audio[0])
+    return torchaudio.transforms.AmplitudeToDB(top_db=80)(mel_spectrogram)
+
+
+def preprocess_cached(audio):
+    """
+    Preprocess a clip with AudioUtils, as the genre detection service does.
+    :param audio: the audio, composed of the signal and the sample rate
+    :type audio: Tuple[torch.Tensor, int]
+    :return: the mel spectrogram
+    :rtype: torch.Tensor
+    """
+    audio = AudioUtils.rechannel(audio, AUDIO_PARAMS['nb_channels'])
+    audio = AudioUtils.resample(audio, AUDIO_PARAMS['sample_rate'])
+    audio = AudioUtils.pad_truncate(audio, AUDIO_PARAMS['audio_duration'])
+    return AudioUtils.mel_spectrogram(audio)
+
+
+def benchmark(preprocess, clips):
+    """
+    Time the preprocessing of clips.
+    :param preprocess: the preprocessing function
+    :type preprocess: Callable
+    :param clips: the clips, composed of the signal and the sample rate
+    :type clips: List[Tuple[torch.Tensor, int]]
+    :return: the mel spectrograms and the mean time per clip (in milliseconds)
+    :rtype: Tuple[List[torch.Tensor], float]
+    """
+    start = time.perf_counter()
+    mel_spectrograms = [preprocess(clip) for clip in clips]
+    return mel_spectrograms, (time.perf_counter() - start) / len(clips) * 1000
+
+
+def build_time(sample_rate, repeats=50):
+    """
+    Time building the transforms of a clip, the time the cache saves per clip.
+    :param sample_rate: the sample rate of the clip
+    :type sample_rate: int
+    :param repeats: the number of times the transforms are built
+    :type repeats: int
+    :return: the mean time (in milliseconds)
+    :rtype: float
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        if sample_rate != AUDIO_PARAMS['sample_rate']:
+            torchaudio.transforms.Resample(sample_rate, AUDIO_PARAMS['sample_rate'])
+        torchaudio.transforms.MelSpectrogram(AUDIO_PARAMS['sample_rate'], n_fft=2048, hop_length=None, n_mels=64)
+        torchaudio.transforms.AmplitudeToDB(top_db=80)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the preprocessing of a clip before and after caching "
+                                                 "the transforms.")
+    parser.add_argument("--clips", type=int, default=50, help="number of clips")
+    parser.add_argument("--sample-rate", type=int, default=44100, help="sample rate of the clips")
+    parser.add_argument("--duration", type=float, default=30, help="duration of the clips (in seconds)")
+    parser.add_argument("--threads", type=int, default=1, help="number of threads used by torch")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="number of alternated runs of both preprocessings, whose median time is kept")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    clips = [(torch.rand(2, int(args.sample_rate * args.duration)) * 2 - 1, args.sample_rate)
+             for _ in range(args.clips)]
+
+    # Warm up, which also fills the cache of the transforms
+    benchmark(preprocess_uncached, clips[:1])
+    benchmark(preprocess_cached, clips[:1])
+
+    # Alternated, so both preprocessings are equally affected by the load of the machine
+    before_times, after_times = [], []
+    for _ in range(args.repeats):
+        before, before_time = benchmark(preprocess_uncached, clips)
+        after, after_time = benchmark(preprocess_cached, clips)
+        before_times.append(before_time)
+        after_times.append(after_time)
+    before_time = statistics.median(before_times)
+    after_time = statistics.median(after_times)
+    identical = all(torch.allclose(b, a) for b, a in zip(before, after))
+
+    print(f"{args.clips} clips of {args.duration:g} s at {args.sample_rate} Hz, {args.threads} thread(s), "
+          f"median of {args.repeats} runs")
+    print(f"transforms built per clip: {before_time:.1f} ms per clip")
+    print(f"cached transforms:         {after_time:.1f} ms per clip ({before_time / after_time:.2f}x)")
+    print(f"building the transforms:   {build_time(args.sample_rate):.2f} ms per clip")
+    print(f"identical mel spectrograms: {identical}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,24 @@ import torchaudio
 import torch.nn.functional as F
 import torch
 import random
+from functools import lru_cache
+
+
+# The transforms compute their kernels and filterbanks when they are built, so they are built once
+# per set of parameters and reused for every signal
+@lru_cache(maxsize=32)
+def _resample_transform(sample_rate, new_sample_rate):
+    return torchaudio.transforms.Resample(sample_rate, new_sample_rate)
+
+
+@lru_cache(maxsize=32)
+def _mel_spectrogram_transform(sample_rate, n_fft, hop_length, n_mels):
+    return torch.nn.Sequential(
+        torchaudio.transforms.MelSpectrogram(sample_rate, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels),
+        # convert to decibels
+        torchaudio.transforms.AmplitudeToDB(top_db=80),
+    )
+
 
 class AudioUtils():
     """
@@ -59,8 +77,7 @@ class AudioUtils():
         if sample_rate == new_sample_rate:
             # nothing to do
             return audio
-        resample = torchaudio.transforms.Resample(sample_rate, new_sample_rate)
-        signal = resample(signal)
+        signal = _resample_transform(sample_rate, new_sample_rate)(signal)
         return signal, new_sample_rate
     
     @staticmethod
@@ -120,15 +137,56 @@ class AudioUtils():
         :rtype: torch.Tensor
         """
         signal, sample_rate = audio
-        
-        mel_spectrogram = torchaudio.transforms.MelSpectrogram(
-            sample_rate,
-            n_fft=n_fft,
-            hop_length=hop_length,
-            n_mels=n_mels
-        )(signal)
+        return _mel_spectrogram_transform(sample_rate, n_fft, hop_length, n_mels)(signal)
 
-        # convert to decibels
-        mel_spectrogram = torchaudio.transforms.AmplitudeToDB(top_db=80)(mel_spectrogram)
+    @staticmethod
+    def mel_spectrogram_windows(audio, length, overlap=0.5, max_windows=None, n_mels=64, n_fft=2048,
+                                hop_length=None):
+        """
+        Create the mel spectrograms of overlapping windows covering the whole audio signal, as one batch.
+        The mel spectrogram of the signal is computed once and split into windows of the frames a signal
+        of the window length gives, then each window is converted to decibels.
+        A signal shorter than a window gives a single window, padded as by pad_truncate.
+        :param audio: the audio, composed of the signal and the sample rate
+        :type audio: Tuple[torch.Tensor, int]
+        :param length: the length of a window in ms
+        :type length: int
+        :param overlap: the fraction of a window overlapping the next one
+        :type overlap: float
+        :param max_windows: the maximum number of windows, evenly spread over the signal, None for no maximum
+        :type max_windows: int
+        :param n_mels: the number of mel filterbanks
+        :type n_mels: int
+        :param n_fft: the size of the FFT
+        :type n_fft: int
+        :param hop_length: the length of hop between STFT windows
+        :type hop_length: int
+        :return: the mel spectograms of the windows, the first dimension being the window
+        :rtype: torch.Tensor
+        """
+        signal, sample_rate = audio
+        hop = hop_length if hop_length is not None else n_fft // 2
+        window_frames = sample_rate//1000 * length // hop + 1
+        transform = _mel_spectrogram_transform(sample_rate, n_fft, hop_length, n_mels)
+
+        mel_spectrogram = transform[0](signal)
+        frames = mel_spectrogram.shape[-1]
+        if frames <= window_frames:
+            padded = AudioUtils.pad_truncate(audio, length)
+            return AudioUtils.mel_spectrogram(padded, n_mels, n_fft, hop_length).unsqueeze(0)
+
+        last_start = frames - window_frames
+        stride = max(1, round(window_frames * (1 - overlap)))
+        starts = list(range(0, last_start + 1, stride))
+        if starts[-1] != last_start:
+            # the last window ends with the signal
+            starts.append(last_start)
+        if max_windows is not None and len(starts) > max_windows:
+            if max_windows == 1:
+                starts = [last_start // 2]
+            else:
+                starts = [round(i * last_start / (max_windows - 1)) for i in range(max_windows)]
 
-        return mel_spectrogram
\ No newline at end of file
+        windows = torch.stack([mel_spectrogram[..., start:start + window_frames] for start in starts])
+        # convert to decibels, relative to the maximum of each window
+        return transform[1](windows)
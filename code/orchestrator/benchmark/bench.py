@@ -0,0 +1,367 @@
+"""
+Load test of the orchestrator against the stub services. Starts the stubs and the orchestrator, drives
+pipelines through `/create`, `/run`, the websocket and `/result` at a target concurrency, and reports the
+throughput, the end-to-end latency percentiles and the CPU and memory used by the orchestrator.
+
+The report is written as JSON with the commit it was measured on, and can be compared with the report of
+another commit: `python bench.py --output new.json --compare baseline.json` exits with status 1 when a
+metric regressed by more than the tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+import websockets
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ORCHESTRATOR_DIR = os.path.join(BENCHMARK_DIR, "..", "fastapi")
+SERVICES = ["youtube-downloader", "whisper", "genre-detection", "sentiment-analysis", "art-generation"]
+TERMINAL_STATUSES = ("result_ready", "failed")
+
+# Metrics compared between two reports, and whether a higher value is better
+COMPARED_METRICS = {
+    "throughput": True,
+    "latency_p50": False,
+    "latency_p95": False,
+    "latency_p99": False,
+    "cpu_seconds_per_pipeline": False,
+    "rss_peak_bytes": False,
+}
+
+
+class ProcessSampler:
+    """
+    Samples the CPU time and the resident memory of a process from /proc (Linux only).
+    """
+
+    def __init__(self, pid: int, interval: float):
+        """
+        Constructor.
+        :param pid: the id of the process
+        :type pid: int
+        :param interval: the time (in seconds) between two samples
+        :type interval: float
+        """
+        self.pid = pid
+        self.interval = interval
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.rss_peak = 0
+        self.rss_last = 0
+        self.task: asyncio.Task | None = None
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            # The command name may contain spaces, the fields follow its closing parenthesis
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_bytes(self) -> int:
+        with open(f"/proc/{self.pid}/statm") as f:
+            return int(f.read().split()[1]) * self.page_size
+
+    def sample(self):
+        self.rss_last = self.rss_bytes()
+        self.rss_peak = max(self.rss_peak, self.rss_last)
+
+    async def _sample_periodically(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.task = asyncio.create_task(self._sample_periodically())
+
+    async def stop(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.sample()
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """
+    Percentile of the values, interpolated between the closest ranks.
+    :param values: the values, sorted
+    :type values: list[float]
+    :param fraction: the percentile, between 0 and 1
+    :type fraction: float
+    :return: the percentile, 0 without values
+    :rtype: float
+    """
+    if not values:
+        return 0.0
+    rank = (len(values) - 1) * fraction
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def git_commit(directory: str) -> str | None:
+    # The measured commit, marked as dirty when the working tree has uncommitted changes
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=directory, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + "-dirty" if changes else commit
+
+
+async def wait_until_up(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not answer within {timeout}s")
+            await asyncio.sleep(0.2)
+
+
+def start_server(app: str, app_dir: str, port: int, cwd: str, env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--app-dir", app_dir, "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=cwd, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def request_with_backoff(client: httpx.AsyncClient, method: str, url: str, stats: dict, **kwargs):
+    # Wait and send the request again while the orchestrator queue is full
+    while True:
+        response = await client.request(method, url, **kwargs)
+        if response.status_code != 429:
+            response.raise_for_status()
+            return response
+        stats["rejected"] += 1
+        await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+
+async def run_pipeline(client: httpx.AsyncClient, base_url: str, index: int, args, stats: dict) -> dict:
+    """
+    Drive one pipeline from its creation to the download of its images.
+    :return: the timings (in seconds since the creation) and the final status of the pipeline
+    :rtype: dict
+    """
+    start = time.perf_counter()
+    if index % 100 < args.youtube_percent:
+        # The video id makes every URL a distinct video for the YouTube audio cache
+        data, files = {"url": f"https://www.youtube.com/watch?v={index:011d}"}, None
+    else:
+        # Random audio, so no stage result comes from the cache
+        data, files = None, {"audio": (f"track{index}.mp3", os.urandom(args.audio_bytes), "audio/mpeg")}
+    response = await request_with_backoff(client, "POST", f"{base_url}/create", stats, data=data, files=files)
+    pipeline_id = response.json()["id"]
+    created = time.perf_counter()
+
+    await request_with_backoff(client, "GET", f"{base_url}/run/{pipeline_id}", stats)
+    submitted = time.perf_counter()
+
+    status = None
+    async with websockets.connect(f"ws{base_url[4:]}/ws/{pipeline_id}", max_size=None) as websocket:
+        while status not in TERMINAL_STATUSES:
+            status = json.loads(await websocket.recv()).get("status")
+    ended = time.perf_counter()
+
+    result_bytes = 0
+    if status == "result_ready":
+        async with client.stream("GET", f"{base_url}/result/{pipeline_id}") as response:
+            async for chunk in response.aiter_bytes():
+                result_bytes += len(chunk)
+    return {
+        "status": status,
+        "create": created - start,
+        "submit": submitted - created,
+        "processing": ended - submitted,
+        "total": time.perf_counter() - start,
+        "result_bytes": result_bytes,
+    }
+
+
+async def drive(base_url: str, args, sampler: ProcessSampler | None) -> dict:
+    stats = {"rejected": 0}
+    results = []
+    next_index = 0
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        async def worker(end: int, record: bool):
+            # The measured pipelines follow the warmup ones, so they do not share their inputs
+            nonlocal next_index
+            while next_index < end:
+                index = next_index
+                next_index += 1
+                result = await run_pipeline(client, base_url, index, args, stats)
+                if record:
+                    results.append(result)
+
+        # Warm up the orchestrator (connections, imports done on first use) before measuring
+        await asyncio.gather(*(worker(args.warmup, False) for _ in range(min(args.concurrency, args.warmup))))
+        stats["rejected"] = 0
+        cpu_start = sampler.cpu_seconds() if sampler else None
+        if sampler:
+            sampler.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(args.warmup + args.pipelines, True) for _ in range(args.concurrency)))
+        duration = time.perf_counter() - start
+        if sampler:
+            await sampler.stop()
+
+    completed = [result for result in results if result["status"] == "result_ready"]
+    totals = sorted(result["total"] for result in completed)
+    report = {
+        "pipelines": len(results),
+        "completed": len(completed),
+        "failed": len(results) - len(completed),
+        "rejected_requests": stats["rejected"],
+        "duration": duration,
+        "throughput": len(completed) / duration,
+        "latency_mean": statistics.fmean(totals) if totals else 0.0,
+        "latency_p50": percentile(totals, 0.50),
+        "latency_p95": percentile(totals, 0.95),
+        "latency_p99": percentile(totals, 0.99),
+        "latency_max": totals[-1] if totals else 0.0,
+        "create_p50": percentile(sorted(result["create"] for result in completed), 0.50),
+        "submit_p50": percentile(sorted(result["submit"] for result in completed), 0.50),
+    }
+    if sampler:
+        cpu_seconds = sampler.cpu_seconds() - cpu_start
+        report.update({
+            "cpu_seconds": cpu_seconds,
+            "cpu_percent": 100 * cpu_seconds / duration,
+            "cpu_seconds_per_pipeline": cpu_seconds / max(1, len(results)),
+            "rss_peak_bytes": sampler.rss_peak,
+            "rss_end_bytes": sampler.rss_last,
+        })
+    return report
+
+
+async def benchmark(args) -> dict:
+    if args.url is not None:
+        sampler = ProcessSampler(args.pid, args.sample_interval) if args.pid else None
+        return await drive(args.url.rstrip("/"), args, sampler)
+
+    with tempfile.TemporaryDirectory(prefix="mlodimage-benchmark-") as workdir:
+        for directory in ("audios", "results"):
+            os.makedirs(os.path.join(workdir, directory))
+        stubs_url = f"http://127.0.0.1:{args.stubs_port}"
+        orchestrator_env = {
+            "PIPELINE_DESCRIPTION": os.path.abspath(os.path.join(args.orchestrator_dir, "pipeline.json")),
+            "TRACES_DIR": os.environ.get("TRACES_DIR", ""),
+            # The shared modules (e.g. tracing), copied next to the orchestrator when its image is built
+            "PYTHONPATH": os.path.abspath(os.path.join(args.orchestrator_dir, "..", "..", "common")),
+            **{f"{service.upper().replace('-', '_')}_URLS": f"{stubs_url}/{service}" for service in SERVICES},
+        }
+        stubs = start_server("stubs:app", BENCHMARK_DIR, args.stubs_port, workdir,
+                             {"BENCHMARK_PROFILE": os.path.abspath(args.profile)},
+                             os.path.join(workdir, "stubs.log"))
+        orchestrator = start_server("main:app", os.path.abspath(args.orchestrator_dir), args.port, workdir,
+                                    orchestrator_env, os.path.join(workdir, "orchestrator.log"))
+        try:
+            await wait_until_up(f"{stubs_url}/whisper/docs", args.startup_timeout)
+            await wait_until_up(f"http://127.0.0.1:{args.port}/pipelines/counts", args.startup_timeout)
+            return await drive(f"http://127.0.0.1:{args.port}", args,
+                               ProcessSampler(orchestrator.pid, args.sample_interval))
+        finally:
+            for process in (orchestrator, stubs):
+                process.terminate()
+                process.wait()
+            if args.keep_logs:
+                for name in ("orchestrator.log", "stubs.log"):
+                    os.replace(os.path.join(workdir, name), os.path.join(args.keep_logs, name))
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Print the change of each compared metric since the baseline.
+    :return: the metrics which regressed by more than the tolerance
+    :rtype: list[str]
+    """
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit') or 'the baseline'}:")
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        if metric not in report["results"] or not baseline["results"].get(metric):
+            continue
+        change = report["results"][metric] / baseline["results"][metric] - 1
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        if regressed:
+            regressions.append(metric)
+        print(f"  {metric:<26} {baseline['results'][metric]:>14.4f} -> {report['results'][metric]:>14.4f}"
+              f"  {change:+.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", type=int, default=200, help="number of measured pipelines")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of pipelines driven at the same time")
+    parser.add_argument("--warmup", type=int, default=16, help="number of pipelines run before measuring")
+    parser.add_argument("--audio-bytes", type=int, default=1024 ** 2, help="size of the uploaded audio files")
+    parser.add_argument("--youtube-percent", type=int, default=0,
+                        help="percentage of the pipelines created from a YouTube URL instead of an upload")
+    parser.add_argument("--profile", default=os.path.join(BENCHMARK_DIR, "profile.json"),
+                        help="latency distribution and response size of each stub service")
+    parser.add_argument("--port", type=int, default=9200, help="port of the orchestrator")
+    parser.add_argument("--stubs-port", type=int, default=9100, help="port of the stub services")
+    parser.add_argument("--orchestrator-dir", default=ORCHESTRATOR_DIR,
+                        help="directory of the orchestrator started with the stubs, e.g. in a worktree of another "
+                             "commit")
+    parser.add_argument("--url", help="benchmark this running orchestrator instead of starting one with the stubs")
+    parser.add_argument("--pid", type=int, help="process id of the orchestrator given by --url, to measure it")
+    parser.add_argument("--timeout", type=float, default=600, help="timeout (in seconds) of each request")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--sample-interval", type=float, default=0.2, help="time (in seconds) between RSS samples")
+    parser.add_argument("--keep-logs", help="directory where the logs of the orchestrator and stubs are kept")
+    parser.add_argument("--output", help="path of the JSON report")
+    parser.add_argument("--compare", help="JSON report of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative regression tolerated by --compare")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(args.orchestrator_dir),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": {"cpus": os.cpu_count(), "platform": platform.platform()},
+        "config": {
+            "pipelines": args.pipelines,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "audio_bytes": args.audio_bytes,
+            "youtube_percent": args.youtube_percent,
+            "max_concurrent_pipelines": os.environ.get("MAX_CONCURRENT_PIPELINES"),
+        },
+        "results": asyncio.run(benchmark(args)),
+    }
+    with open(args.profile) as f:
+        report["config"]["profile"] = json.load(f)
+
+    for metric, value in report["results"].items():
+        print(f"{metric:<28} {value:.4f}" if isinstance(value, float) else f"{metric:<28} {value}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["config"] != report["config"]:
+            print("Warning: the baseline was measured with another configuration")
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Stub versions of the five services called by the orchestrator, answering their `/process` route after a
+random latency with a response of the configured size. Each service is served under its own prefix,
+e.g. `http://127.0.0.1:9100/whisper/process`, and the outputs depend on the inputs, so the orchestrator
+caches behave as with the real services.
+
+Run with `BENCHMARK_PROFILE=profile.json uvicorn stubs:app --port 9100`.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import zipfile
+from fastapi import FastAPI, File, Request, UploadFile
+from fastapi.responses import Response
+
+PROFILE_PATH = os.environ.get("BENCHMARK_PROFILE", os.path.join(os.path.dirname(__file__), "profile.json"))
+SERVICES = ["youtube-downloader", "whisper", "genre-detection", "sentiment-analysis", "art-generation"]
+GENRES = ["Electronic", "Experimental", "Folk", "Hip-Hop", "Instrumental", "International", "Pop", "Rock"]
+
+with open(PROFILE_PATH) as f:
+    profile = json.load(f)
+
+app = FastAPI(title="MLodImage benchmark stubs")
+
+
+def latency(service: str) -> float:
+    """
+    Draw the processing time of a request from the latency distribution of the service.
+    :param service: the name of the service
+    :type service: str
+    :return: the latency (in seconds)
+    :rtype: float
+    """
+    distribution = profile[service]["latency"]
+    kind = distribution["distribution"]
+    if kind == "constant":
+        return distribution["value"]
+    if kind == "uniform":
+        return random.uniform(distribution["low"], distribution["high"])
+    if kind == "lognormal":
+        return random.lognormvariate(0, distribution["sigma"]) * distribution["median"]
+    if kind == "exponential":
+        return random.expovariate(1 / distribution["mean"])
+    raise ValueError(f"Unknown latency distribution {kind} of service {service}")
+
+
+def payload(service: str, seed: str) -> bytes:
+    # Deterministic filler, so identical inputs give identical outputs
+    size = profile[service]["response_bytes"]
+    block = hashlib.sha256(seed.encode()).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+async def digest_upload(audio: UploadFile) -> str:
+    sha256 = hashlib.sha256()
+    while chunk := await audio.read(1024 * 1024):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@app.get("/{service}/docs")
+async def health(service: str):
+    # Route of the orchestrator health checks
+    return {"service": service}
+
+
+@app.post("/youtube-downloader/process")
+async def youtube_downloader(url: str):
+    await asyncio.sleep(latency("youtube-downloader"))
+    return Response(payload("youtube-downloader", url), media_type="audio/mpeg")
+
+
+@app.post("/whisper/process")
+async def whisper(audio: UploadFile = File(...)):
+    digest = await digest_upload(audio)
+    await asyncio.sleep(latency("whisper"))
+    lyrics = f"lyrics {digest} " + payload("whisper", digest).hex()
+    return lyrics[:max(profile["whisper"]["response_bytes"], len(digest) + 7)]
+
+
+@app.post("/genre-detection/process")
+async def genre_detection(audio: UploadFile = File(...)):
+    digest = await digest_upload(audio)
+    await asyncio.sleep(latency("genre-detection"))
+    genres = {genre: int(digest[2 * i:2 * i + 2], 16) / 255 for i, genre in enumerate(GENRES)}
+    return {"genre_top": max(genres, key=genres.get), "genres": genres, "windows_used": 1}
+
+
+@app.post("/sentiment-analysis/process")
+async def sentiment_analysis(request: Request):
+    text = (await request.json())["text"]
+    await asyncio.sleep(latency("sentiment-analysis"))
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    # The top words make the image prompts, and so the art-generation cache keys, differ per song
+    return {"language": "en", "sentiments": {"joy": 0.5, "sadness": 0.25, "others": 0.25},
+            "top_words": [digest[i:i + 8] for i in range(0, 64, 8)]}
+
+
+@app.post("/art-generation/process")
+async def art_generation(request: Request):
+    body = await request.body()
+    await asyncio.sleep(latency("art-generation"))
+    seed = hashlib.sha256(body).hexdigest()
+    images = payload("art-generation", seed)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED) as zip_file:
+        third = len(images) // 3
+        for i in range(3):
+            zip_file.writestr(f"images/image{i}.png", images[i * third:(i + 1) * third])
+    headers = {"prompt": seed, "negative_prompts": "", "model_ids": "[]"}
+    return Response(archive.getvalue(), media_type="application/zip", headers=headers)
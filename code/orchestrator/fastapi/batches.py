@@ -0,0 +1,122 @@
+"""
+Batches of pipelines submitted together, e.g. the tracks of an album.
+"""
+
+import os
+import re
+import shutil
+import zipfile
+from models import BatchInformation, BatchItem, Pipeline, PipelineStatus
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Statuses of the pipelines having produced their images
+RESULT_STATUSES = (PipelineStatus.RESULT_READY, PipelineStatus.FINISHED)
+
+
+class BatchIndex:
+    """
+    Pipeline ids of each batch, in submission order. Registered as an observer of the registry,
+    so the batches are rebuilt with the pipelines when they are recovered from the journal.
+    """
+
+    def __init__(self):
+        self.batches: dict[str, list[str]] = {}
+        self.batch_by_pipeline: dict[str, str] = {}
+
+    def record(self, pipeline: Pipeline):
+        pipeline_id = pipeline.informations.id
+        if pipeline.batch_id is not None and pipeline_id not in self.batch_by_pipeline:
+            self.batches.setdefault(pipeline.batch_id, []).append(pipeline_id)
+            self.batch_by_pipeline[pipeline_id] = pipeline.batch_id
+
+    def forget(self, pipeline_id: str):
+        batch_id = self.batch_by_pipeline.pop(pipeline_id, None)
+        if batch_id is not None:
+            self.batches[batch_id].remove(pipeline_id)
+            if not self.batches[batch_id]:
+                del self.batches[batch_id]
+
+    def get(self, batch_id: str) -> list[str] | None:
+        """
+        The pipelines of a batch.
+        :param batch_id: the id of the batch
+        :type batch_id: str
+        :return: the ids of the pipelines, None if the batch is unknown or all its pipelines were removed
+        :rtype: list[str] | None
+        """
+        pipeline_ids = self.batches.get(batch_id)
+        return list(pipeline_ids) if pipeline_ids is not None else None
+
+
+def batch_information(batch_id: str, pipelines: list[Pipeline], steps: int) -> BatchInformation:
+    """
+    Aggregate the progress of the pipelines of a batch.
+    :param batch_id: the id of the batch
+    :type batch_id: str
+    :param pipelines: the pipelines of the batch
+    :type pipelines: list[Pipeline]
+    :param steps: the number of steps of a pipeline
+    :type steps: int
+    :return: the state of the batch
+    :rtype: BatchInformation
+    """
+    counts = {}
+    done = 0
+    items = []
+    for pipeline in pipelines:
+        status = pipeline.informations.status
+        counts[status.value] = counts.get(status.value, 0) + 1
+        ended = status in RESULT_STATUSES or status == PipelineStatus.FAILED
+        done += steps if ended else min(len(pipeline.stage_results), steps)
+        items += [
+            BatchItem(index=item["index"], name=item["name"], pipeline_id=pipeline.informations.id, status=status)
+            for item in pipeline.batch_items
+        ]
+
+    if any(pipeline.informations.status not in RESULT_STATUSES + (PipelineStatus.FAILED,) for pipeline in pipelines):
+        status = "running"
+    elif any(pipeline.informations.status in RESULT_STATUSES for pipeline in pipelines):
+        status = PipelineStatus.RESULT_READY.value
+    else:
+        status = PipelineStatus.FAILED.value
+
+    return BatchInformation(
+        id=batch_id,
+        status=status,
+        progress=done / (steps * len(pipelines)) if pipelines else 1.0,
+        counts=counts,
+        items=sorted(items, key=lambda item: item.index),
+    )
+
+
+def _folder_name(item: BatchItem) -> str:
+    # Number the folders in submission order, keeping only the safe characters of the item name
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", os.path.basename(item.name.rstrip("/")))[:64]
+    return f"{item.index:03d}_{name}"
+
+
+def write_batch_archive(information: BatchInformation, pipelines: dict, path: str):
+    """
+    Write one archive holding the images of every item of a batch, one folder per item, and the
+    state of the batch in `batch.json`. The images are already compressed, so they are stored as is.
+    :param information: the state of the batch
+    :type information: BatchInformation
+    :param pipelines: the pipelines of the batch, by id
+    :type pipelines: dict[str, Pipeline]
+    :param path: the path of the archive
+    :type path: str
+    """
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as archive:
+        archive.writestr("batch.json", information.json(indent=2))
+        for item in information.items:
+            pipeline = pipelines[item.pipeline_id]
+            if item.status not in RESULT_STATUSES or not pipeline.result_path:
+                continue
+            with zipfile.ZipFile(pipeline.result_path) as images:
+                for entry in images.infolist():
+                    if entry.is_dir():
+                        continue
+                    name = f"{_folder_name(item)}/{entry.filename}"
+                    with images.open(entry) as source, archive.open(name, "w") as target:
+                        shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
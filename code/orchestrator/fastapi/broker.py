@@ -0,0 +1,133 @@
+"""
+Publish/subscribe broker of the progress events of the pipelines.
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Events of a pipeline delivered to a single subscriber, through a bounded queue.
+    """
+
+    def __init__(self, pipeline_id: str, max_pending: int):
+        """
+        Constructor.
+        :param pipeline_id: the id of the pipeline
+        :type pipeline_id: str
+        :param max_pending: the number of events the subscriber may lag behind before being dropped
+        :type max_pending: int
+        """
+        self.pipeline_id = pipeline_id
+        self.queue: asyncio.Queue = asyncio.Queue(max_pending)
+
+    def _deliver(self, event: dict | None) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def _close(self):
+        # Wake up the subscriber, dropping an event if needed since it will not read them anyway
+        if not self._deliver(None):
+            self.queue.get_nowait()
+            self._deliver(None)
+
+    async def get(self) -> dict | None:
+        """
+        Wait for the next event.
+        :return: the event, None once the subscription is closed
+        :rtype: dict | None
+        """
+        return await self.queue.get()
+
+
+class ProgressBroker:
+    """
+    Keeps the last events of each pipeline, numbered by a per-pipeline sequence number, and fans them
+    out to any number of subscribers. Publishing never waits: a subscriber lagging more than its queue
+    allows is closed, and can subscribe again to replay the events it missed from the log.
+    The log and the sequence numbers only live in memory, so the events also hold the epoch of the broker,
+    which changes when the orchestrator restarts: a subscriber giving the epoch of another broker gets the
+    whole log, whatever its last sequence number.
+    """
+
+    def __init__(self, log_size: int, max_pending: int):
+        """
+        Constructor.
+        :param log_size: the number of events kept per pipeline for the replays
+        :type log_size: int
+        :param max_pending: the number of events a subscriber may lag behind before being dropped
+        :type max_pending: int
+        """
+        self.log_size = log_size
+        self.max_pending = max_pending
+        self.logs: dict[str, deque] = {}
+        self.sequences: dict[str, int] = {}
+        self.subscriptions: dict[str, set[Subscription]] = {}
+        self.epoch = uuid.uuid4().hex
+
+    def publish(self, pipeline_id: str, message: dict):
+        """
+        Add an event to the log of a pipeline and send it to its subscribers.
+        :param pipeline_id: the id of the pipeline
+        :type pipeline_id: str
+        :param message: the content of the event, the `seq` and `epoch` keys are added to it
+        :type message: dict
+        """
+        sequence = self.sequences.get(pipeline_id, 0) + 1
+        self.sequences[pipeline_id] = sequence
+        event = {**message, "seq": sequence, "epoch": self.epoch}
+        self.logs.setdefault(pipeline_id, deque(maxlen=self.log_size)).append(event)
+        for subscription in list(self.subscriptions.get(pipeline_id, ())):
+            if not subscription._deliver(event):
+                logger.warning(f"Dropping a slow subscriber of pipeline {pipeline_id}")
+                self.unsubscribe(subscription)
+                subscription._close()
+
+    def subscribe(self, pipeline_id: str, last_seq: int = 0, epoch: str | None = None) -> Subscription:
+        """
+        Subscribe to the events of a pipeline, starting with the logged events following `last_seq`.
+        :param pipeline_id: the id of the pipeline
+        :type pipeline_id: str
+        :param last_seq: the sequence number of the last event already received, 0 to replay the whole log
+        :type last_seq: int
+        :param epoch: the epoch of the last event already received, None if unknown
+        :type epoch: str | None
+        :return: the subscription
+        :rtype: Subscription
+        """
+        if epoch is not None and epoch != self.epoch:
+            # The sequence numbers started again since the last event received
+            last_seq = 0
+        replay = [event for event in self.logs.get(pipeline_id, ()) if event["seq"] > last_seq]
+        # The replayed events do not count as lag
+        subscription = Subscription(pipeline_id, self.max_pending + len(replay))
+        for event in replay:
+            subscription._deliver(event)
+        self.subscriptions.setdefault(pipeline_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self.subscriptions.get(subscription.pipeline_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscriptions[subscription.pipeline_id]
+
+    def close(self, pipeline_id: str):
+        """
+        Drop the log of a removed pipeline and close its subscriptions.
+        :param pipeline_id: the id of the pipeline
+        :type pipeline_id: str
+        """
+        self.logs.pop(pipeline_id, None)
+        self.sequences.pop(pipeline_id, None)
+        for subscription in self.subscriptions.pop(pipeline_id, ()):
+            subscription._close()
@@ -0,0 +1,205 @@
+"""
+Content-addressed on-disk cache of the results of the pipeline stages.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_key(*parts) -> str:
+    """
+    Hash the given parts into a cache key.
+    :return: the hexadecimal SHA-256 digest of the parts
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """
+    Hash the content of a file, reading it by chunks.
+    :param path: path to the file
+    :type path: str
+    :return: the hexadecimal SHA-256 digest of the file
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source: str, destination: str):
+    """
+    Hard link a file to a new path, copy it if the file system does not support links.
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ResultCache:
+    """
+    Size-bounded directory of cache entries with least recently used eviction, and optionally
+    a time to live. Entries are grouped by stage, each stage having its own hit and miss counters.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float | None = None):
+        """
+        Constructor.
+        :param directory: the directory holding the entries
+        :type directory: str
+        :param max_bytes: the maximum total size of the entries
+        :type max_bytes: int
+        :param ttl: the time (in seconds) after which an entry expires, None to keep entries until evicted
+        :type ttl: float | None
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        # Entry file name -> size, least recently used first
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        # Entry file name -> time it was stored (the last access time for entries found on startup)
+        self.stored_at: dict[str, float] = {}
+        self.size = 0
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        files = [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith("tmp")]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self.entries[entry.name] = entry.stat().st_size
+            self.stored_at[entry.name] = entry.stat().st_mtime
+            self.size += entry.stat().st_size
+
+    def _name(self, stage: str, key: str, extension: str) -> str:
+        return f"{stage}-{key}.{extension}"
+
+    def _remove(self, name: str):
+        os.remove(os.path.join(self.directory, name))
+        self.size -= self.entries.pop(name)
+        del self.stored_at[name]
+
+    def _expired(self, name: str) -> bool:
+        return self.ttl is not None and time.time() - self.stored_at[name] > self.ttl
+
+    def _lookup(self, stage: str, name: str) -> str | None:
+        with self.lock:
+            if name in self.entries and self._expired(name):
+                self._remove(name)
+            if name not in self.entries:
+                self.misses[stage] = self.misses.get(stage, 0) + 1
+                return None
+            self.hits[stage] = self.hits.get(stage, 0) + 1
+            self.entries.move_to_end(name)
+            path = os.path.join(self.directory, name)
+            # Keep the recency on disk so the order survives a restart
+            os.utime(path)
+            return path
+
+    def _store(self, name: str, temporary_path: str):
+        size = os.path.getsize(temporary_path)
+        os.replace(temporary_path, os.path.join(self.directory, name))
+        with self.lock:
+            self.size += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+            self.stored_at[name] = time.time()
+            if self.ttl is not None:
+                for expired in [entry for entry in self.entries if self._expired(entry)]:
+                    self._remove(expired)
+                    self.evictions += 1
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def get_json(self, stage: str, key: str):
+        """
+        Get the JSON result of a stage.
+        :return: the cached value, None on a miss
+        """
+        path = self._lookup(stage, self._name(stage, key, "json"))
+        if path is None:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def put_json(self, stage: str, key: str, value):
+        with NamedTemporaryFile("w", dir=self.directory, delete=False) as f:
+            json.dump(value, f)
+        self._store(self._name(stage, key, "json"), f.name)
+
+    def get_file(self, stage: str, key: str, extension: str) -> str | None:
+        """
+        Get the path of a file produced by a stage. The file must be linked or copied
+        before being handed out, as the entry can be evicted at any time.
+        :return: the path of the cached file, None on a miss
+        :rtype: str | None
+        """
+        return self._lookup(stage, self._name(stage, key, extension))
+
+    def contains(self, stage: str, key: str, extension: str) -> bool:
+        """
+        Check whether an entry is cached, without counting a hit or a miss nor refreshing the entry.
+        """
+        name = self._name(stage, key, extension)
+        with self.lock:
+            return name in self.entries and not self._expired(name)
+
+    def peek_file(self, stage: str, key: str, extension: str) -> str | None:
+        """
+        Get the path of a cached file, without counting a hit or a miss nor refreshing the entry.
+        The file can be evicted at any time.
+        :return: the path of the cached file, None if it is not cached
+        :rtype: str | None
+        """
+        if not self.contains(stage, key, extension):
+            return None
+        return os.path.join(self.directory, self._name(stage, key, extension))
+
+    def peek_json(self, stage: str, key: str):
+        """
+        Get the JSON result of a stage, without counting a hit or a miss nor refreshing the entry.
+        :return: the cached value, None if it is not cached
+        """
+        path = self.peek_file(stage, key, "json")
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # Evicted meanwhile
+            return None
+
+    def put_file(self, stage: str, key: str, extension: str, path: str):
+        temporary_path = os.path.join(self.directory, f"tmp{uuid.uuid4().hex}")
+        link_or_copy(path, temporary_path)
+        self._store(self._name(stage, key, extension), temporary_path)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "max_size": self.max_bytes,
+                "evictions": self.evictions,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+            }
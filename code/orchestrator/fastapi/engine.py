@@ -0,0 +1,124 @@
+"""
+Pipeline execution engine of the orchestrator.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from models import Pipeline, PipelineStatus
+from registry import PipelineRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineEngine:
+    """
+    Pool of asyncio workers running the WAITING pipelines of the registry on the application's
+    event loop. Workers claim pipelines from the registry, so a pipeline is never executed twice.
+    """
+
+    # Weight of the last execution in the average duration of the pipelines
+    DURATION_SMOOTHING = 0.2
+
+    def __init__(self, run, fail, registry: PipelineRegistry, max_concurrent_pipelines: int,
+                 initial_duration_estimate: float):
+        """
+        Constructor.
+        :param run: coroutine function executing a single pipeline
+        :type run: Callable[[Pipeline], Awaitable[None]]
+        :param fail: coroutine function marking a pipeline as FAILED after `run` raised an unexpected exception
+        :type fail: Callable[[Pipeline, Exception], Awaitable[None]]
+        :param registry: the registry holding the pipelines
+        :type registry: PipelineRegistry
+        :param max_concurrent_pipelines: the number of pipelines executed at the same time
+        :type max_concurrent_pipelines: int
+        :param initial_duration_estimate: the duration (in seconds) of a pipeline assumed before the first one ends
+        :type initial_duration_estimate: float
+        """
+        self.run = run
+        self.fail = fail
+        self.registry = registry
+        self.max_concurrent_pipelines = max_concurrent_pipelines
+        # One token per submission, waking up an idle worker
+        self.wakeups: asyncio.Queue = asyncio.Queue()
+        self.workers: list[asyncio.Task] = []
+        self.busy_workers = 0
+        # Exponentially weighted moving average of the execution time of the pipelines
+        self.average_duration = initial_duration_estimate
+
+    def start(self):
+        """
+        Start the workers. Must be called from the running event loop.
+        """
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent_pipelines)]
+        logger.info(f"Pipeline engine started with {self.max_concurrent_pipelines} workers")
+
+    async def stop(self):
+        """
+        Cancel the workers and wait for them to exit.
+        """
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def submit(self, pipeline: Pipeline):
+        """
+        Mark a pipeline as WAITING and wake up a worker to execute it.
+        :param pipeline: the pipeline to execute
+        :type pipeline: Pipeline
+        """
+        self.registry.set_status(pipeline, PipelineStatus.WAITING)
+        self.notify()
+
+    def notify(self):
+        """
+        Wake up a worker to look for WAITING pipelines.
+        """
+        self.wakeups.put_nowait(None)
+
+    def estimated_wait(self, queue_position: int) -> float:
+        """
+        Estimate the time before a worker claims a waiting pipeline.
+        :param queue_position: the number of waiting pipelines claimed before this one
+        :type queue_position: int
+        :return: the estimated waiting time (in seconds)
+        :rtype: float
+        """
+        idle_workers = self.max_concurrent_pipelines - self.busy_workers
+        if queue_position < idle_workers:
+            return 0.0
+        # Every round of executions frees all the workers once
+        rounds = (queue_position - idle_workers) // self.max_concurrent_pipelines + 1
+        return rounds * self.average_duration
+
+    def retry_after(self) -> int:
+        """
+        Estimate the time before a pipeline leaves the queue, used to tell rejected clients when to come back.
+        :return: the estimated time (in whole seconds, at least 1)
+        :rtype: int
+        """
+        return max(1, math.ceil(self.average_duration / self.max_concurrent_pipelines))
+
+    async def _worker(self):
+        while True:
+            await self.wakeups.get()
+            pipeline = self.registry.claim()
+            while pipeline is not None:
+                self.busy_workers += 1
+                start = time.monotonic()
+                try:
+                    await self.run(pipeline)
+                except Exception as e:
+                    logger.exception(f"Error while running pipeline {pipeline.informations.id}")
+                    try:
+                        await self.fail(pipeline, e)
+                    except Exception:
+                        logger.exception(f"Error while failing pipeline {pipeline.informations.id}")
+                        self.registry.set_status(pipeline, PipelineStatus.FAILED)
+                finally:
+                    self.busy_workers -= 1
+                    self.registry.release(pipeline.informations.id)
+                self.average_duration += self.DURATION_SMOOTHING * (time.monotonic() - start - self.average_duration)
+                pipeline = self.registry.claim()
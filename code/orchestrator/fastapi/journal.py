@@ -0,0 +1,139 @@
+"""
+Durable journal of the pipelines, used to recover them after a restart of the orchestrator.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from models import Pipeline
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineJournal:
+    """
+    Latest state of each pipeline (status, stage results, file paths) stored in an SQLite database
+    in write-ahead log mode. Changes are buffered in memory, coalesced by pipeline and committed
+    in batches by a background task.
+    """
+
+    def __init__(self, path: str, batch_size: int, flush_interval: float):
+        """
+        Constructor.
+        :param path: path to the database file
+        :type path: str
+        :param batch_size: the number of buffered pipelines triggering an immediate commit
+        :type batch_size: int
+        :param flush_interval: the maximum time (in seconds) a change stays in the buffer
+        :type flush_interval: float
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pipelines (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+        # Pipeline id -> serialized pipeline, None if the pipeline was deleted
+        self.pending: dict[str, str | None] = {}
+        self.batch_ready: asyncio.Event | None = None
+        self.flusher: asyncio.Task | None = None
+        self.commits = 0
+
+    def record(self, pipeline: Pipeline):
+        """
+        Buffer the current state of a pipeline.
+        :param pipeline: the pipeline
+        :type pipeline: Pipeline
+        """
+        self.pending[pipeline.informations.id] = pipeline.json()
+        self._check_batch()
+
+    def forget(self, pipeline_id: str):
+        """
+        Buffer the deletion of a pipeline.
+        :param pipeline_id: the id of the pipeline
+        :type pipeline_id: str
+        """
+        self.pending[pipeline_id] = None
+        self._check_batch()
+
+    def _check_batch(self):
+        if self.batch_ready is not None and len(self.pending) >= self.batch_size:
+            self.batch_ready.set()
+
+    def load(self) -> list[Pipeline]:
+        """
+        Read the pipelines stored in the journal.
+        :return: the pipelines, oldest change first
+        :rtype: list[Pipeline]
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT data FROM pipelines ORDER BY updated_at").fetchall()
+        return [Pipeline.parse_raw(data) for data, in rows]
+
+    def _commit(self, changes: dict):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM pipelines WHERE id = ?",
+                [(pipeline_id,) for pipeline_id, data in changes.items() if data is None],
+            )
+            self.connection.executemany(
+                "INSERT INTO pipelines (id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                [(pipeline_id, data, now) for pipeline_id, data in changes.items() if data is not None],
+            )
+        self.commits += 1
+
+    async def flush(self):
+        """
+        Commit the buffered changes in a single transaction, off the event loop.
+        """
+        if not self.pending:
+            return
+        changes, self.pending = self.pending, {}
+        try:
+            await asyncio.to_thread(self._commit, changes)
+        except sqlite3.Error:
+            # Keep the changes for the next commit, unless they were superseded meanwhile
+            for pipeline_id, data in changes.items():
+                self.pending.setdefault(pipeline_id, data)
+            raise
+
+    def start(self):
+        """
+        Start committing the buffered changes in the background. Must be called from the running event loop.
+        """
+        self.batch_ready = asyncio.Event()
+        self.flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """
+        Stop the background commits, commit the remaining changes and close the database.
+        """
+        if self.flusher is not None:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+        await self.flush()
+        with self.lock:
+            self.connection.close()
+
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            try:
+                await self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"Error while writing the pipeline journal: {e!r}")
@@ -1,18 +1,36 @@
-from enum import Enum
 import os
-from typing import Optional
-import requests
-import time
+from typing import AsyncIterator, List, Optional
+import httpx
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 import uuid
-import threading
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, File, Form, HTTPException, Query, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, FileResponse
-from pydantic import BaseModel
+from fastapi.responses import RedirectResponse, Response
+from starlette.background import BackgroundTask
 from tempfile import NamedTemporaryFile
-import zipfile
-import io
 import asyncio
+import contextlib
+import time
+import functools
+import json
+import logging
+from batches import BatchIndex, batch_information, write_batch_archive
+from broker import ProgressBroker
+from cache import ResultCache, content_key, file_digest, link_or_copy
+from engine import PipelineEngine
+from journal import PipelineJournal
+from metrics import OrchestratorCollector, observe_stage
+from models import (BatchInformation, Pipeline, PipelineInformation, PipelinePriority, PipelineStatus,
+                    PipelineSubmission)
+from registry import PipelineRegistry
+from resilience import CircuitOpenError
+from scheduler import StageError, StageScheduler
+from service_client import ServiceClients
+from sweeper import StorageSweeper, pipeline_files
+from streaming import CHUNK_SIZE, MultipartFileStream, SendfileResponse, iter_upload, write_file
+from tracing import KIND_CLIENT, Tracer, current_span, new_trace_id
+from transcoding import Rendition, TranscodingError, ffmpeg_available, transcode
+from youtube import youtube_video_id
 
 api_description = """
 This service is the orchestrator of the MLodImage project. It is responsible for: 
@@ -59,67 +77,6 @@ async def root():
     return RedirectResponse("/docs", status_code=301)
 
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections = {}
-
-    async def connect(self, websocket: WebSocket, execution_id: str):
-        await websocket.accept()
-        print(f"websocket {execution_id} accepted")
-        self.active_connections[execution_id] = websocket
-
-    async def disconnect(self, execution_id: str):
-        print(f"websocket {execution_id} disconnected")
-        await self.active_connections[execution_id].close()
-        del self.active_connections[execution_id]
-
-    async def send_json(self, message: dict, execution_id: str):
-        await self.active_connections[execution_id].send_json(message)
-
-    async def send_bytes(self, message: bytes, execution_id: str):
-        await self.active_connections[execution_id].send_bytes(message)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
-
-
-manager = ConnectionManager()
-
-
-class PipelineStatus(str, Enum):
-    CREATED = "created"
-    WAITING = "waiting"
-    RUNNING_YOUTUBE_DOWNLOADER = "running_youtube_downloader"
-    RUNNING_WHISPER = "running_whisper"
-    RUNNING_SENTIMENT = "running_sentiment"
-    RUNNING_MUSIC_STYLE = "running_music_style"
-    RUNNING_IMAGE_GENERATION = "running_image_generation"
-    FINISHED = "finished"
-    FAILED = "failed"
-    RESULT_READY = "result_ready"
-
-
-class PipelineInformation(BaseModel):
-    id: str
-    status: PipelineStatus
-    results: dict = {
-        "whisper": None,
-        "sentiment_analysis": None,
-        "music_style": None,
-        "image_generation": None,
-    }
-
-
-class Pipeline(BaseModel):
-    informations: PipelineInformation
-    audio_path: str = None
-    audio_type: str = None
-    result_path: str = None
-    url: str = None
-
-
-pipelines: list[Pipeline] = []
 audio_supported = ["audio/mpeg", "audio/ogg"]
 
 SERVICE_URL_TEMPLATE = "https://{}-mlodimage.kube.isc.heia-fr.ch"
@@ -130,12 +87,113 @@ MUSIC_STYLE_URL = SERVICE_URL_TEMPLATE.format("genre-detection")
 ART_GENERATION_URL = SERVICE_URL_TEMPLATE.format("art-generation")
 SERVICE_ROUTE = "/process"
 
-
-async def save_audio(audio: io.BytesIO, file_type: str):
-    # Save the audio file to the audios folder
+SERVICE_URLS = {
+    "youtube-downloader": YOUTUBE_DOWNLOADER_URL,
+    "whisper": WHISPER_URL,
+    "sentiment-analysis": SENTIMENT_ANALYSIS_URL,
+    "genre-detection": MUSIC_STYLE_URL,
+    "art-generation": ART_GENERATION_URL,
+}
+# Services whose requests can be sent twice without harm, the costly image generation is not retried
+# once it reached the service
+IDEMPOTENT_SERVICES = ("youtube-downloader", "whisper", "sentiment-analysis", "genre-detection")
+
+# Step graph of the pipeline, in the core engine format
+PIPELINE_DESCRIPTION = os.environ.get("PIPELINE_DESCRIPTION", "pipeline.json")
+
+# Models used by the art-generation service, part of the cache key of the generated images
+ART_GENERATION_MODEL_IDS = os.environ.get(
+    "ART_GENERATION_MODEL_IDS",
+    "stabilityai/stable-diffusion-2-base,prompthero/openjourney,./music-cover",
+).split(",")
+
+# Directory and maximum size (in bytes) of the stage results cache
+CACHE_DIR = os.environ.get("CACHE_DIR", "./cache/")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# Directory, maximum size (in bytes) and time to live (in seconds) of the downloaded YouTube audios
+YOUTUBE_AUDIO_DIR = os.environ.get("YOUTUBE_AUDIO_DIR", "./youtube/")
+YOUTUBE_AUDIO_MAX_BYTES = int(os.environ.get("YOUTUBE_AUDIO_MAX_BYTES", str(1024 ** 3)))
+YOUTUBE_AUDIO_TTL = float(os.environ.get("YOUTUBE_AUDIO_TTL", str(24 * 3600)))
+
+# Services receiving a rendition of the audio, transcoded once per pipeline, instead of the uploaded file
+AUDIO_RENDITIONS = [service for service in os.environ.get("AUDIO_RENDITIONS", "whisper,genre-detection").split(",")
+                    if service]
+# Bitrate of the Opus rendition sent to whisper, which resamples every audio to 16 kHz mono
+WHISPER_AUDIO_BITRATE = os.environ.get("WHISPER_AUDIO_BITRATE", "32k")
+# Inference mode of the genre detection service (its INFERENCE_MODE): "center" only reads the window at the
+# center of the audio, "full" and "cascade" read the whole audio
+GENRE_INFERENCE_MODE = os.environ.get("GENRE_INFERENCE_MODE", "center")
+# Window (in milliseconds) at the center of the audio sent to the genre detection service, which must be the
+# audio_duration of its params.yaml in the center mode, 0 to send the whole audio (the only choice in the full
+# and cascade modes). Both settings are checked against the audio format the service publishes
+GENRE_AUDIO_DURATION = int(os.environ.get("GENRE_AUDIO_DURATION",
+                                          "30000" if GENRE_INFERENCE_MODE == "center" else "0"))
+# Time (in seconds) before checking the audio format of the genre detection service again (e.g. after
+# the model was trained with other parameters)
+GENRE_AUDIO_FORMAT_CHECK_INTERVAL = float(os.environ.get("GENRE_AUDIO_FORMAT_CHECK_INTERVAL", "300"))
+
+# Level of the messages logged by the orchestrator modules (e.g. the service clients and the engine)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(levelname)s:%(name)s: %(message)s")
+
+# Path of the pipeline journal, and how its changes are batched
+JOURNAL_PATH = os.environ.get("JOURNAL_PATH", "./journal/pipelines.db")
+JOURNAL_BATCH_SIZE = int(os.environ.get("JOURNAL_BATCH_SIZE", "256"))
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get("JOURNAL_FLUSH_INTERVAL", "0.1"))
+
+# Number of pipelines executed at the same time by the engine
+MAX_CONCURRENT_PIPELINES = int(os.environ.get("MAX_CONCURRENT_PIPELINES", "4"))
+
+# Number of progress events kept per pipeline for the clients connecting late, and number of events
+# a client may lag behind before being disconnected
+PROGRESS_LOG_SIZE = int(os.environ.get("PROGRESS_LOG_SIZE", "64"))
+PROGRESS_MAX_PENDING = int(os.environ.get("PROGRESS_MAX_PENDING", "256"))
+
+# Maximum number of pipelines created or waiting, new ones are refused beyond it
+MAX_QUEUE_DEPTH = int(os.environ.get("MAX_QUEUE_DEPTH", "64"))
+# Duration (in seconds) of a pipeline assumed by the wait estimates until the first one ends
+PIPELINE_DURATION_ESTIMATE = float(os.environ.get("PIPELINE_DURATION_ESTIMATE", "120"))
+
+# Time (in seconds) a pipeline may stay in each status before the sweeper removes it with its files,
+# configured with e.g. PIPELINE_TTL_RESULT_READY. Waiting and running pipelines are never removed.
+# Failed pipelines keep their audio and stage results as long as the results, so they can be retried
+DEFAULT_PIPELINE_TTLS = {
+    PipelineStatus.CREATED: 3600,
+    PipelineStatus.RESULT_READY: 24 * 3600,
+    PipelineStatus.FINISHED: 600,
+    PipelineStatus.FAILED: 24 * 3600,
+}
+PIPELINE_TTLS = {
+    status: float(os.environ.get(f"PIPELINE_TTL_{status.name}", str(ttl)))
+    for status, ttl in DEFAULT_PIPELINE_TTLS.items()
+}
+# Maximum total size (in bytes) of the audios and results folders
+STORAGE_MAX_BYTES = int(os.environ.get("STORAGE_MAX_BYTES", str(10 * 1024 ** 3)))
+# Age (in seconds) after which a file of these folders that no pipeline refers to is removed
+STORAGE_ORPHAN_GRACE = float(os.environ.get("STORAGE_ORPHAN_GRACE", "3600"))
+# Time (in seconds) between two sweeps of the pipelines and of their files
+SWEEPER_INTERVAL = float(os.environ.get("SWEEPER_INTERVAL", "60"))
+
+pipelines = PipelineRegistry()
+# Progress events of the pipelines, sent to their websocket clients
+broker = ProgressBroker(PROGRESS_LOG_SIZE, PROGRESS_MAX_PENDING)
+# Every change of the registry is written to the journal
+journal = PipelineJournal(JOURNAL_PATH, JOURNAL_BATCH_SIZE, JOURNAL_FLUSH_INTERVAL)
+pipelines.observe(journal)
+# Pipelines of each batch, rebuilt from the recovered pipelines after a restart
+batch_index = BatchIndex()
+pipelines.observe(batch_index)
+# Spans of the pipelines, whose context is sent to the services
+tracer = Tracer("orchestrator")
+
+
+async def save_audio(chunks: AsyncIterator[bytes], file_type: str):
+    # Save the audio file to the audios folder, one chunk at a time
     try:
         with NamedTemporaryFile(suffix="." + file_type, dir="./audios/", delete=False) as f:
-            f.write(audio.read())
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
             return f.name
     except Exception as e:
         print(e)
@@ -143,152 +201,564 @@ async def save_audio(audio: io.BytesIO, file_type: str):
 
 
 def delete_pipeline(pipeline_id: str):
-    for pipeline in pipelines:
-        if pipeline.informations.id == pipeline_id:
-            # Delete audio file
-            if pipeline.audio_path:
-                os.remove(pipeline.audio_path)
-            # Delete result file
-            if pipeline.result_path:
-                os.remove(pipeline.result_path)
-            pipelines.remove(pipeline)
-            return
-    return None
-
-
-def get_waiting_pipeline():
-    for pipeline in pipelines:
-        if pipeline.informations.status == PipelineStatus.WAITING:
-            return pipeline
-    return None
+    pipeline = pipelines.remove(pipeline_id)
+    if pipeline is None:
+        return None
+    broker.close(pipeline_id)
+    if pipeline.batch_id is not None and batch_index.get(pipeline.batch_id) is None:
+        broker.close(pipeline.batch_id)
+    # Delete the audio file, its renditions and the result file
+    for path in pipeline_files(pipeline):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def mark_finished(pipeline_id: str):
+    # The pipeline may have been removed while its result was sent
+    pipeline = pipelines.get(pipeline_id)
+    if pipeline is not None and pipeline.informations.status == PipelineStatus.RESULT_READY:
+        pipelines.set_status(pipeline, PipelineStatus.FINISHED)
+
+
+def finish_batch_download(archive_path: str, pipeline_ids: list[str]):
+    os.remove(archive_path)
+    for pipeline_id in pipeline_ids:
+        mark_finished(pipeline_id)
 
 
 def delete_finished_pipelines():
-    for pipeline in pipelines:
-        if pipeline.informations.status == PipelineStatus.FINISHED:
-            delete_pipeline(pipeline.informations.id)
+    # with_status returns a copy, so deleting while iterating is safe
+    for pipeline in pipelines.with_status(PipelineStatus.FINISHED):
+        delete_pipeline(pipeline.informations.id)
+
+
+# Remove the expired pipelines and keep the audios and results folders within their budget
+sweeper = StorageSweeper(pipelines, delete_pipeline, ["./audios/", "./results/"], PIPELINE_TTLS,
+                         STORAGE_MAX_BYTES, STORAGE_ORPHAN_GRACE, SWEEPER_INTERVAL)
 
 
 def get_pipeline_by_id(pipeline_id: str):
-    for pipeline in pipelines:
-        if pipeline.informations.id == pipeline_id:
-            return pipeline
-    return None
+    return pipelines.get(pipeline_id)
+
 
+# Statuses of the running stages, in the order of the pipeline progress
+RUNNING_STATUSES = [PipelineStatus.RUNNING_YOUTUBE_DOWNLOADER, PipelineStatus.RUNNING_WHISPER,
+                    PipelineStatus.RUNNING_SENTIMENT, PipelineStatus.RUNNING_MUSIC_STYLE,
+                    PipelineStatus.RUNNING_IMAGE_GENERATION]
 
-def start_pipeline_thread():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(run_pipeline())
+
+# Update pipeline status, and optionally one of its results, and send it to the client
+async def update_pipeline_status(pipeline: Pipeline, status: PipelineStatus, result_dict_key: str = None,
+                                 result_value=None):
+    current = pipeline.informations.status
+    # Concurrent stages only move the status forward, so the progress shown to the client never goes back
+    if not (status in RUNNING_STATUSES and current in RUNNING_STATUSES
+            and RUNNING_STATUSES.index(status) < RUNNING_STATUSES.index(current)):
+        pipelines.set_status(pipeline, status)
+    if result_dict_key is None:
+        publish_pipeline(pipeline)
+    else:
+        await update_pipeline_result(pipeline, result_dict_key, result_value)
 
 
-# Update pipeline status and send it to the client
-async def update_pipeline_status(pipeline: Pipeline, status: PipelineStatus, result_dict_key: str, result_value):
+# Update a pipeline result without changing its status and send it to the client
+async def update_pipeline_result(pipeline: Pipeline, result_dict_key: str, result_value):
     pipeline.informations.results[result_dict_key] = result_value
-    pipeline.informations.status = status
-    # find the client websocket with the same id
-    for connection_id, _ in manager.active_connections.items():
-        if connection_id == pipeline.informations.id:
-            await manager.send_json(pipeline.informations.dict(), connection_id)
-            return
+    pipelines.changed(pipeline)
+    publish_pipeline(pipeline)
+
+
+def publish_pipeline(pipeline: Pipeline):
+    broker.publish(pipeline.informations.id, pipeline.informations.dict())
+    if pipeline.batch_id is not None:
+        broker.publish(pipeline.batch_id, get_batch_information(pipeline.batch_id).dict())
 
 
-def isResponseOK(response: requests.Response):
+def get_batch_information(batch_id: str):
+    pipeline_ids = batch_index.get(batch_id)
+    if pipeline_ids is None:
+        return None
+    return batch_information(batch_id, [pipelines.get(pipeline_id) for pipeline_id in pipeline_ids],
+                             len(scheduler.steps))
+
+
+def isResponseOK(response: httpx.Response):
     if response.status_code != 200:
         print("Error while calling service", response.status_code, response.content)
         return False
     return True
 
 
-# Execute all the waiting pipelines
-async def run_pipeline():
-    while get_waiting_pipeline() is not None:
-        pipeline = get_waiting_pipeline()
-
-        if pipeline.audio_path is None:
-            # Call youtube-downloader service
-            await update_pipeline_status(pipeline, PipelineStatus.RUNNING_YOUTUBE_DOWNLOADER, "whisper",
-                                         "Downloading audio")
-            print("Calling youtube-downloader service", YOUTUBE_DOWNLOADER_URL + SERVICE_ROUTE)
-            response = requests.post(YOUTUBE_DOWNLOADER_URL + SERVICE_ROUTE, params={"url": pipeline.url})
-            if not isResponseOK(response):
-                await update_pipeline_status(pipeline, PipelineStatus.FAILED, "whisper",
-                                             "Error while downloading audio")
-                continue
-            # Transform response.content to a BinaryIO
-            audio = io.BytesIO(response.content)
-            pipeline.audio_path = await save_audio(audio, "mp3")
+# Results of the stages, keyed by the hash of their inputs
+results_cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+# Audio of the YouTube videos, keyed by video id
+audio_cache = ResultCache(YOUTUBE_AUDIO_DIR, YOUTUBE_AUDIO_MAX_BYTES, ttl=YOUTUBE_AUDIO_TTL)
+
+# Pooled async clients, one per service
+clients = ServiceClients(SERVICE_URLS, IDEMPOTENT_SERVICES)
+
+# Queue depths and service counters are read when the metrics are scraped
+REGISTRY.register(OrchestratorCollector(pipelines, clients))
+
+
+# Call the process route of a service and stream its response, raise a StageError if the call failed
+@contextlib.asynccontextmanager
+async def stream_service(service: str, error_key: str, error_message: str, **kwargs):
+    with tracer.span(f"POST {service}{SERVICE_ROUTE}", kind=KIND_CLIENT, attributes={"service": service}) as span:
+        kwargs["headers"] = {**kwargs.get("headers", {}), "traceparent": span.traceparent}
+        try:
+            async with clients[service].stream(SERVICE_ROUTE, **kwargs) as response:
+                span.set_attribute("http.status_code", response.status_code)
+                if response.status_code != 200:
+                    await response.aread()
+                if not isResponseOK(response):
+                    raise StageError(error_key, error_message)
+                yield response
+                span.set_attribute("http.response_bytes", response.num_bytes_downloaded)
+        except httpx.HTTPError as e:
+            print("Error while calling service", service, repr(e))
+            raise StageError(error_key, error_message)
+        except CircuitOpenError as e:
+            # Fail fast while the service is down
+            print(e)
+            raise StageError(error_key, f"{error_message}: {e}, retry later")
+
+
+# Call the process route of a service and read its response, raise a StageError if the call failed
+async def call_service(service: str, error_key: str, error_message: str, **kwargs):
+    async with stream_service(service, error_key, error_message, **kwargs) as response:
+        await response.aread()
+        return response
+
+
+# Arguments of a service call sending the pipeline's audio file as a streamed multipart body,
+# or the rendition of the audio for the service if it was transcoded
+def audio_upload(pipeline: Pipeline, service: str):
+    rendition = pipeline.renditions.get(service)
+    if rendition is not None and os.path.exists(rendition["path"]):
+        path, audio_type = rendition["path"], rendition["content_type"]
+    else:
+        path, audio_type = pipeline.audio_path, pipeline.audio_type if pipeline.audio_type else "audio/mpeg"
+    body = MultipartFileStream("audio", path, audio_type)
+    return {"content": body, "headers": body.headers}
+
+
+async def run_youtube_downloader(pipeline: Pipeline, results: dict):
+    if pipeline.audio_path is not None:
+        # The audio file was uploaded by the client
+        return pipeline.audio_path
+
+    await update_pipeline_status(pipeline, PipelineStatus.RUNNING_YOUTUBE_DOWNLOADER)
+
+    with observe_stage("youtube-downloader"):
+        # Reuse the audio of a video downloaded recently
+        video_id = youtube_video_id(pipeline.url)
+        cached_audio = audio_cache.get_file("youtube-downloader", video_id, "mp3") if video_id else None
+        if cached_audio is not None:
+            print("Using cached audio for video", video_id)
+            with NamedTemporaryFile(suffix=".mp3", dir="./audios/", delete=False) as f:
+                pipeline.audio_path = f.name
+            os.remove(pipeline.audio_path)
+            link_or_copy(cached_audio, pipeline.audio_path)
             pipeline.audio_type = "audio/mpeg"
+            return pipeline.audio_path
+
+        # Call youtube-downloader service
+        print("Calling youtube-downloader service", YOUTUBE_DOWNLOADER_URL + SERVICE_ROUTE)
+        async with stream_service("youtube-downloader", "whisper", "Error while downloading audio",
+                                  params={"url": pipeline.url}) as response:
+            pipeline.audio_path = await save_audio(response.aiter_bytes(CHUNK_SIZE), "mp3")
+        pipeline.audio_type = "audio/mpeg"
+        if video_id is not None:
+            await asyncio.to_thread(audio_cache.put_file, "youtube-downloader", video_id, "mp3", pipeline.audio_path)
+        return pipeline.audio_path
+
+
+# Format of the audio read by each service
+RENDITIONS = {
+    # Whisper downmixes and resamples every audio with ffmpeg too
+    "whisper": Rendition(".ogg", "audio/ogg", ["-c:a", "libopus", "-b:a", WHISPER_AUDIO_BITRATE], 16000, 1),
+    # Lossless, at the rate and channels of the audio: the service converts them like the training samples
+    "genre-detection": Rendition(".flac", "audio/flac", ["-c:a", "flac"],
+                                 window=GENRE_AUDIO_DURATION / 1000 or None),
+}
+GENRE_AUDIO_FORMAT_ROUTE = "/audio-format"
+# Time the audio format of the genre detection service was last found to match the settings
+genre_audio_format_checked_at = None
+
+
+# Check that the genre detection service reads the audio sent to it, as its genres are cached by the settings:
+# return False if the service did not tell its audio format, raise a StageError if it does not match
+async def check_genre_audio_format(error_key: str):
+    global genre_audio_format_checked_at
+    now = time.monotonic()
+    checked_at = genre_audio_format_checked_at
+    if checked_at is not None and now - checked_at < GENRE_AUDIO_FORMAT_CHECK_INTERVAL:
+        return True
+    try:
+        async with clients["genre-detection"].stream(GENRE_AUDIO_FORMAT_ROUTE, method="GET") as response:
+            await response.aread()
+        response.raise_for_status()
+        audio_format = response.json()
+    except (httpx.HTTPError, CircuitOpenError, ValueError) as e:
+        print("Could not get the audio format of the genre detection service:", repr(e))
+        return False
+    window, inference_mode = audio_format["window"], audio_format["inference_mode"]
+    if inference_mode != GENRE_INFERENCE_MODE or GENRE_AUDIO_DURATION not in (0, window):
+        message = (f"The genre detection service reads a {window} ms window in {inference_mode} mode, not a "
+                   f"{GENRE_AUDIO_DURATION} ms window in {GENRE_INFERENCE_MODE} mode: set GENRE_INFERENCE_MODE "
+                   f"and GENRE_AUDIO_DURATION accordingly")
+        print("Error:", message)
+        raise StageError(error_key, message)
+    genre_audio_format_checked_at = now
+    return True
+
+
+# The genre also depends on the part of the audio sent and on the windows the service reads from it
+def audio_result_key(service: str, digest: str):
+    if service == "genre-detection":
+        return content_key(digest, GENRE_INFERENCE_MODE, GENRE_AUDIO_DURATION)
+    return content_key(digest)
+
+
+async def run_audio_ingest(pipeline: Pipeline, results: dict):
+    # Transcode the audio once, for the services whose result is not cached
+    digest = await get_audio_digest(pipeline)
+    renditions = {service: RENDITIONS[service] for service in AUDIO_RENDITIONS
+                  if not results_cache.contains(service, audio_result_key(service, digest), "json")}
+    if not renditions or not ffmpeg_available():
+        return []
+    if "genre-detection" in renditions and not await check_genre_audio_format("music_style"):
+        # The service cuts the original audio itself
+        del renditions["genre-detection"]
+        if not renditions:
+            return []
+
+    with observe_stage("audio-ingest"):
+        try:
+            pipeline.renditions = await transcode(pipeline.audio_path, renditions, "./audios/")
+        except TranscodingError as e:
+            # The services also read the original audio
+            print("Error while transcoding audio, sending the original file:", e)
+            return []
+    return sorted(pipeline.renditions)
+
+
+async def get_audio_digest(pipeline: Pipeline):
+    # Hash of the audio file, computed once per pipeline
+    if pipeline.audio_digest is None:
+        pipeline.audio_digest = await asyncio.to_thread(file_digest, pipeline.audio_path)
+    return pipeline.audio_digest
+
+
+# Computations running, by stage and cache key
+computations: dict[tuple, asyncio.Future] = {}
+
+
+# Run a computation, or wait for the identical one already running (e.g. for two tracks of a batch)
+async def single_flight(stage: str, key: str, compute):
+    while (running := computations.get((stage, key))) is not None:
+        try:
+            print("Waiting for the running computation of", stage)
+            current_span.get().set_attribute("computation.shared", True)
+            return await asyncio.shield(running)
+        except asyncio.CancelledError:
+            # Compute it again if the pipeline running it was cancelled, not this one
+            if not running.cancelled():
+                raise
+
+    future = asyncio.get_running_loop().create_future()
+    computations[(stage, key)] = future
+    try:
+        result = await compute()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Retrieved by the waiting pipelines, if any
+        future.exception()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        del computations[(stage, key)]
+
+
+# Return the cached result of a stage, or compute and cache it
+async def cached_result(stage: str, key: str, compute):
+    async def compute_once():
+        result = results_cache.get_json(stage, key)
+        if result is None:
+            result = await compute()
+            await asyncio.to_thread(results_cache.put_json, stage, key, result)
+        else:
+            print("Using cached result for", stage)
+            current_span.get().set_attribute("cache.hit", True)
+        return result
+
+    return await single_flight(stage, key, compute_once)
+
+
+async def run_whisper(pipeline: Pipeline, results: dict):
+    await update_pipeline_status(pipeline, PipelineStatus.RUNNING_WHISPER)
 
+    async def compute():
         # Call whisper service
-        await update_pipeline_status(pipeline, PipelineStatus.RUNNING_WHISPER, "whisper", "Extracting lyrics")
-        audio_file = open(pipeline.audio_path, "rb")
-        audio_file_bytes = audio_file.read()
-        audio_type = pipeline.audio_type if pipeline.audio_type else "audio/mpeg"
         print("Calling whisper service", WHISPER_URL + SERVICE_ROUTE)
-        response = requests.post(WHISPER_URL + SERVICE_ROUTE,
-                                 files={"audio": (pipeline.audio_path, audio_file_bytes, audio_type)})
-        audio_file.close()
-        if not isResponseOK(response):
-            await update_pipeline_status(pipeline, PipelineStatus.FAILED, "whisper", "Error while extracting lyrics")
-            continue
-        lyrics = response.json()
+        response = await call_service("whisper", "whisper", "Error while extracting lyrics",
+                                      **audio_upload(pipeline, "whisper"))
+        return response.json()
 
+    with observe_stage("whisper"):
+        lyrics = await cached_result("whisper", audio_result_key("whisper", await get_audio_digest(pipeline)),
+                                     compute)
+    await update_pipeline_result(pipeline, "whisper", lyrics)
+    return lyrics
+
+
+async def run_sentiment_analysis(pipeline: Pipeline, results: dict):
+    await update_pipeline_status(pipeline, PipelineStatus.RUNNING_SENTIMENT)
+
+    async def compute():
         # Call sentiment-analysis service
-        await update_pipeline_status(pipeline, PipelineStatus.RUNNING_SENTIMENT, "whisper", lyrics)
         print("Calling sentiment-analysis service", SENTIMENT_ANALYSIS_URL + SERVICE_ROUTE)
-        response = requests.post(SENTIMENT_ANALYSIS_URL + SERVICE_ROUTE, json={"text": lyrics})
-        if not isResponseOK(response):
-            await update_pipeline_status(pipeline, PipelineStatus.FAILED, "sentiment_analysis",
-                                         "Error while analyzing lyrics")
-            continue
-        sentiment_analysis = response.json()
+        response = await call_service("sentiment-analysis", "sentiment_analysis", "Error while analyzing lyrics",
+                                      json={"text": results["whisper"]})
+        return response.json()
+
+    with observe_stage("sentiment-analysis"):
+        sentiment_analysis = await cached_result("sentiment-analysis", content_key(results["whisper"]), compute)
+    await update_pipeline_result(pipeline, "sentiment_analysis", sentiment_analysis)
+    return sentiment_analysis
 
+
+async def run_music_style(pipeline: Pipeline, results: dict):
+    await update_pipeline_status(pipeline, PipelineStatus.RUNNING_MUSIC_STYLE)
+
+    async def compute():
+        await check_genre_audio_format("music_style")
         # Call music-style service
-        await update_pipeline_status(pipeline, PipelineStatus.RUNNING_MUSIC_STYLE, "sentiment_analysis",
-                                     sentiment_analysis)
         print("Calling music-style service", MUSIC_STYLE_URL + SERVICE_ROUTE)
-        response = requests.post(MUSIC_STYLE_URL + SERVICE_ROUTE,
-                                 files={"audio": (pipeline.audio_path, audio_file_bytes, audio_type)})
-        if not isResponseOK(response):
-            await update_pipeline_status(pipeline, PipelineStatus.FAILED, "music_style", "Error while analyzing music")
-            continue
-        music_style = response.json()
-
-        # Call image-generation service
-        await update_pipeline_status(pipeline, PipelineStatus.RUNNING_IMAGE_GENERATION, "music_style", music_style)
-        print("Calling image-generation service", ART_GENERATION_URL + SERVICE_ROUTE)
-        image_data = {
-            "lyrics_analysis": sentiment_analysis,
-            "music_style": {
-                "genre_top": music_style["genre_top"],
-            }
+        response = await call_service("genre-detection", "music_style", "Error while analyzing music",
+                                      **audio_upload(pipeline, "genre-detection"))
+        return response.json()
+
+    with observe_stage("genre-detection"):
+        music_style = await cached_result("genre-detection",
+                                          audio_result_key("genre-detection", await get_audio_digest(pipeline)),
+                                          compute)
+    await update_pipeline_result(pipeline, "music_style", music_style)
+    return music_style
+
+
+def art_generation_input(sentiment_analysis, music_style):
+    return {
+        "lyrics_analysis": sentiment_analysis,
+        "music_style": {
+            "genre_top": music_style["genre_top"],
         }
-        response = requests.post(ART_GENERATION_URL + SERVICE_ROUTE, json=image_data)
-        if not isResponseOK(response):
-            await update_pipeline_status(pipeline, PipelineStatus.FAILED, "image_generation",
-                                         "Error while generating images")
-            continue
-
-        response_metadata = {
-            "prompt": response.headers["prompt"],
-            "negative_prompts": response.headers["negative_prompts"],
-            "model_ids": response.headers["model_ids"],
-        }
-        print("Creating zip file with generated images")
-        zip_file_content = response.content
+    }
+
+
+# The images only depend on the prompt inputs and on the models generating them
+def art_generation_key(image_data: dict):
+    return content_key(json.dumps(image_data, sort_keys=True), *ART_GENERATION_MODEL_IDS)
+
 
-        # Save the zip file to disk
-        zf = zipfile.ZipFile(io.BytesIO(zip_file_content))
+async def run_image_generation(pipeline: Pipeline, results: dict):
+    await update_pipeline_status(pipeline, PipelineStatus.RUNNING_IMAGE_GENERATION)
+    image_data = art_generation_input(results["sentiment-analysis"], results["musical-genre-detection"])
+    archive_path = f"results/images_{pipeline.informations.id}.zip"
 
-        # Write zip file to disk
-        archive_path = f"results/images_{pipeline.informations.id}.zip"
-        with zipfile.ZipFile(archive_path, "w") as f:
-            for file in zf.namelist():
-                f.writestr(file, zf.read(file))
+    # Return the metadata of the images and the path of an archive holding them
+    async def generate():
+        cached_archive = results_cache.get_file("art-generation-images", key, "zip")
+        response_metadata = results_cache.get_json("art-generation", key) if cached_archive else None
+        if response_metadata is not None:
+            print("Using cached result for art-generation")
+            link_or_copy(cached_archive, archive_path)
+            return response_metadata, archive_path
 
+        # Call image-generation service
+        print("Calling image-generation service", ART_GENERATION_URL + SERVICE_ROUTE)
+        async with stream_service("art-generation", "image_generation", "Error while generating images",
+                                  json=image_data) as response:
+            response_metadata = {
+                "prompt": response.headers["prompt"],
+                "negative_prompts": response.headers["negative_prompts"],
+                "model_ids": response.headers["model_ids"],
+            }
+            # Write the archive returned by the service as is, timed once the response headers arrived
+            print("Saving zip file with generated images")
+            with observe_stage("result-archive"):
+                await write_file(response.aiter_bytes(CHUNK_SIZE), archive_path)
+
+        await asyncio.to_thread(results_cache.put_file, "art-generation-images", key, "zip", archive_path)
+        await asyncio.to_thread(results_cache.put_json, "art-generation", key, response_metadata)
+        return response_metadata, archive_path
+
+    with observe_stage("art-generation"):
+        key = art_generation_key(image_data)
+        response_metadata, generated_archive = await single_flight("art-generation", key, generate)
+        if generated_archive != archive_path:
+            # The images were generated for another pipeline with the same inputs
+            link_or_copy(generated_archive, archive_path)
         pipeline.result_path = archive_path
-        await update_pipeline_status(pipeline, PipelineStatus.RESULT_READY, "image_generation", response_metadata)
+        return response_metadata
+
+
+# Handler of each step of the pipeline description
+STAGE_HANDLERS = {
+    "youtube-downloader": run_youtube_downloader,
+    "audio-ingest": run_audio_ingest,
+    "whisper": run_whisper,
+    "musical-genre-detection": run_music_style,
+    "sentiment-analysis": run_sentiment_analysis,
+    "album-cover-art-generation": run_image_generation,
+}
+
+scheduler = StageScheduler.from_file(PIPELINE_DESCRIPTION)
+
+
+# Run a stage of a pipeline in its own span
+async def run_stage(identifier: str, pipeline: Pipeline, results: dict):
+    with tracer.span(identifier):
+        return await STAGE_HANDLERS[identifier](pipeline, results)
+
+
+# Execute a single pipeline, called by the engine's workers once the pipeline is claimed
+async def run_pipeline(pipeline: Pipeline):
+    if pipeline.trace_id is None:
+        pipeline.trace_id = new_trace_id()
+    # A recovered pipeline may already be running
+    waiting = pipeline.informations.status == PipelineStatus.WAITING
+    waiting_since = pipelines.entered_at(pipeline.informations.id) if waiting else None
+    attributes = {"pipeline.id": pipeline.informations.id, "pipeline.priority": pipeline.priority.value,
+                  "pipeline.skipped_steps": ",".join(pipeline.stage_results)}
+
+    with tracer.span("pipeline", trace_id=pipeline.trace_id, attributes=attributes, start_time=waiting_since) as span:
+        if waiting:
+            tracer.start_span("queue", start_time=waiting_since).end()
+        handlers = {identifier: functools.partial(run_stage, identifier, pipeline) for identifier in STAGE_HANDLERS}
+        try:
+            # Independent stages (whisper and music style detection) run concurrently
+            # Steps having a result (e.g. before a restart) are skipped
+            await scheduler.run(handlers, pipeline.stage_results, on_step_done=lambda _: pipelines.changed(pipeline))
+        except StageError as e:
+            span.end(error=e)
+            await update_pipeline_status(pipeline, PipelineStatus.FAILED, e.result_key, e.message)
+        else:
+            await update_pipeline_status(pipeline, PipelineStatus.RESULT_READY, "image_generation",
+                                         pipeline.stage_results["album-cover-art-generation"])
+    await asyncio.to_thread(tracer.flush)
+
+
+# Fail a pipeline whose execution raised an unexpected exception, as a failed stage does
+async def fail_pipeline(pipeline: Pipeline, error: Exception):
+    await update_pipeline_status(pipeline, PipelineStatus.FAILED, "image_generation",
+                                 "Unexpected error while running the pipeline")
+
+
+engine = PipelineEngine(run_pipeline, fail_pipeline, pipelines, MAX_CONCURRENT_PIPELINES,
+                        PIPELINE_DURATION_ESTIMATE)
+
+
+# Priority class of a pipeline: high when its images are already cached, so no image generation will run
+async def expected_priority(pipeline: Pipeline):
+    if "album-cover-art-generation" in pipeline.stage_results:
+        return PipelinePriority.HIGH
+
+    if pipeline.audio_path is not None:
+        digest = await get_audio_digest(pipeline)
+    else:
+        # The audio of a recently downloaded video is hashed, but not kept as the pipeline's audio
+        video_id = youtube_video_id(pipeline.url)
+        cached_audio = audio_cache.peek_file("youtube-downloader", video_id, "mp3") if video_id else None
+        if cached_audio is None:
+            return PipelinePriority.NORMAL
+        try:
+            digest = await asyncio.to_thread(file_digest, cached_audio)
+        except FileNotFoundError:
+            return PipelinePriority.NORMAL
+
+    lyrics = results_cache.peek_json("whisper", audio_result_key("whisper", digest))
+    music_style = results_cache.peek_json("genre-detection", audio_result_key("genre-detection", digest))
+    if lyrics is None or music_style is None:
+        return PipelinePriority.NORMAL
+    sentiment_analysis = results_cache.peek_json("sentiment-analysis", content_key(lyrics))
+    if sentiment_analysis is None:
+        return PipelinePriority.NORMAL
+    key = art_generation_key(art_generation_input(sentiment_analysis, music_style))
+    if results_cache.contains("art-generation-images", key, "zip") and results_cache.contains("art-generation", key, "json"):
+        return PipelinePriority.HIGH
+    return PipelinePriority.NORMAL
+
+
+# Refuse a request when the queue is full, telling the client when to retry
+def check_queue_depth(depth: int, new_pipelines: int = 1):
+    if depth + new_pipelines > MAX_QUEUE_DEPTH:
+        raise HTTPException(status_code=429, detail="Too many pipelines waiting, retry later",
+                            headers={"Retry-After": str(engine.retry_after())})
+
+
+# Reload the pipelines of the journal, queue the waiting ones and resume the running ones
+def recover_pipelines():
+    for pipeline in journal.load():
+        pipelines.add(pipeline)
+        if pipeline.informations.status == PipelineStatus.WAITING:
+            engine.notify()
+        elif pipeline.informations.status.value.startswith("running_"):
+            print("Resuming pipeline", pipeline.informations.id, "after", list(pipeline.stage_results))
+            engine.submit(pipeline)
+    print(f"Recovered {len(pipelines)} pipelines from the journal")
+
+
+# Submit a created (or failed) pipeline to the engine in its priority class, which `priority` can only lower
+async def submit(pipeline: Pipeline, priority: Optional[PipelinePriority],
+                 status: PipelineStatus = PipelineStatus.CREATED):
+    classes = list(PipelinePriority)
+    priority_class = await expected_priority(pipeline)
+    # Another request may have submitted the pipeline meanwhile
+    if pipeline.informations.status != status:
+        raise HTTPException(status_code=400, detail="The pipeline was already submitted")
+    pipeline.priority = priority_class
+    if priority is not None and classes.index(priority) > classes.index(pipeline.priority):
+        pipeline.priority = priority
+    engine.submit(pipeline)
+
+    queue_position = pipelines.queue_position(pipeline.informations.id)
+    return PipelineSubmission(
+        id=pipeline.informations.id,
+        status=pipeline.informations.status,
+        results=pipeline.informations.results,
+        priority=pipeline.priority,
+        queue_position=queue_position,
+        estimated_start_time=time.time() + engine.estimated_wait(queue_position),
+    )
+
+
+@app.on_event("startup")
+async def startup_event():
+    journal.start()
+    recover_pipelines()
+    # Start the workers on the application's event loop
+    engine.start()
+    sweeper.start()
+    clients.start_health_checks()
+    if AUDIO_RENDITIONS and not ffmpeg_available():
+        print("ffmpeg not found, the services receive the original audio files")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await sweeper.stop()
+    await engine.stop()
+    await clients.close()
+    await journal.stop()
+    tracer.flush()
 
 
 @app.get("/reload", tags=['Pipeline'])
@@ -296,7 +766,9 @@ async def reload():
     """
     Reload the pipeline list
     """
-    threading.Thread(target=run_pipeline).start()
+    # Pipelines already claimed by a worker are ignored by the engine
+    for _ in range(pipelines.counts()[PipelineStatus.WAITING]):
+        engine.notify()
     return {"message": "Reloaded"}
 
 
@@ -306,8 +778,12 @@ async def create_pipeline(audio: Optional[UploadFile] = File(None), url: Optiona
     Create a new pipeline
     """
 
+    counts = pipelines.counts()
+    check_queue_depth(counts[PipelineStatus.CREATED] + counts[PipelineStatus.WAITING])
+
     # Generate a random id and create a new pipeline
-    pipeline = Pipeline(informations=PipelineInformation(status=PipelineStatus.CREATED, id=str(uuid.uuid4())))
+    pipeline = Pipeline(informations=PipelineInformation(status=PipelineStatus.CREATED, id=str(uuid.uuid4())),
+                        trace_id=new_trace_id())
 
     # Check if audio file or url is given
     if audio is None and url is None:
@@ -325,16 +801,19 @@ async def create_pipeline(audio: Optional[UploadFile] = File(None), url: Optiona
         pipeline.audio_type = audio.content_type
         tmp = audio.filename.split('.')
         file_type = tmp[len(tmp) - 1]
-        pipeline.audio_path = await save_audio(audio.file, file_type)
+        with tracer.span("upload", trace_id=pipeline.trace_id, attributes={"pipeline.id": pipeline.informations.id}):
+            pipeline.audio_path = await save_audio(iter_upload(audio), file_type)
 
-    pipelines.append(pipeline)
+    pipelines.add(pipeline)
     return pipeline.informations
 
 
-@app.get("/run/{pipeline_id}", tags=['Pipeline'])
-async def submit_pipeline(pipeline_id: str):
+@app.get("/run/{pipeline_id}", tags=['Pipeline'], response_model=PipelineSubmission)
+async def submit_pipeline(pipeline_id: str, priority: Optional[PipelinePriority] = None):
     """
-    Submits the pipeline to the pipeline manager
+    Submits the pipeline to the pipeline manager. Pipelines whose images are already cached run first,
+    `priority` can only lower the priority class of the pipeline (e.g. for background jobs).
+    Returns the position of the pipeline in the queue and the estimated time at which it starts
     """
     delete_finished_pipelines()
 
@@ -344,11 +823,42 @@ async def submit_pipeline(pipeline_id: str):
     if pipeline.informations.status != PipelineStatus.CREATED:
         raise HTTPException(status_code=400, detail="The pipeline was already submitted")
 
-    pipeline.informations.status = PipelineStatus.WAITING
+    check_queue_depth(pipelines.counts()[PipelineStatus.WAITING])
+
+    return await submit(pipeline, priority)
+
+
+@app.get("/retry/{pipeline_id}", tags=['Pipeline'], response_model=PipelineSubmission)
+async def retry_pipeline(pipeline_id: str, priority: Optional[PipelinePriority] = None):
+    """
+    Submits a failed pipeline again. The stages which succeeded are not executed again,
+    the pipeline resumes at the first stage without a result (e.g. after a failed image generation,
+    only the images are generated). Returns the same information as /run
+    """
+    pipeline = get_pipeline_by_id(pipeline_id)
+    if pipeline is None:
+        raise HTTPException(status_code=400, detail="Invalid pipeline id")
+    if pipeline.informations.status != PipelineStatus.FAILED:
+        raise HTTPException(status_code=400, detail="Only failed pipelines can be retried")
+
+    audio_needed = any(step not in pipeline.stage_results for step in ("whisper", "musical-genre-detection"))
+    if audio_needed and pipeline.audio_path is not None and not os.path.exists(pipeline.audio_path):
+        if pipeline.url is None:
+            raise HTTPException(status_code=410, detail="The audio file of the pipeline was removed")
+        # Download and transcode the audio again, the results of the other stages do not depend on the file
+        for rendition in pipeline.renditions.values():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(rendition["path"])
+        pipeline.audio_path = None
+        pipeline.audio_digest = None
+        pipeline.renditions = {}
+        pipeline.stage_results.pop("youtube-downloader", None)
+        pipeline.stage_results.pop("audio-ingest", None)
 
-    threading.Thread(target=start_pipeline_thread).start()
+    check_queue_depth(pipelines.counts()[PipelineStatus.WAITING])
 
-    return PipelineInformation(id=pipeline_id, status=PipelineStatus.WAITING)
+    print("Retrying pipeline", pipeline_id, "after", list(pipeline.stage_results))
+    return await submit(pipeline, priority, PipelineStatus.FAILED)
 
 
 @app.get("/status/{pipeline_id}", tags=['Pipeline'])
@@ -375,17 +885,161 @@ async def get_pipeline_result(pipeline_id: str):
     if pipeline.informations.status != PipelineStatus.RESULT_READY:
         raise HTTPException(status_code=400, detail="Pipeline is not finished yet")
 
-    pipeline.informations.status = PipelineStatus.FINISHED
+    # Finished once sent, so the file is not deleted by delete_finished_pipelines while being sent
+    return SendfileResponse(pipeline.result_path, media_type="application/zip", filename=pipeline.result_path,
+                            background=BackgroundTask(mark_finished, pipeline_id))
 
-    return FileResponse(pipeline.result_path, media_type="application/zip", filename=pipeline.result_path)
+
+@app.post("/batch", tags=['Batch'], response_model=BatchInformation)
+async def create_batch(audios: List[UploadFile] = File(None), urls: List[str] = Form(None),
+                       priority: Optional[PipelinePriority] = Form(None)):
+    """
+    Create and submit one pipeline per audio file and URL, e.g. for the tracks of an album or a playlist.
+    Identical audio files and URLs of the same video share a pipeline, and identical stage inputs
+    (lyrics, prompts) are computed once. Returns the batch with its id
+    """
+    audios = audios or []
+    urls = urls or []
+    if not audios and not urls:
+        raise HTTPException(status_code=400, detail="No audio file or url given")
+    if len(audios) + len(urls) > MAX_QUEUE_DEPTH:
+        raise HTTPException(status_code=400, detail=f"A batch cannot have more than {MAX_QUEUE_DEPTH} items")
+    if any(audio.content_type not in audio_supported for audio in audios):
+        raise HTTPException(status_code=400, detail="Invalid audio file given")
+    counts = pipelines.counts()
+    check_queue_depth(counts[PipelineStatus.CREATED] + counts[PipelineStatus.WAITING], len(audios) + len(urls))
+
+    batch_id = str(uuid.uuid4())
+    # Pipeline of each distinct item, by audio digest or video
+    batch_pipelines: dict[str, Pipeline] = {}
+
+    def batch_pipeline(key: str, trace_id: str, **fields):
+        if key not in batch_pipelines:
+            batch_pipelines[key] = Pipeline(
+                informations=PipelineInformation(status=PipelineStatus.CREATED, id=str(uuid.uuid4())),
+                batch_id=batch_id,
+                trace_id=trace_id,
+                **fields,
+            )
+        return batch_pipelines[key]
+
+    for index, audio in enumerate(audios):
+        # Save the audio file to the audio folder, and hash it to find the duplicates
+        trace_id = new_trace_id()
+        with tracer.span("upload", trace_id=trace_id, attributes={"batch.id": batch_id, "batch.index": index}):
+            audio_path = await save_audio(iter_upload(audio), audio.filename.split('.')[-1])
+            audio_digest = await asyncio.to_thread(file_digest, audio_path)
+        pipeline = batch_pipeline(f"audio:{audio_digest}", trace_id, audio_path=audio_path,
+                                  audio_type=audio.content_type, audio_digest=audio_digest)
+        if pipeline.audio_path != audio_path:
+            os.remove(audio_path)
+        pipeline.batch_items.append({"index": index, "name": audio.filename})
+
+    for index, url in enumerate(urls, start=len(audios)):
+        pipeline = batch_pipeline(f"youtube:{youtube_video_id(url) or url}", new_trace_id(), url=url)
+        pipeline.batch_items.append({"index": index, "name": url})
+
+    for pipeline in batch_pipelines.values():
+        pipelines.add(pipeline)
+    for pipeline in batch_pipelines.values():
+        await submit(pipeline, priority)
+    return get_batch_information(batch_id)
+
+
+@app.get("/batch/{batch_id}", tags=['Batch'], response_model=BatchInformation)
+async def get_batch(batch_id: str):
+    """
+    Returns the aggregate progress of a batch and the status of each of its items
+    """
+    information = get_batch_information(batch_id)
+    if information is None:
+        raise HTTPException(status_code=400, detail="Invalid batch id")
+    return information
+
+
+@app.get("/batch/{batch_id}/result", tags=['Batch'])
+async def get_batch_result(batch_id: str):
+    """
+    Returns a zip file with one folder of images per item of the batch, and the state of the batch in batch.json
+    """
+    information = get_batch_information(batch_id)
+    if information is None:
+        raise HTTPException(status_code=400, detail="Invalid batch id")
+    if information.status == "running":
+        raise HTTPException(status_code=400, detail="Batch is not finished yet")
+
+    batch_pipelines = {item.pipeline_id: get_pipeline_by_id(item.pipeline_id) for item in information.items}
+    with NamedTemporaryFile(suffix=".zip", dir="./results/", delete=False) as f:
+        archive_path = f.name
+    await asyncio.to_thread(write_batch_archive, information, batch_pipelines, archive_path)
+
+    # The combined archive is only kept while it is sent, and the pipelines are finished once it is sent, so
+    # their results are not deleted by delete_finished_pipelines while being sent
+    return SendfileResponse(archive_path, media_type="application/zip", filename=f"batch_{batch_id}.zip",
+                            background=BackgroundTask(finish_batch_download, archive_path, list(batch_pipelines)))
 
 
 @app.get("/pipelines", tags=['Pipeline'])
-async def get_pipelines():
+async def get_pipelines(cursor: Optional[int] = None, limit: int = Query(100, ge=1, le=1000)):
+    """
+    Returns a page of pipelines, in creation order. Pass the returned `next_cursor` to get the next page
+    """
+    page, next_cursor = pipelines.page(cursor, limit)
+    return {
+        "pipelines": [pipeline.informations for pipeline in page],
+        "next_cursor": next_cursor,
+    }
+
+
+@app.get("/pipelines/counts", tags=['Pipeline'])
+async def get_pipelines_counts():
+    """
+    Returns the number of pipelines of each status
+    """
+    return pipelines.counts()
+
+
+@app.get("/services/stats", tags=['Services'])
+async def get_services_stats():
+    """
+    Returns the request counters of each service client, and the health and connection pool state of its replicas
+    """
+    return clients.stats()
+
+
+@app.get("/services/breakers", tags=['Services'])
+async def get_services_breakers():
+    """
+    Returns the state of the circuit breaker of each service (closed, open or half_open)
+    """
+    return clients.breakers()
+
+
+@app.get("/cache/stats", tags=['Cache'])
+async def get_cache_stats():
     """
-    Returns a list of all pipelines
+    Returns the size of the stage results and YouTube audio caches, with their hit and miss counters by stage
     """
-    return [pipeline.informations for pipeline in pipelines]
+    return {
+        "results": results_cache.stats(),
+        "youtube_audio": audio_cache.stats(),
+    }
+
+
+@app.get("/storage/stats", tags=['Storage'])
+async def get_storage_stats():
+    """
+    Returns the size of the audios and results folders and the bytes reclaimed by the sweeper
+    """
+    return sweeper.stats()
+
+
+@app.get("/metrics", tags=['Metrics'])
+async def get_metrics():
+    """
+    Returns the metrics of the orchestrator in the Prometheus text format
+    """
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/reset", tags=['Pipeline'])
@@ -393,6 +1047,10 @@ async def reset_pipelines():
     """
     Delete all pipelines and removes all files in the audios and results folder
     """
+    for pipeline in pipelines.values():
+        broker.close(pipeline.informations.id)
+        if pipeline.batch_id is not None:
+            broker.close(pipeline.batch_id)
     pipelines.clear()
     # Remove all files in the audios folder
     for file in os.listdir("./audios/"):
@@ -406,44 +1064,57 @@ async def reset_pipelines():
 
 
 @app.websocket("/ws/{pipeline_id}")
-async def websocket_endpoint(websocket: WebSocket, pipeline_id: str):
+async def websocket_endpoint(websocket: WebSocket, pipeline_id: str, last_seq: int = 0, epoch: Optional[str] = None):
     """
-    Websocket endpoint for the pipeline status
+    Websocket endpoint for the pipeline status, or for the progress of a batch given its id.
+    The events following `last_seq` are replayed first, so a client connecting late or reconnecting does not miss any.
+    A client reconnecting passes the `epoch` of its last event too: the events of an orchestrator which restarted
+    since then are all replayed, their sequence numbers started again
     """
-    pipeline = get_pipeline_by_id(pipeline_id)
-    if pipeline is None:
+    await websocket.accept()
+    if get_pipeline_by_id(pipeline_id) is None and batch_index.get(pipeline_id) is None:
         # Refuse connection
-        await manager.connect(websocket, pipeline_id)
         await websocket.send_json({"error": "Invalid pipeline id"})
         await websocket.close()
         return
 
-    await manager.connect(websocket, pipeline.informations.id)
+    if pipeline_id not in broker.logs:
+        # e.g. a pipeline recovered from the journal after a restart, nothing was published yet
+        pipeline = get_pipeline_by_id(pipeline_id)
+        if pipeline is not None:
+            publish_pipeline(pipeline)
+        else:
+            broker.publish(pipeline_id, get_batch_information(pipeline_id).dict())
+    subscription = broker.subscribe(pipeline_id, last_seq, epoch)
+
+    async def send_events():
+        while (event := await subscription.get()) is not None:
+            await websocket.send_json(event)
+        # The pipeline was removed, or the client was too slow and must reconnect
+        await websocket.close()
+
+    async def receive_messages():
+        with contextlib.suppress(WebSocketDisconnect):
+            while True:
+                await websocket.receive_text()
+
+    tasks = [asyncio.ensure_future(send_events()), asyncio.ensure_future(receive_messages())]
     try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        manager.disconnect(pipeline.informations.id)
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        broker.unsubscribe(subscription)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 if __name__ == "__main__":
     # Create test pipeline
-    pipelines.append(Pipeline(informations=PipelineInformation(id="test", status=PipelineStatus.CREATED),
+    pipelines.add(Pipeline(informations=PipelineInformation(id="test", status=PipelineStatus.CREATED),
                               audio_path="./audios/music.wav"))
     test_pipeline = get_pipeline_by_id("test")
 
     # Run pipeline
-    test_pipeline.informations.status = PipelineStatus.WAITING
-    threading.Thread(target=run_pipeline).start()
-
-    # Wait for pipeline to finish
-    current_status = None
-    while test_pipeline.informations.status != PipelineStatus.RESULT_READY:
-        if test_pipeline.informations.status != current_status:
-            print(test_pipeline.informations.status)
-            current_status = test_pipeline.informations.status
-
-        if test_pipeline.informations.status == PipelineStatus.FAILED:
-            break
-
-        time.sleep(1)
+    pipelines.set_status(test_pipeline, PipelineStatus.WAITING)
+    asyncio.run(run_pipeline(test_pipeline))
+    print(test_pipeline.informations.status)
@@ -0,0 +1,124 @@
+"""
+Prometheus metrics of the orchestrator.
+"""
+
+import contextlib
+import time
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Stages last from a few milliseconds (cache hits) to several minutes (image generation)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_DURATION = Histogram(
+    "mlodimage_stage_duration_seconds",
+    "Duration of the successful executions of each pipeline stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_FAILURES = Counter(
+    "mlodimage_stage_failures_total",
+    "Number of failed executions of each pipeline stage",
+    ["stage"],
+)
+
+SWEEPER_RECLAIMED_BYTES = Counter(
+    "mlodimage_sweeper_reclaimed_bytes",
+    "Number of bytes of pipeline files removed by the sweeper, by reason (ttl, budget, orphan)",
+    ["reason"],
+)
+SWEEPER_REMOVED_PIPELINES = Counter(
+    "mlodimage_sweeper_removed_pipelines",
+    "Number of pipelines removed by the sweeper, by reason (ttl, budget)",
+    ["reason"],
+)
+STORAGE_BYTES = Gauge(
+    "mlodimage_storage_bytes",
+    "Total size of the audio and result files, measured by the last sweep",
+)
+
+
+@contextlib.contextmanager
+def observe_stage(stage: str):
+    """
+    Time the execution of a stage, or count it as failed if it raises an exception.
+    A stage cancelled because another one failed is neither timed nor counted.
+    :param stage: the name of the stage
+    :type stage: str
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.labels(stage).inc()
+        raise
+    STAGE_DURATION.labels(stage).observe(time.perf_counter() - start)
+
+
+class OrchestratorCollector:
+    """
+    Collector reading the queue depths from the pipeline registry and the request counters
+    from the service clients each time the metrics are scraped.
+    """
+
+    def __init__(self, registry, clients):
+        """
+        Constructor.
+        :param registry: the registry holding the pipelines
+        :type registry: PipelineRegistry
+        :param clients: the service clients
+        :type clients: ServiceClients
+        """
+        self.registry = registry
+        self.clients = clients
+
+    def collect(self):
+        pipelines = GaugeMetricFamily("mlodimage_pipelines", "Number of pipelines of each status", labels=["status"])
+        for status, count in self.registry.counts().items():
+            pipelines.add_metric([status], count)
+        yield pipelines
+
+        in_flight = GaugeMetricFamily(
+            "mlodimage_service_requests_in_flight", "Number of requests being sent to each service", labels=["service"]
+        )
+        requests = CounterMetricFamily(
+            "mlodimage_service_requests", "Number of requests sent to each service", labels=["service"]
+        )
+        errors = CounterMetricFamily(
+            "mlodimage_service_errors", "Number of requests to each service failing with a transport error",
+            labels=["service"],
+        )
+        retries = CounterMetricFamily(
+            "mlodimage_service_retries", "Number of requests sent again to each service", labels=["service"]
+        )
+        transferred = CounterMetricFamily(
+            "mlodimage_service_bytes", "Number of bytes exchanged with each service", labels=["service", "direction"]
+        )
+        for service, stats in self.clients.stats().items():
+            in_flight.add_metric([service], stats["in_flight"])
+            requests.add_metric([service], stats["requests"])
+            errors.add_metric([service], stats["errors"])
+            retries.add_metric([service], stats["retries"])
+            transferred.add_metric([service, "sent"], stats["bytes_sent"])
+            transferred.add_metric([service, "received"], stats["bytes_received"])
+        yield in_flight
+        yield requests
+        yield errors
+        yield retries
+        yield transferred
+
+        breakers = GaugeMetricFamily(
+            "mlodimage_service_circuit_open", "Whether the circuit breaker of each service rejects requests (1) or not (0)",
+            labels=["service"],
+        )
+        for service, stats in self.clients.breakers().items():
+            breakers.add_metric([service], 0 if stats["state"] == "closed" else 1)
+        yield breakers
+
+        replicas = GaugeMetricFamily(
+            "mlodimage_service_replicas_available",
+            "Number of replicas of each service passing their health checks and not ejected", labels=["service"],
+        )
+        for service, stats in self.clients.stats().items():
+            replicas.add_metric([service], stats["available_replicas"])
+        yield replicas
@@ -0,0 +1,79 @@
+from enum import Enum
+from pydantic import BaseModel
+
+
+class PipelineStatus(str, Enum):
+    CREATED = "created"
+    WAITING = "waiting"
+    RUNNING_YOUTUBE_DOWNLOADER = "running_youtube_downloader"
+    RUNNING_WHISPER = "running_whisper"
+    RUNNING_SENTIMENT = "running_sentiment"
+    RUNNING_MUSIC_STYLE = "running_music_style"
+    RUNNING_IMAGE_GENERATION = "running_image_generation"
+    FINISHED = "finished"
+    FAILED = "failed"
+    RESULT_READY = "result_ready"
+
+
+# Pipelines of a higher priority class leave the WAITING status first
+class PipelinePriority(str, Enum):
+    HIGH = "high"
+    NORMAL = "normal"
+    LOW = "low"
+
+
+class PipelineInformation(BaseModel):
+    id: str
+    status: PipelineStatus
+    results: dict = {
+        "whisper": None,
+        "sentiment_analysis": None,
+        "music_style": None,
+        "image_generation": None,
+    }
+
+
+class PipelineSubmission(PipelineInformation):
+    priority: PipelinePriority
+    # Number of waiting pipelines executed before this one
+    queue_position: int
+    # Estimated time (in seconds since the epoch) at which a worker starts the pipeline
+    estimated_start_time: float
+
+
+class Pipeline(BaseModel):
+    informations: PipelineInformation
+    audio_path: str = None
+    audio_type: str = None
+    result_path: str = None
+    url: str = None
+    # SHA-256 of the audio file, used as cache key of the stages reading it
+    audio_digest: str = None
+    # Renditions of the audio file sent to the services instead of it, by service ("path" and "content_type")
+    renditions: dict = {}
+    # Output of each completed step, by step identifier
+    stage_results: dict = {}
+    priority: PipelinePriority = PipelinePriority.NORMAL
+    # Batch the pipeline belongs to, and the items of the batch it processes (identical items share a pipeline)
+    batch_id: str = None
+    batch_items: list = []
+    # Trace of the uploads and runs of the pipeline
+    trace_id: str = None
+
+
+class BatchItem(BaseModel):
+    index: int
+    name: str
+    pipeline_id: str
+    status: PipelineStatus
+
+
+class BatchInformation(BaseModel):
+    id: str
+    # running until every pipeline ended, then result_ready, or failed if no pipeline succeeded
+    status: str
+    # Fraction of the pipeline steps completed
+    progress: float
+    # Number of pipelines of each status
+    counts: dict
+    items: list[BatchItem]
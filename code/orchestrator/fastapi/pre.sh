@@ -0,0 +1,6 @@
+#!/bin/bash
+
+cd $REPO_ROOT
+
+# The tracing module is shared with the services
+cp code/common/tracing.py code/orchestrator/fastapi/tracing.py
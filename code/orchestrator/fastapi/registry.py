@@ -0,0 +1,245 @@
+"""
+In-memory registry of the pipelines known by the orchestrator.
+"""
+
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from models import Pipeline, PipelinePriority, PipelineStatus
+
+
+class PipelineRegistry:
+    """
+    Pipelines indexed by id, with one FIFO index per status, and one FIFO queue of WAITING
+    pipelines per priority class. Every status change must go through `set_status` so that
+    the indexes and the counters stay consistent.
+    Observers (e.g. the journal) are told about every added, changed and removed pipeline.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.pipelines: dict[str, Pipeline] = {}
+        # Pipeline ids of each status, in the order they entered it, with the time they did
+        self.statuses: dict[PipelineStatus, OrderedDict[str, float]] = {
+            status: OrderedDict() for status in PipelineStatus
+        }
+        # Ids of the WAITING pipelines of each priority class, in the order they entered it
+        self.queues: dict[PipelinePriority, OrderedDict[str, None]] = {
+            priority: OrderedDict() for priority in PipelinePriority
+        }
+        # Pipelines taken by a worker that did not leave the WAITING status yet
+        self.claimed: set[str] = set()
+        # Creation sequence numbers, used as pagination cursors
+        self.sequence_by_id: dict[str, int] = {}
+        self.id_by_sequence: dict[int, str] = {}
+        self.sequences: list[int] = []
+        self.next_sequence = 0
+        # Objects with `record(pipeline)` and `forget(pipeline_id)` methods
+        self.observers = []
+
+    def observe(self, observer):
+        """
+        Register an observer of the changes of the pipelines.
+        :param observer: object with `record(pipeline)` and `forget(pipeline_id)` methods
+        """
+        self.observers.append(observer)
+
+    def __len__(self):
+        return len(self.pipelines)
+
+    def add(self, pipeline: Pipeline):
+        """
+        Register a new pipeline.
+        :param pipeline: the pipeline
+        :type pipeline: Pipeline
+        """
+        with self.lock:
+            pipeline_id = pipeline.informations.id
+            self.pipelines[pipeline_id] = pipeline
+            self.statuses[pipeline.informations.status][pipeline_id] = time.time()
+            if pipeline.informations.status == PipelineStatus.WAITING:
+                self.queues[pipeline.priority][pipeline_id] = None
+            self.sequence_by_id[pipeline_id] = self.next_sequence
+            self.id_by_sequence[self.next_sequence] = pipeline_id
+            self.sequences.append(self.next_sequence)
+            self.next_sequence += 1
+            self.changed(pipeline)
+
+    def get(self, pipeline_id: str) -> Pipeline | None:
+        return self.pipelines.get(pipeline_id)
+
+    def remove(self, pipeline_id: str) -> Pipeline | None:
+        """
+        Unregister a pipeline.
+        :param pipeline_id: the id of the pipeline
+        :type pipeline_id: str
+        :return: the removed pipeline, None if it was unknown
+        :rtype: Pipeline | None
+        """
+        with self.lock:
+            pipeline = self.pipelines.pop(pipeline_id, None)
+            if pipeline is None:
+                return None
+            self.statuses[pipeline.informations.status].pop(pipeline_id, None)
+            self.queues[pipeline.priority].pop(pipeline_id, None)
+            self.claimed.discard(pipeline_id)
+            del self.id_by_sequence[self.sequence_by_id.pop(pipeline_id)]
+            # Drop the sequences of removed pipelines once they outnumber the live ones
+            if len(self.sequences) > 2 * len(self.pipelines) + 64:
+                self.sequences = [sequence for sequence in self.sequences if sequence in self.id_by_sequence]
+            for observer in self.observers:
+                observer.forget(pipeline_id)
+            return pipeline
+
+    def clear(self):
+        with self.lock:
+            for pipeline_id in self.pipelines:
+                for observer in self.observers:
+                    observer.forget(pipeline_id)
+            self.pipelines.clear()
+            for ids in self.statuses.values():
+                ids.clear()
+            for ids in self.queues.values():
+                ids.clear()
+            self.claimed.clear()
+            self.sequence_by_id.clear()
+            self.id_by_sequence.clear()
+            self.sequences.clear()
+
+    def set_status(self, pipeline: Pipeline, status: PipelineStatus):
+        """
+        Change the status of a pipeline.
+        :param pipeline: the pipeline
+        :type pipeline: Pipeline
+        :param status: the new status
+        :type status: PipelineStatus
+        """
+        with self.lock:
+            pipeline_id = pipeline.informations.id
+            self.statuses[pipeline.informations.status].pop(pipeline_id, None)
+            self.queues[pipeline.priority].pop(pipeline_id, None)
+            pipeline.informations.status = status
+            if pipeline_id in self.pipelines:
+                self.statuses[status][pipeline_id] = time.time()
+                if status == PipelineStatus.WAITING:
+                    self.queues[pipeline.priority][pipeline_id] = None
+                self.changed(pipeline)
+
+    def changed(self, pipeline: Pipeline):
+        """
+        Tell the observers that a pipeline was modified.
+        :param pipeline: the pipeline
+        :type pipeline: Pipeline
+        """
+        for observer in self.observers:
+            observer.record(pipeline)
+
+    def with_status(self, status: PipelineStatus) -> list[Pipeline]:
+        """
+        The pipelines having the given status, oldest first.
+        :param status: the status
+        :type status: PipelineStatus
+        :return: the pipelines
+        :rtype: list[Pipeline]
+        """
+        with self.lock:
+            return [self.pipelines[pipeline_id] for pipeline_id in self.statuses[status]]
+
+    def values(self) -> list[Pipeline]:
+        with self.lock:
+            return list(self.pipelines.values())
+
+    def entered(self, status: PipelineStatus) -> list:
+        """
+        The pipelines having the given status with the time they entered it, oldest first.
+        :param status: the status
+        :type status: PipelineStatus
+        :return: the ids of the pipelines and the times they entered the status
+        :rtype: list[Tuple[str, float]]
+        """
+        with self.lock:
+            return list(self.statuses[status].items())
+
+    def entered_at(self, pipeline_id: str) -> float | None:
+        """
+        The time a pipeline entered its current status.
+        :param pipeline_id: the id of the pipeline
+        :type pipeline_id: str
+        :return: the time (in seconds since the epoch), None if the pipeline is unknown
+        :rtype: float | None
+        """
+        with self.lock:
+            pipeline = self.pipelines.get(pipeline_id)
+            return self.statuses[pipeline.informations.status].get(pipeline_id) if pipeline is not None else None
+
+    def counts(self) -> dict:
+        """
+        The number of pipelines of each status.
+        :return: the counters, by status
+        :rtype: dict[str, int]
+        """
+        return {status.value: len(ids) for status, ids in self.statuses.items()}
+
+    def claim(self) -> Pipeline | None:
+        """
+        Take the oldest WAITING pipeline of the highest priority class not already claimed by a worker.
+        :return: the claimed pipeline, None if there is no waiting work
+        :rtype: Pipeline | None
+        """
+        with self.lock:
+            for queue in self.queues.values():
+                for pipeline_id in queue:
+                    if pipeline_id not in self.claimed:
+                        self.claimed.add(pipeline_id)
+                        return self.pipelines[pipeline_id]
+            return None
+
+    def queue_position(self, pipeline_id: str) -> int:
+        """
+        The number of unclaimed WAITING pipelines a worker will claim before the given one.
+        :param pipeline_id: the id of a WAITING pipeline
+        :type pipeline_id: str
+        :return: the position of the pipeline in the queue, 0 if it is the next one
+        :rtype: int
+        """
+        with self.lock:
+            position = 0
+            for queue in self.queues.values():
+                for queued_id in queue:
+                    if queued_id == pipeline_id:
+                        return position
+                    if queued_id not in self.claimed:
+                        position += 1
+            return position
+
+    def release(self, pipeline_id: str):
+        """
+        Release a pipeline claimed with `claim`, once its execution is over.
+        :param pipeline_id: the id of the pipeline
+        :type pipeline_id: str
+        """
+        with self.lock:
+            self.claimed.discard(pipeline_id)
+
+    def page(self, cursor: int | None, limit: int):
+        """
+        A page of pipelines in creation order.
+        :param cursor: the cursor returned with the previous page, None for the first page
+        :type cursor: int | None
+        :param limit: the maximum number of pipelines in the page
+        :type limit: int
+        :return: the pipelines and the cursor of the next page (None on the last page)
+        :rtype: Tuple[list[Pipeline], int | None]
+        """
+        with self.lock:
+            start = 0 if cursor is None else bisect.bisect_right(self.sequences, cursor)
+            page = []
+            for index in range(start, len(self.sequences)):
+                pipeline_id = self.id_by_sequence.get(self.sequences[index])
+                if pipeline_id is None:
+                    continue
+                if len(page) == limit:
+                    return page, self.sequence_by_id[page[-1].informations.id]
+                page.append(self.pipelines[pipeline_id])
+            return page, None
@@ -0,0 +1,141 @@
+"""
+Retry policies and circuit breakers protecting the calls to the services.
+"""
+
+import logging
+import random
+import time
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Errors after which an idempotent request can be sent again: the service did not process it, or its
+# connection broke, maybe while processing it
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.WriteError,
+                    httpx.RemoteProtocolError)
+# Errors after which any request can be sent again: the request never reached the service
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+# Statuses of the proxies and services unavailable for a moment
+RETRYABLE_STATUSES = (502, 503, 504)
+# Statuses after which any request can be sent again: after a gateway timeout, the service may still be
+# processing the request
+UNPROCESSED_STATUSES = (502, 503)
+
+
+class RetryPolicy:
+    """
+    Number of retries of a request and exponential backoff between them, with full jitter so the
+    retries of concurrent pipelines do not hit a recovering service at the same time.
+    """
+
+    def __init__(self, retries: int, base_backoff: float, max_backoff: float):
+        """
+        Constructor.
+        :param retries: the number of times a failed request is sent again
+        :type retries: int
+        :param base_backoff: the maximum delay (in seconds) before the first retry, doubled at each retry
+        :type base_backoff: float
+        :param max_backoff: the maximum delay (in seconds) before a retry
+        :type max_backoff: float
+        """
+        self.retries = retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    def backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        """
+        The delay before retrying a request.
+        :param attempt: the number of the failed attempt, starting at 0
+        :type attempt: int
+        :param retry_after: the Retry-After header of the failed response, if any
+        :type retry_after: str | None
+        :return: the delay (in seconds)
+        :rtype: float
+        """
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request to a service considered down.
+    """
+
+    def __init__(self, service: str, retry_at: float):
+        super().__init__(f"Service {service} is unavailable")
+        self.service = service
+        self.retry_at = retry_at
+
+
+class CircuitBreaker:
+    """
+    Counts the consecutive failures of a service. Once they reach the threshold the circuit opens and
+    requests fail immediately. After the reset timeout a single probe request is let through
+    (half-open): the circuit closes if it succeeds and opens again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, service: str, failure_threshold: int, reset_timeout: float):
+        """
+        Constructor.
+        :param service: the name of the service
+        :type service: str
+        :param failure_threshold: the number of consecutive failures opening the circuit
+        :type failure_threshold: int
+        :param reset_timeout: the time (in seconds) the circuit stays open before a probe request
+        :type reset_timeout: float
+        """
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probe_started_at: float | None = None
+        self.rejected = 0
+
+    def before_request(self):
+        """
+        Check that a request may be sent.
+        :raise CircuitOpenError: if the circuit is open, or half-open with a probe in flight
+        """
+        now = time.monotonic()
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        # A probe that never reported (e.g. cancelled) is replaced after the reset timeout
+        if self.state == self.HALF_OPEN and (self.probe_started_at is None
+                                             or now - self.probe_started_at >= self.reset_timeout):
+            self.probe_started_at = now
+            return
+        self.rejected += 1
+        since = now - (self.probe_started_at or self.opened_at)
+        raise CircuitOpenError(self.service, time.time() + max(0.0, self.reset_timeout - since))
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit of service {self.service} opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probe_started_at = None
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected_requests": self.rejected,
+            "open_for": time.monotonic() - self.opened_at if self.opened_at is not None else None,
+        }
@@ -0,0 +1,102 @@
+"""
+Stage scheduler running the steps of a pipeline as soon as their dependencies are done.
+"""
+
+import asyncio
+import json
+
+
+class StageError(Exception):
+    """
+    Raised by a stage handler when its service call failed.
+    """
+
+    def __init__(self, result_key: str, message: str):
+        """
+        Constructor.
+        :param result_key: the key of the pipeline results reporting the error
+        :type result_key: str
+        :param message: the error message sent to the client
+        :type message: str
+        """
+        super().__init__(message)
+        self.result_key = result_key
+        self.message = message
+
+
+class StageScheduler:
+    """
+    Run a step graph described in the core engine format: each step has an `identifier` and
+    the list of steps it `needs`. Steps whose needs are satisfied run concurrently.
+    """
+
+    def __init__(self, steps: list[dict]):
+        """
+        Constructor.
+        :param steps: the steps of the pipeline
+        :type steps: list[dict]
+        """
+        self.steps = {step["identifier"]: step for step in steps}
+        self.order = self._topological_order()
+
+    @classmethod
+    def from_file(cls, path: str):
+        """
+        Load the step graph from a pipeline description file.
+        :param path: path to the JSON pipeline description
+        :type path: str
+        :return: the scheduler
+        :rtype: StageScheduler
+        """
+        with open(path) as f:
+            return cls(json.load(f)["steps"])
+
+    def _topological_order(self):
+        for identifier, step in self.steps.items():
+            for need in step["needs"]:
+                if need not in self.steps:
+                    raise ValueError(f"Step {identifier} needs unknown step {need}")
+
+        order = []
+        remaining = dict(self.steps)
+        while remaining:
+            ready = [identifier for identifier, step in remaining.items()
+                     if all(need not in remaining for need in step["needs"])]
+            if not ready:
+                raise ValueError(f"Cycle between steps {list(remaining)}")
+            for identifier in ready:
+                order.append(identifier)
+                del remaining[identifier]
+        return order
+
+    async def run(self, handlers: dict, results: dict, on_step_done=None):
+        """
+        Run every step missing from `results`. Each handler is called with the results of the
+        completed steps and its return value is stored under the step identifier.
+        If a step fails, the steps still running are cancelled and the error is raised.
+        :param handlers: coroutine function of each step, by identifier
+        :type handlers: dict[str, Callable[[dict], Awaitable]]
+        :param results: the results of the completed steps, updated in place
+        :type results: dict
+        :param on_step_done: function called with the identifier of each step once its result is stored
+        :type on_step_done: Callable[[str], None] | None
+        """
+        tasks = {}
+
+        async def run_step(identifier):
+            needs = self.steps[identifier]["needs"]
+            await asyncio.gather(*(tasks[need] for need in needs))
+            if identifier not in results:
+                results[identifier] = await handlers[identifier](results)
+                if on_step_done is not None:
+                    on_step_done(identifier)
+
+        for identifier in self.order:
+            tasks[identifier] = asyncio.ensure_future(run_step(identifier))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
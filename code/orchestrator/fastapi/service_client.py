@@ -0,0 +1,413 @@
+"""
+Pooled async HTTP clients used by the orchestrator to call the services.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import statistics
+import time
+import httpx
+from resilience import (CONNECT_ERRORS, RETRYABLE_ERRORS, RETRYABLE_STATUSES, UNPROCESSED_STATUSES, CircuitBreaker,
+                        RetryPolicy)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get("SERVICE_CONNECT_TIMEOUT", "10"))
+DEFAULT_READ_TIMEOUT = float(os.environ.get("SERVICE_READ_TIMEOUT", "600"))
+MAX_CONNECTIONS = int(os.environ.get("SERVICE_MAX_CONNECTIONS", "32"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("SERVICE_MAX_KEEPALIVE_CONNECTIONS", "16"))
+KEEPALIVE_EXPIRY = float(os.environ.get("SERVICE_KEEPALIVE_EXPIRY", "60"))
+DEFAULT_RETRIES = int(os.environ.get("SERVICE_RETRIES", "2"))
+DEFAULT_RETRY_BACKOFF = float(os.environ.get("SERVICE_RETRY_BACKOFF", "0.5"))
+DEFAULT_RETRY_MAX_BACKOFF = float(os.environ.get("SERVICE_RETRY_MAX_BACKOFF", "10"))
+DEFAULT_BREAKER_THRESHOLD = int(os.environ.get("SERVICE_BREAKER_THRESHOLD", "5"))
+DEFAULT_BREAKER_RESET_TIMEOUT = float(os.environ.get("SERVICE_BREAKER_RESET_TIMEOUT", "30"))
+# Active health checks of the replicas, on a route every service already has
+HEALTH_CHECK_ROUTE = os.environ.get("SERVICE_HEALTH_CHECK_ROUTE", "/docs")
+HEALTH_CHECK_INTERVAL = float(os.environ.get("SERVICE_HEALTH_CHECK_INTERVAL", "10"))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("SERVICE_HEALTH_CHECK_TIMEOUT", "2"))
+# Consecutive failed requests ejecting a replica, and the first ejection time (in seconds, doubled at each ejection)
+DEFAULT_EJECTION_THRESHOLD = int(os.environ.get("SERVICE_EJECTION_THRESHOLD", "3"))
+DEFAULT_EJECTION_TIME = float(os.environ.get("SERVICE_EJECTION_TIME", "30"))
+MAX_EJECTION_TIME = float(os.environ.get("SERVICE_MAX_EJECTION_TIME", "300"))
+# A replica whose average latency is this many times the median latency of the other replicas is ejected
+# (0 disables it), once it answered enough requests. The average weighs the last request by the smoothing
+DEFAULT_LATENCY_EJECTION_FACTOR = float(os.environ.get("SERVICE_LATENCY_EJECTION_FACTOR", "3"))
+LATENCY_MIN_REQUESTS = int(os.environ.get("SERVICE_LATENCY_MIN_REQUESTS", "5"))
+LATENCY_SMOOTHING = float(os.environ.get("SERVICE_LATENCY_SMOOTHING", "0.2"))
+
+logger = logging.getLogger(__name__)
+
+
+def service_setting(service: str, name: str, default):
+    """
+    Read a per-service setting from the environment, e.g. `WHISPER_READ_TIMEOUT`.
+    :param service: the name of the service
+    :type service: str
+    :param name: the name of the setting
+    :type name: str
+    :param default: the value used when the variable is not set
+    :return: the value of the setting
+    """
+    value = os.environ.get(f"{service.upper().replace('-', '_')}_{name}")
+    return type(default)(value) if value is not None else default
+
+
+class Replica:
+    """
+    A replica of a service, with its own pool of keep-alive connections. A replica is skipped by the
+    load balancer while it fails its health checks, or while it is ejected after consecutive failed
+    requests or for being much slower than the other replicas.
+    """
+
+    def __init__(self, url: str, connect_timeout: float, read_timeout: float):
+        """
+        Constructor.
+        :param url: the base URL of the replica
+        :type url: str
+        :param connect_timeout: the timeout to establish a connection (in seconds)
+        :type connect_timeout: float
+        :param read_timeout: the timeout to receive the response (in seconds)
+        :type read_timeout: float
+        """
+        self.url = url
+        self.client = httpx.AsyncClient(
+            base_url=url,
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # Exponentially weighted moving average of the time (in seconds) to receive the responses
+        self.latency: float | None = None
+        self.latency_samples = 0
+
+    def available(self, now: float) -> bool:
+        return self.healthy and now >= self.ejected_until
+
+    def eject(self, duration: float, reason: str):
+        logger.warning(f"Ejecting replica {self.url} for {duration:.0f}s: {reason}")
+        self.ejected_until = time.monotonic() + duration
+
+    def record_failure(self, threshold: int, ejection_time: float):
+        self.errors += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= threshold and time.monotonic() >= self.ejected_until:
+            duration = min(MAX_EJECTION_TIME, ejection_time * 2 ** self.ejections)
+            self.eject(duration, f"{self.consecutive_failures} consecutive failures")
+            self.ejections += 1
+
+    def record_success(self, latency: float):
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.latency_samples += 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+    async def check_health(self):
+        start = time.monotonic()
+        try:
+            response = await self.client.get(HEALTH_CHECK_ROUTE, timeout=HEALTH_CHECK_TIMEOUT)
+            healthy = response.status_code < 500
+        except httpx.HTTPError:
+            healthy = False
+        if healthy != self.healthy:
+            logger.warning(f"Replica {self.url} is {'healthy' if healthy else 'unhealthy'}"
+                           f" ({time.monotonic() - start:.2f}s health check)")
+        self.healthy = healthy
+
+    def stats(self) -> dict:
+        pool = getattr(self.client._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "ejected_for": max(0.0, self.ejected_until - time.monotonic()),
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "errors": self.errors,
+            "latency": self.latency,
+            "connections": len(connections),
+            "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+        }
+
+
+class ServiceClient:
+    """
+    Async HTTP client spreading the requests to a service over its replicas, sending each request to
+    the available replica with the fewest outstanding requests. Failed requests are retried according
+    to the retry policy, on another replica when possible, and go through the circuit breaker.
+    The requests of a service which is not idempotent (e.g. a costly generation) are only retried when
+    they did not reach it.
+    """
+
+    def __init__(self, name: str, urls: list[str], connect_timeout: float, read_timeout: float,
+                 retry_policy: RetryPolicy, breaker: CircuitBreaker, ejection_threshold: int, ejection_time: float,
+                 latency_ejection_factor: float = DEFAULT_LATENCY_EJECTION_FACTOR, idempotent: bool = False):
+        """
+        Constructor.
+        :param name: the name of the service
+        :type name: str
+        :param urls: the base URL of each replica of the service
+        :type urls: list[str]
+        :param connect_timeout: the timeout to establish a connection (in seconds)
+        :type connect_timeout: float
+        :param read_timeout: the timeout to receive the response (in seconds)
+        :type read_timeout: float
+        :param retry_policy: the retries of the failed requests
+        :type retry_policy: RetryPolicy
+        :param breaker: the circuit breaker of the service
+        :type breaker: CircuitBreaker
+        :param ejection_threshold: the number of consecutive failed requests ejecting a replica
+        :type ejection_threshold: int
+        :param ejection_time: the duration (in seconds) of the first ejection of a replica
+        :type ejection_time: float
+        :param latency_ejection_factor: the ratio between the average latency of a replica and the median of the
+        other replicas ejecting it, 0 to never eject slow replicas
+        :type latency_ejection_factor: float
+        :param idempotent: whether processing a request twice is harmless, so it can be retried after its
+        connection broke or timed out
+        :type idempotent: bool
+        """
+        self.name = name
+        self.replicas = [Replica(url, connect_timeout, read_timeout) for url in urls]
+        self.retry_policy = retry_policy
+        self.breaker = breaker
+        self.ejection_threshold = ejection_threshold
+        self.ejection_time = ejection_time
+        self.latency_ejection_factor = latency_ejection_factor
+        self.retryable_errors = RETRYABLE_ERRORS if idempotent else CONNECT_ERRORS
+        self.retryable_statuses = RETRYABLE_STATUSES if idempotent else UNPROCESSED_STATUSES
+        self.health_checks: asyncio.Task | None = None
+        self.requests = 0
+        self.in_flight = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _pick(self, failed: Replica | None) -> Replica:
+        now = time.monotonic()
+        candidates = [replica for replica in self.replicas if replica.available(now) and replica is not failed]
+        if not candidates:
+            # Better to try an ejected replica than to fail without trying
+            candidates = [replica for replica in self.replicas if replica is not failed] or self.replicas
+        fewest = min(replica.in_flight for replica in candidates)
+        # Break the ties randomly, so idle replicas share the load
+        return random.choice([replica for replica in candidates if replica.in_flight == fewest])
+
+    def _record_failure(self, replica: Replica):
+        replica.record_failure(self.ejection_threshold, self.ejection_time)
+        # The failures of a replica only count against the service once no other replica is available
+        now = time.monotonic()
+        if not any(other.available(now) for other in self.replicas if other is not replica):
+            self.breaker.record_failure()
+
+    def _record_success(self, replica: Replica, latency: float):
+        replica.record_success(latency)
+        if self.latency_ejection_factor <= 0 or replica.latency_samples < LATENCY_MIN_REQUESTS:
+            return
+        # Compare the replica with the other ones serving traffic, so the last available replica is never ejected
+        now = time.monotonic()
+        others = [other.latency for other in self.replicas
+                  if other is not replica and other.available(now) and other.latency_samples >= LATENCY_MIN_REQUESTS]
+        if not others:
+            return
+        median = statistics.median(others)
+        if replica.latency > self.latency_ejection_factor * median and now >= replica.ejected_until:
+            replica.eject(self.ejection_time, f"average latency {replica.latency:.2f}s, "
+                                              f"{replica.latency / median:.1f} times the other replicas")
+            # Measure it again once it is back
+            replica.latency = None
+            replica.latency_samples = 0
+
+    @contextlib.asynccontextmanager
+    async def stream(self, route: str, method: str = "POST", **kwargs):
+        """
+        Send a request to the service, a POST by default. The body of the response is not read, so it can be
+        streamed with `aiter_bytes`, or read at once with `aread`. Connection errors and 502 and 503
+        responses are retried, as well as broken connections and 504 responses if the service is
+        idempotent. The last response is returned once the retries are exhausted.
+        The request body must be iterable again (e.g. bytes, JSON or a MultipartFileStream).
+        :param route: the route, relative to the service URL
+        :type route: str
+        :param method: the HTTP method
+        :type method: str
+        :return: the response
+        :rtype: AsyncContextManager[httpx.Response]
+        :raise CircuitOpenError: if the service is considered down
+        """
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            replica, response = await self._send(route, method, **kwargs)
+            self.bytes_sent += int(response.request.headers.get("Content-Length", 0))
+            try:
+                yield response
+            except httpx.HTTPError:
+                self.errors += 1
+                replica.record_failure(self.ejection_threshold, self.ejection_time)
+                raise
+            finally:
+                replica.in_flight -= 1
+                self.bytes_received += response.num_bytes_downloaded
+                await response.aclose()
+        finally:
+            self.in_flight -= 1
+
+    async def _send(self, route: str, method: str, **kwargs):
+        attempt = 0
+        failed = None
+        while True:
+            self.breaker.before_request()
+            replica = self._pick(failed)
+            replica.requests += 1
+            replica.in_flight += 1
+            start = time.monotonic()
+            try:
+                response = await replica.client.send(replica.client.build_request(method, route, **kwargs), stream=True)
+            except httpx.HTTPError as e:
+                replica.in_flight -= 1
+                self.errors += 1
+                # An exhausted local connection pool says nothing about the service
+                if not isinstance(e, httpx.PoolTimeout):
+                    self._record_failure(replica)
+                if not isinstance(e, self.retryable_errors) or attempt >= self.retry_policy.retries:
+                    raise
+                delay = self.retry_policy.backoff(attempt)
+                logger.warning(f"Retrying {self.name} in {delay:.2f}s after {e!r} from {replica.url}")
+            except BaseException:
+                replica.in_flight -= 1
+                raise
+            else:
+                if response.status_code < 500:
+                    # Other errors (e.g. 4xx) come from the request, not from the service health
+                    self.breaker.record_success()
+                    self._record_success(replica, time.monotonic() - start)
+                    return replica, response
+                self._record_failure(replica)
+                if response.status_code not in self.retryable_statuses or attempt >= self.retry_policy.retries:
+                    return replica, response
+                replica.in_flight -= 1
+                await response.aclose()
+                delay = self.retry_policy.backoff(attempt, response.headers.get("Retry-After"))
+                logger.warning(f"Retrying {self.name} in {delay:.2f}s after status {response.status_code} "
+                               f"from {replica.url}")
+            failed = replica
+            self.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _check_health_periodically(self):
+        while True:
+            await asyncio.gather(*(replica.check_health() for replica in self.replicas))
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+    def start_health_checks(self):
+        """
+        Start checking the health of the replicas in the background. Must be called from the running event loop.
+        """
+        self.health_checks = asyncio.create_task(self._check_health_periodically())
+
+    def stats(self) -> dict:
+        """
+        Statistics about the requests and the replicas of the service.
+        :return: the statistics
+        :rtype: dict
+        """
+        now = time.monotonic()
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "available_replicas": sum(1 for replica in self.replicas if replica.available(now)),
+            "replicas": [replica.stats() for replica in self.replicas],
+        }
+
+    async def close(self):
+        if self.health_checks is not None:
+            self.health_checks.cancel()
+            await asyncio.gather(self.health_checks, return_exceptions=True)
+        for replica in self.replicas:
+            await replica.client.aclose()
+
+
+class ServiceClients:
+    """
+    One load-balanced client per service, configured from the environment. The replicas of a service
+    are listed in e.g. `WHISPER_URLS`, separated by commas, and default to the given URL.
+    """
+
+    def __init__(self, service_urls: dict, idempotent_services: tuple = ()):
+        """
+        Constructor.
+        :param service_urls: the default base URL of each service, by service name
+        :type service_urls: dict[str, str]
+        :param idempotent_services: the names of the services whose requests can be retried after their
+        connection broke, unless set otherwise by `{SERVICE}_IDEMPOTENT`
+        :type idempotent_services: tuple[str]
+        """
+        self.clients = {
+            name: ServiceClient(
+                name,
+                service_setting(name, "URLS", url).split(","),
+                connect_timeout=service_setting(name, "CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+                read_timeout=service_setting(name, "READ_TIMEOUT", DEFAULT_READ_TIMEOUT),
+                retry_policy=RetryPolicy(
+                    retries=service_setting(name, "RETRIES", DEFAULT_RETRIES),
+                    base_backoff=service_setting(name, "RETRY_BACKOFF", DEFAULT_RETRY_BACKOFF),
+                    max_backoff=service_setting(name, "RETRY_MAX_BACKOFF", DEFAULT_RETRY_MAX_BACKOFF),
+                ),
+                breaker=CircuitBreaker(
+                    name,
+                    failure_threshold=service_setting(name, "BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD),
+                    reset_timeout=service_setting(name, "BREAKER_RESET_TIMEOUT", DEFAULT_BREAKER_RESET_TIMEOUT),
+                ),
+                ejection_threshold=service_setting(name, "EJECTION_THRESHOLD", DEFAULT_EJECTION_THRESHOLD),
+                ejection_time=service_setting(name, "EJECTION_TIME", DEFAULT_EJECTION_TIME),
+                latency_ejection_factor=service_setting(name, "LATENCY_EJECTION_FACTOR",
+                                                        DEFAULT_LATENCY_EJECTION_FACTOR),
+                idempotent=bool(service_setting(name, "IDEMPOTENT", int(name in idempotent_services))),
+            )
+            for name, url in service_urls.items()
+        }
+
+    def __getitem__(self, name: str) -> ServiceClient:
+        return self.clients[name]
+
+    def start_health_checks(self):
+        for client in self.clients.values():
+            client.start_health_checks()
+
+    def stats(self) -> dict:
+        return {name: client.stats() for name, client in self.clients.items()}
+
+    def breakers(self) -> dict:
+        return {name: client.breaker.stats() for name, client in self.clients.items()}
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
@@ -0,0 +1,117 @@
+"""
+Chunked streaming of files between the clients, the disk and the services.
+"""
+
+import asyncio
+import os
+import uuid
+from tempfile import NamedTemporaryFile
+from fastapi import UploadFile
+from fastapi.responses import FileResponse
+
+CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", str(1024 * 1024)))
+
+
+async def iter_upload(upload: UploadFile):
+    """
+    Iterate over the content of an uploaded file by chunks.
+    :param upload: the uploaded file
+    :type upload: UploadFile
+    :return: the chunks of the file
+    :rtype: AsyncIterator[bytes]
+    """
+    while chunk := await upload.read(CHUNK_SIZE):
+        yield chunk
+
+
+def _commit_file(temporary_path: str, path: str):
+    # Flush the file to the disk before renaming it, so a crash never leaves a partial file at path
+    with open(temporary_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+async def write_file(chunks, path: str):
+    """
+    Write the chunks to a temporary file next to `path`, then atomically rename it to `path`.
+    The disk operations run off the event loop.
+    :param chunks: the content of the file
+    :type chunks: AsyncIterator[bytes]
+    :param path: the final path of the file
+    :type path: str
+    """
+    with NamedTemporaryFile(dir=os.path.dirname(path) or ".", prefix=".tmp", delete=False) as f:
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+        except BaseException:
+            os.remove(f.name)
+            raise
+    await asyncio.to_thread(_commit_file, f.name, path)
+
+
+class SendfileResponse(FileResponse):
+    """
+    File response handing the file over to the server when it supports one of the ASGI zero-copy
+    extensions (`http.response.pathsend`, `http.response.zerocopysend`), which lets it use sendfile.
+    Other servers receive the file by chunks of CHUNK_SIZE.
+    """
+
+    chunk_size = CHUNK_SIZE
+
+    async def __call__(self, scope, receive, send):
+        extensions = scope.get("extensions") or {}
+        zero_copy = "http.response.pathsend" in extensions or "http.response.zerocopysend" in extensions
+        if self.send_header_only or not zero_copy:
+            return await super().__call__(scope, receive, send)
+
+        if self.stat_result is None:
+            self.set_stat_headers(await asyncio.to_thread(os.stat, self.path))
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+        else:
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.zerocopysend", "file": f})
+        if self.background is not None:
+            await self.background()
+
+
+class MultipartFileStream:
+    """
+    multipart/form-data request body sending a single file read from disk by chunks.
+    The body is read again from the file each time it is iterated, so a request can be retried.
+    """
+
+    def __init__(self, field: str, path: str, content_type: str):
+        """
+        Constructor.
+        :param field: the name of the form field
+        :type field: str
+        :param path: path to the file to send
+        :type path: str
+        :param content_type: the content type of the file
+        :type content_type: str
+        """
+        self.path = path
+        self.boundary = uuid.uuid4().hex
+        self.head = (
+            f"--{self.boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"{field}\"; filename=\"{os.path.basename(path)}\"\r\n"
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+
+    @property
+    def headers(self) -> dict:
+        return {
+            "Content-Type": f"multipart/form-data; boundary={self.boundary}",
+            "Content-Length": str(len(self.head) + os.path.getsize(self.path) + len(self.tail)),
+        }
+
+    async def __aiter__(self):
+        yield self.head
+        with open(self.path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+                yield chunk
+        yield self.tail
@@ -0,0 +1,181 @@
+"""
+Background removal of the expired pipelines and of their files.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import time
+from metrics import STORAGE_BYTES, SWEEPER_RECLAIMED_BYTES, SWEEPER_REMOVED_PIPELINES
+from models import Pipeline, PipelineStatus
+from registry import PipelineRegistry
+
+logger = logging.getLogger(__name__)
+
+# Pipelines whose files are not being used by a worker, the only ones removed to respect the byte budget
+IDLE_STATUSES = (PipelineStatus.CREATED, PipelineStatus.RESULT_READY, PipelineStatus.FINISHED, PipelineStatus.FAILED)
+
+
+def _file_size(path: str | None) -> int:
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+
+def pipeline_files(pipeline: Pipeline) -> list[str]:
+    """
+    Get the files of a pipeline: its audio, the renditions of the audio sent to the services and its result.
+    :param pipeline: the pipeline
+    :type pipeline: Pipeline
+    :return: the paths of the files, which may not exist
+    :rtype: list[str]
+    """
+    paths = [pipeline.audio_path, pipeline.result_path]
+    paths.extend(rendition["path"] for rendition in pipeline.renditions.values())
+    return [path for path in paths if path]
+
+
+def _scan(directories: list[str]) -> dict:
+    # Size and modification time of every file of the directories, by absolute path
+    files = {}
+    for directory in directories:
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name != ".gitkeep":
+                stat = entry.stat()
+                files[os.path.abspath(entry.path)] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+class StorageSweeper:
+    """
+    Periodically removes the pipelines that stayed too long in a status, then the oldest idle
+    pipelines until the files of the directories fit in the byte budget. Files no pipeline refers to
+    (e.g. left by a crash or a reset) are removed once they are older than a grace period.
+    """
+
+    def __init__(self, registry: PipelineRegistry, delete_pipeline, directories: list[str], ttls: dict,
+                 max_bytes: int, orphan_grace: float, interval: float):
+        """
+        Constructor.
+        :param registry: the registry holding the pipelines
+        :type registry: PipelineRegistry
+        :param delete_pipeline: function removing a pipeline and its files, by id
+        :type delete_pipeline: Callable[[str], None]
+        :param directories: the directories holding the files of the pipelines
+        :type directories: list[str]
+        :param ttls: the time (in seconds) a pipeline may stay in each status, statuses without TTL are kept
+        :type ttls: dict[PipelineStatus, float]
+        :param max_bytes: the maximum total size of the files of the directories
+        :type max_bytes: int
+        :param orphan_grace: the age (in seconds) after which a file no pipeline refers to is removed
+        :type orphan_grace: float
+        :param interval: the time (in seconds) between two sweeps
+        :type interval: float
+        """
+        self.registry = registry
+        self.delete_pipeline = delete_pipeline
+        self.directories = directories
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.orphan_grace = orphan_grace
+        self.interval = interval
+        self.task: asyncio.Task | None = None
+        self.reclaimed_bytes: dict[str, int] = {"ttl": 0, "budget": 0, "orphan": 0}
+        self.removed_pipelines: dict[str, int] = {"ttl": 0, "budget": 0}
+        self.usage = 0
+
+    def _remove_pipeline(self, pipeline: Pipeline, reason: str) -> int:
+        size = sum(_file_size(path) for path in pipeline_files(pipeline))
+        self.delete_pipeline(pipeline.informations.id)
+        self.reclaimed_bytes[reason] += size
+        self.removed_pipelines[reason] += 1
+        SWEEPER_RECLAIMED_BYTES.labels(reason).inc(size)
+        SWEEPER_REMOVED_PIPELINES.labels(reason).inc()
+        return size
+
+    def _sweep_expired(self, now: float):
+        for status, ttl in self.ttls.items():
+            # Entries are in the order the pipelines entered the status, so the expired ones come first
+            for pipeline_id, entered_at in self.registry.entered(status):
+                if now - entered_at <= ttl:
+                    break
+                pipeline = self.registry.get(pipeline_id)
+                if pipeline is not None and pipeline.informations.status == status:
+                    self._remove_pipeline(pipeline, "ttl")
+
+    def _sweep_orphans(self, files: dict, now: float) -> int:
+        referenced = {
+            os.path.abspath(path)
+            for pipeline in self.registry.values()
+            for path in pipeline_files(pipeline)
+        }
+        reclaimed = 0
+        for path, (size, modified_at) in files.items():
+            if path not in referenced and now - modified_at > self.orphan_grace:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                reclaimed += size
+                self.reclaimed_bytes["orphan"] += size
+                SWEEPER_RECLAIMED_BYTES.labels("orphan").inc(size)
+        return reclaimed
+
+    def _sweep_budget(self, usage: int) -> int:
+        # Oldest idle pipelines first, whatever their status
+        candidates = heapq.merge(
+            *([(entered_at, pipeline_id) for pipeline_id, entered_at in self.registry.entered(status)]
+              for status in IDLE_STATUSES)
+        )
+        for _, pipeline_id in candidates:
+            if usage <= self.max_bytes:
+                break
+            pipeline = self.registry.get(pipeline_id)
+            if pipeline is not None and pipeline.informations.status in IDLE_STATUSES:
+                usage -= self._remove_pipeline(pipeline, "budget")
+        return usage
+
+    async def sweep(self):
+        """
+        Remove the expired pipelines, the orphan files and, if the budget is exceeded, the oldest idle pipelines.
+        """
+        now = time.time()
+        self._sweep_expired(now)
+        # Listing the directories is the only slow part, the removals stay on the event loop with the registry
+        files = await asyncio.to_thread(_scan, self.directories)
+        usage = sum(size for size, _ in files.values())
+        usage -= self._sweep_orphans(files, now)
+        if usage > self.max_bytes:
+            usage = self._sweep_budget(usage)
+        self.usage = usage
+        STORAGE_BYTES.set(usage)
+
+    def start(self):
+        """
+        Start sweeping in the background. Must be called from the running event loop.
+        """
+        self.task = asyncio.create_task(self._sweep_periodically())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _sweep_periodically(self):
+        while True:
+            try:
+                await self.sweep()
+            except OSError as e:
+                logger.error(f"Error while sweeping the pipeline files: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "usage": self.usage,
+            "max_size": self.max_bytes,
+            "reclaimed_bytes": dict(self.reclaimed_bytes),
+            "removed_pipelines": dict(self.removed_pipelines),
+        }
@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+
+ORCHESTRATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = ["youtube-downloader", "whisper", "sentiment-analysis", "genre-detection", "art-generation"]
+
+# The orchestrator modules are imported as top-level modules, as uvicorn does, with the shared modules
+# copied next to them when the image is built
+sys.path.insert(0, ORCHESTRATOR_DIR)
+sys.path.insert(1, os.path.join(ORCHESTRATOR_DIR, "..", "..", "common"))
+
+
+@pytest.fixture(scope="session")
+def orchestrator(tmp_path_factory):
+    """
+    The orchestrator application, running in a temporary directory with unreachable services.
+    """
+    directory = tmp_path_factory.mktemp("orchestrator")
+    for folder in ("audios", "results"):
+        os.makedirs(directory / folder)
+    os.environ.update({
+        "PIPELINE_DESCRIPTION": os.path.join(ORCHESTRATOR_DIR, "pipeline.json"),
+        "TRACES_DIR": "",
+        "SERVICE_RETRIES": "0",
+        "SERVICE_HEALTH_CHECK_INTERVAL": "3600",
+        **{service.upper().replace("-", "_") + "_URLS": "http://127.0.0.1:9" for service in SERVICES},
+    })
+    os.chdir(directory)
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(orchestrator):
+    from fastapi.testclient import TestClient
+    with TestClient(orchestrator.app) as client:
+        yield client
@@ -0,0 +1,47 @@
+import asyncio
+import io
+import zipfile
+from models import PipelineStatus
+
+
+def test_distinct_shorts_get_distinct_pipelines(client):
+    urls = ["https://www.youtube.com/shorts/aaaaaaaaaaa", "https://www.youtube.com/shorts/bbbbbbbbbbb"]
+    response = client.post("/batch", data={"urls": urls})
+    assert response.status_code == 200, response.text
+    items = response.json()["items"]
+    assert len(items) == 2
+    assert items[0]["pipeline_id"] != items[1]["pipeline_id"]
+
+
+def test_same_video_shares_a_pipeline(client):
+    urls = ["https://www.youtube.com/watch?v=ccccccccccc", "https://youtu.be/ccccccccccc"]
+    response = client.post("/batch", data={"urls": urls})
+    assert response.status_code == 200, response.text
+    items = response.json()["items"]
+    assert items[0]["pipeline_id"] == items[1]["pipeline_id"]
+
+
+def test_batch_can_be_downloaded_again_after_a_run(orchestrator, client, tmp_path):
+    urls = ["https://www.youtube.com/watch?v=fffffffffff", "https://www.youtube.com/watch?v=ggggggggggg"]
+    response = client.post("/batch", data={"urls": urls})
+    assert response.status_code == 200, response.text
+    batch_id = response.json()["id"]
+    batch_pipelines = [orchestrator.get_pipeline_by_id(item["pipeline_id"]) for item in response.json()["items"]]
+    for index, pipeline in enumerate(batch_pipelines):
+        pipeline.result_path = str(tmp_path / f"images_{index}.zip")
+        with zipfile.ZipFile(pipeline.result_path, "w") as archive:
+            archive.writestr("image0.png", b"image")
+        orchestrator.pipelines.set_status(pipeline, PipelineStatus.RESULT_READY)
+
+    # A download still being sent when another pipeline is submitted
+    pending = asyncio.run(orchestrator.get_batch_result(batch_id))
+    response = client.post("/create", data={"url": "https://www.youtube.com/watch?v=hhhhhhhhhhh"})
+    client.get(f"/run/{response.json()['id']}")
+    assert all(orchestrator.get_pipeline_by_id(pipeline.informations.id) for pipeline in batch_pipelines)
+
+    response = client.get(f"/batch/{batch_id}/result")
+    assert response.status_code == 200, response.text
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert sum(name.endswith("image0.png") for name in archive.namelist()) == 2
+    assert all(pipeline.informations.status == PipelineStatus.FINISHED for pipeline in batch_pipelines)
+    asyncio.run(pending.background())
@@ -0,0 +1,78 @@
+import asyncio
+from broker import ProgressBroker
+
+
+def drain(subscription) -> list[int]:
+    events = []
+    while not subscription.queue.empty():
+        event = subscription.queue.get_nowait()
+        events.append(event["seq"] if event is not None else None)
+    return events
+
+
+def test_subscriber_replays_the_events_after_its_last_seq():
+    async def run():
+        broker = ProgressBroker(log_size=10, max_pending=10)
+        for step in range(5):
+            broker.publish("pipeline", {"step": step})
+        subscription = broker.subscribe("pipeline", last_seq=3)
+        broker.publish("pipeline", {"step": 5})
+        assert drain(subscription) == [4, 5, 6]
+
+    asyncio.run(run())
+
+
+def test_replay_is_limited_to_the_log():
+    async def run():
+        broker = ProgressBroker(log_size=2, max_pending=10)
+        for step in range(5):
+            broker.publish("pipeline", {"step": step})
+        assert drain(broker.subscribe("pipeline")) == [4, 5]
+
+    asyncio.run(run())
+
+
+def test_events_of_another_epoch_are_all_replayed():
+    async def run():
+        before_restart = ProgressBroker(log_size=10, max_pending=10)
+        for step in range(5):
+            before_restart.publish("pipeline", {"step": step})
+        last_event = list(before_restart.logs["pipeline"])[-1]
+
+        # The orchestrator restarted, its sequence numbers start again
+        broker = ProgressBroker(log_size=10, max_pending=10)
+        broker.publish("pipeline", {"step": 5})
+        broker.publish("pipeline", {"step": 6})
+        assert broker.epoch != last_event["epoch"]
+        assert drain(broker.subscribe("pipeline", last_event["seq"], last_event["epoch"])) == [1, 2]
+        assert drain(broker.subscribe("pipeline", 1, broker.epoch)) == [2]
+
+    asyncio.run(run())
+
+
+def test_slow_subscriber_is_closed_and_can_resume():
+    async def run():
+        broker = ProgressBroker(log_size=10, max_pending=2)
+        slow = broker.subscribe("pipeline")
+        for step in range(3):
+            broker.publish("pipeline", {"step": step})
+        # The subscription is closed on the third event, the closing marker takes the place of the oldest event
+        assert drain(slow) == [2, None]
+        assert "pipeline" not in broker.subscriptions
+        assert drain(broker.subscribe("pipeline", last_seq=2)) == [3]
+
+    asyncio.run(run())
+
+
+def test_close_drops_the_log_and_the_subscribers():
+    async def run():
+        broker = ProgressBroker(log_size=10, max_pending=10)
+        subscription = broker.subscribe("pipeline")
+        broker.publish("pipeline", {"step": 0})
+        broker.close("pipeline")
+        assert drain(subscription) == [1, None]
+        assert "pipeline" not in broker.logs
+        broker.publish("pipeline", {"step": 0})
+        assert broker.logs["pipeline"][0]["seq"] == 1
+
+    asyncio.run(run())
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import cache
+from cache import ResultCache, content_key, file_digest
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    results = ResultCache(str(tmp_path), max_bytes=30)
+    for key in ("a", "b", "c"):
+        results.put_json("whisper", key, "x" * 8)
+    # Reading "a" makes "b" the least recently used entry
+    assert results.get_json("whisper", "a") == "x" * 8
+    results.put_json("whisper", "d", "x" * 8)
+
+    assert results.get_json("whisper", "b") is None
+    assert all(results.get_json("whisper", key) is not None for key in ("a", "c", "d"))
+    assert results.stats()["evictions"] == 1
+    assert results.stats()["size"] <= 30
+
+
+def test_recency_survives_a_restart(tmp_path):
+    results = ResultCache(str(tmp_path), max_bytes=30)
+    for key in ("a", "b", "c"):
+        results.put_json("whisper", key, "x" * 8)
+        # Distinct modification times, which order the entries found on startup
+        os.utime(os.path.join(tmp_path, f"whisper-{key}.json"), (len(results.entries), len(results.entries)))
+    # "a" was read last
+    os.utime(os.path.join(tmp_path, "whisper-a.json"), (10, 10))
+
+    restarted = ResultCache(str(tmp_path), max_bytes=30)
+    assert restarted.size == results.size
+    restarted.put_json("whisper", "d", "x" * 8)
+    assert not restarted.contains("whisper", "b", "json")
+    assert restarted.contains("whisper", "a", "json")
+
+
+def test_entries_expire_after_their_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    results = ResultCache(str(tmp_path), max_bytes=1024, ttl=60)
+    results.put_json("youtube-downloader", "old", 1)
+    now[0] += 30
+    results.put_json("youtube-downloader", "new", 2)
+
+    now[0] += 40
+    assert not results.contains("youtube-downloader", "old", "json")
+    assert results.get_json("youtube-downloader", "old") is None
+    assert results.get_json("youtube-downloader", "new") == 2
+    assert results.stats()["misses"] == {"youtube-downloader": 1}
+    assert not os.path.exists(os.path.join(tmp_path, "youtube-downloader-old.json"))
+
+
+def test_peek_and_contains_do_not_count_nor_refresh(tmp_path):
+    results = ResultCache(str(tmp_path), max_bytes=20)
+    results.put_json("whisper", "a", "x" * 8)
+    results.put_json("whisper", "b", "x" * 8)
+    assert results.peek_json("whisper", "a") == "x" * 8
+    assert results.contains("whisper", "a", "json")
+    results.put_json("whisper", "c", "x" * 8)
+    assert not results.contains("whisper", "a", "json")
+    assert results.stats()["hits"] == {} and results.stats()["misses"] == {}
+
+
+def test_files_are_stored_as_their_own_copy(tmp_path):
+    results = ResultCache(str(tmp_path / "cache"), max_bytes=1024)
+    source = tmp_path / "images.zip"
+    source.write_bytes(b"images")
+    results.put_file("art-generation-images", "key", "zip", str(source))
+    os.remove(source)
+    with open(results.get_file("art-generation-images", "key", "zip"), "rb") as f:
+        assert f.read() == b"images"
+
+
+def test_content_keys_separate_their_parts(tmp_path):
+    assert content_key("ab", "c") != content_key("a", "bc")
+    assert content_key("a", "b") != content_key("b", "a")
+    assert content_key(b"a") == content_key("a")
+    path = tmp_path / "audio.mp3"
+    path.write_bytes(b"audio" * 100000)
+    # Read by chunks, but hashed as a whole
+    assert file_digest(str(path)) == hashlib.sha256(b"audio" * 100000).hexdigest()
+
+
+def test_stage_keys_depend_on_everything_the_result_depends_on(orchestrator, monkeypatch):
+    digest = "0" * 64
+    assert orchestrator.audio_result_key("whisper", digest) == content_key(digest)
+    genre_key = orchestrator.audio_result_key("genre-detection", digest)
+    monkeypatch.setattr(orchestrator, "GENRE_INFERENCE_MODE", "full")
+    assert orchestrator.audio_result_key("genre-detection", digest) != genre_key
+
+    image_data = {"lyrics_analysis": {"mood": "happy"}, "music_style": {"genre_top": "rock"}}
+    reordered = {"music_style": {"genre_top": "rock"}, "lyrics_analysis": {"mood": "happy"}}
+    key = orchestrator.art_generation_key(image_data)
+    assert orchestrator.art_generation_key(reordered) == key
+    monkeypatch.setattr(orchestrator, "ART_GENERATION_MODEL_IDS", ["another/model"])
+    assert orchestrator.art_generation_key(image_data) != key
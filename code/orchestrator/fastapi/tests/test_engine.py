@@ -0,0 +1,48 @@
+from fastapi import HTTPException
+from scheduler import StageError
+
+
+def test_unexpected_stage_error_fails_pipeline(orchestrator, client, monkeypatch):
+    async def broken_download(pipeline, results):
+        # e.g. save_audio when the download stream breaks
+        raise HTTPException(status_code=500, detail="Error while processing audio file")
+
+    monkeypatch.setitem(orchestrator.STAGE_HANDLERS, "youtube-downloader", broken_download)
+    response = client.post("/create", data={"url": "https://www.youtube.com/watch?v=ddddddddddd"})
+    assert response.status_code == 200, response.text
+    pipeline_id = response.json()["id"]
+
+    with client.websocket_connect(f"/ws/{pipeline_id}") as websocket:
+        assert client.get(f"/run/{pipeline_id}").status_code == 200
+        while (event := websocket.receive_json())["status"] != "failed":
+            pass
+    assert event["results"]["image_generation"] == "Unexpected error while running the pipeline"
+    assert client.get(f"/status/{pipeline_id}").json() == "failed"
+
+
+def test_failed_stage_fails_pipeline_with_its_message(orchestrator, client, monkeypatch):
+    async def failed_lyrics(pipeline, results):
+        raise StageError("whisper", "Error while extracting lyrics")
+
+    async def genre(pipeline, results):
+        return {"genre_top": "rock"}
+
+    async def download(pipeline, results):
+        return None
+
+    monkeypatch.setitem(orchestrator.STAGE_HANDLERS, "youtube-downloader", download)
+    monkeypatch.setitem(orchestrator.STAGE_HANDLERS, "audio-ingest", download)
+    monkeypatch.setitem(orchestrator.STAGE_HANDLERS, "whisper", failed_lyrics)
+    monkeypatch.setitem(orchestrator.STAGE_HANDLERS, "musical-genre-detection", genre)
+    response = client.post("/create", data={"url": "https://www.youtube.com/watch?v=iiiiiiiiiii"})
+    pipeline_id = response.json()["id"]
+
+    with client.websocket_connect(f"/ws/{pipeline_id}") as websocket:
+        assert client.get(f"/run/{pipeline_id}").status_code == 200
+        while (event := websocket.receive_json())["status"] != "failed":
+            pass
+    assert event["results"]["whisper"] == "Error while extracting lyrics"
+    # The stages needing the lyrics never ran, the completed ones are kept for a retry
+    stage_results = orchestrator.get_pipeline_by_id(pipeline_id).stage_results
+    assert "sentiment-analysis" not in stage_results and "album-cover-art-generation" not in stage_results
+    assert "audio-ingest" in stage_results
@@ -0,0 +1,78 @@
+import asyncio
+from journal import PipelineJournal
+from models import Pipeline, PipelineInformation, PipelineStatus
+from registry import PipelineRegistry
+
+
+def new_pipeline(pipeline_id: str, status: PipelineStatus, **fields) -> Pipeline:
+    return Pipeline(informations=PipelineInformation(id=pipeline_id, status=status), **fields)
+
+
+def test_registry_changes_are_replayed_after_a_restart(tmp_path):
+    path = str(tmp_path / "journal" / "pipelines.db")
+    journal = PipelineJournal(path, batch_size=100, flush_interval=1)
+    registry = PipelineRegistry()
+    registry.observe(journal)
+
+    running = new_pipeline("running", PipelineStatus.WAITING, audio_path="audios/running.mp3")
+    deleted = new_pipeline("deleted", PipelineStatus.CREATED)
+    for pipeline in (running, deleted):
+        registry.add(pipeline)
+    registry.set_status(running, PipelineStatus.RUNNING_WHISPER)
+    running.stage_results["youtube-downloader"] = "audios/running.mp3"
+    registry.changed(running)
+    registry.remove("deleted")
+    # The changes are coalesced by pipeline until they are committed
+    assert set(journal.pending) == {"running", "deleted"}
+    asyncio.run(journal.stop())
+
+    restarted = PipelineJournal(path, batch_size=100, flush_interval=1)
+    recovered = restarted.load()
+    asyncio.run(restarted.stop())
+    assert [pipeline.informations.id for pipeline in recovered] == ["running"]
+    assert recovered[0].informations.status == PipelineStatus.RUNNING_WHISPER
+    assert recovered[0].stage_results == {"youtube-downloader": "audios/running.mp3"}
+    assert recovered[0].audio_path == "audios/running.mp3"
+
+
+def test_full_batch_is_committed_without_waiting(tmp_path):
+    async def run():
+        journal = PipelineJournal(str(tmp_path / "pipelines.db"), batch_size=2, flush_interval=60)
+        journal.start()
+        journal.record(new_pipeline("first", PipelineStatus.CREATED))
+        journal.record(new_pipeline("second", PipelineStatus.CREATED))
+        for _ in range(100):
+            if journal.commits:
+                break
+            await asyncio.sleep(0.01)
+        assert journal.commits == 1
+        assert len(journal.load()) == 2
+        await journal.stop()
+
+    asyncio.run(run())
+
+
+def test_recovered_pipelines_are_queued_or_resumed(orchestrator, monkeypatch, tmp_path):
+    path = str(tmp_path / "pipelines.db")
+    journal = PipelineJournal(path, batch_size=100, flush_interval=1)
+    journal.record(new_pipeline("recovered-waiting", PipelineStatus.WAITING))
+    journal.record(new_pipeline("recovered-running", PipelineStatus.RUNNING_SENTIMENT,
+                                stage_results={"whisper": {"lyrics": "la la"}}))
+    journal.record(new_pipeline("recovered-ready", PipelineStatus.RESULT_READY))
+    asyncio.run(journal.stop())
+
+    submitted, notified = [], []
+    monkeypatch.setattr(orchestrator, "journal", PipelineJournal(path, batch_size=100, flush_interval=1))
+    monkeypatch.setattr(orchestrator.engine, "submit", submitted.append)
+    monkeypatch.setattr(orchestrator.engine, "notify", lambda: notified.append(True))
+    try:
+        orchestrator.recover_pipelines()
+        assert [pipeline.informations.id for pipeline in submitted] == ["recovered-running"]
+        assert submitted[0].stage_results == {"whisper": {"lyrics": "la la"}}
+        assert notified == [True]
+        assert orchestrator.pipelines.queue_position("recovered-waiting") == 0
+        assert orchestrator.get_pipeline_by_id("recovered-ready").informations.status == PipelineStatus.RESULT_READY
+    finally:
+        for pipeline_id in ("recovered-waiting", "recovered-running", "recovered-ready"):
+            orchestrator.pipelines.remove(pipeline_id)
+        asyncio.run(orchestrator.journal.stop())
@@ -0,0 +1,84 @@
+from models import Pipeline, PipelineInformation, PipelinePriority, PipelineStatus
+from registry import PipelineRegistry
+
+
+def new_pipeline(pipeline_id: str, status=PipelineStatus.CREATED, priority=PipelinePriority.NORMAL) -> Pipeline:
+    return Pipeline(informations=PipelineInformation(id=pipeline_id, status=status), priority=priority)
+
+
+def registry_of(*pipelines: Pipeline) -> PipelineRegistry:
+    registry = PipelineRegistry()
+    for pipeline in pipelines:
+        registry.add(pipeline)
+    return registry
+
+
+def test_claims_follow_priority_then_arrival():
+    pipelines = [new_pipeline("low", PipelineStatus.WAITING, PipelinePriority.LOW),
+                 new_pipeline("normal-1", PipelineStatus.WAITING),
+                 new_pipeline("high", PipelineStatus.WAITING, PipelinePriority.HIGH),
+                 new_pipeline("normal-2", PipelineStatus.WAITING)]
+    registry = registry_of(*pipelines)
+    claimed = [registry.claim().informations.id for _ in pipelines]
+    assert claimed == ["high", "normal-1", "normal-2", "low"]
+    assert registry.claim() is None
+
+
+def test_claimed_pipeline_is_not_claimed_twice_until_released():
+    registry = registry_of(new_pipeline("first", PipelineStatus.WAITING),
+                           new_pipeline("second", PipelineStatus.WAITING))
+    assert registry.claim().informations.id == "first"
+    assert registry.queue_position("second") == 0
+    assert registry.claim().informations.id == "second"
+    assert registry.claim() is None
+    # Released while still WAITING (e.g. the worker was stopped), it can be claimed again
+    registry.release("first")
+    assert registry.claim().informations.id == "first"
+
+
+def test_set_status_keeps_the_indexes_consistent():
+    pipeline = new_pipeline("pipeline")
+    registry = registry_of(pipeline)
+    registry.set_status(pipeline, PipelineStatus.WAITING)
+    assert registry.counts()["waiting"] == 1
+    assert registry.queue_position("pipeline") == 0
+
+    registry.set_status(pipeline, PipelineStatus.RUNNING_WHISPER)
+    assert registry.counts()["waiting"] == 0
+    assert registry.counts()["running_whisper"] == 1
+    assert registry.claim() is None
+    assert registry.with_status(PipelineStatus.RUNNING_WHISPER) == [pipeline]
+
+    registry.remove("pipeline")
+    assert sum(registry.counts().values()) == 0
+    assert registry.get("pipeline") is None
+
+
+def test_queue_position_skips_claimed_pipelines():
+    registry = registry_of(*(new_pipeline(str(index), PipelineStatus.WAITING) for index in range(4)))
+    registry.claim()
+    assert [registry.queue_position(str(index)) for index in range(1, 4)] == [0, 1, 2]
+
+
+def test_pages_follow_creation_order():
+    registry = registry_of(*(new_pipeline(str(index)) for index in range(5)))
+    page, cursor = registry.page(None, 2)
+    assert [pipeline.informations.id for pipeline in page] == ["0", "1"]
+    page, cursor = registry.page(cursor, 2)
+    assert [pipeline.informations.id for pipeline in page] == ["2", "3"]
+    page, cursor = registry.page(cursor, 2)
+    assert [pipeline.informations.id for pipeline in page] == ["4"]
+    assert cursor is None
+
+
+def test_cursor_survives_removed_and_added_pipelines():
+    registry = registry_of(*(new_pipeline(str(index)) for index in range(100)))
+    page, cursor = registry.page(None, 10)
+    assert [pipeline.informations.id for pipeline in page] == [str(index) for index in range(10)]
+    # Enough removals to compact the sequences, including the pipeline the cursor points to
+    for index in range(9, 90):
+        registry.remove(str(index))
+    registry.add(new_pipeline("new"))
+    page, cursor = registry.page(cursor, 100)
+    assert [pipeline.informations.id for pipeline in page] == [str(index) for index in range(90, 100)] + ["new"]
+    assert cursor is None
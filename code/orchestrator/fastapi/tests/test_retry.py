@@ -0,0 +1,72 @@
+import os
+import pytest
+from models import Pipeline, PipelineInformation, PipelineStatus
+from resilience import RetryPolicy
+
+
+def test_backoff_is_jittered_up_to_its_exponential_cap():
+    policy = RetryPolicy(retries=5, base_backoff=1, max_backoff=5)
+    for attempt, cap in enumerate([1, 2, 4, 5, 5]):
+        delays = [policy.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        # Spread over the whole interval, so concurrent retries do not happen at once
+        assert min(delays) < cap / 4 and max(delays) > 3 * cap / 4
+
+
+def test_retry_after_is_followed_up_to_the_maximum_backoff():
+    policy = RetryPolicy(retries=1, base_backoff=1, max_backoff=5)
+    assert policy.backoff(0, "3") == 3
+    assert policy.backoff(0, "120") == 5
+    # HTTP dates are not supported, the usual backoff is used
+    assert 0 <= policy.backoff(0, "Wed, 21 Oct 2015 07:28:00 GMT") <= 1
+
+
+@pytest.fixture
+def failed_pipeline(orchestrator, monkeypatch, tmp_path):
+    """
+    A failed pipeline whose lyrics were transcribed, with an engine recording the submitted pipelines.
+    """
+    audio_path = tmp_path / "audio.mp3"
+    audio_path.write_bytes(b"audio")
+    pipeline = Pipeline(informations=PipelineInformation(id="failed", status=PipelineStatus.FAILED),
+                        url="https://www.youtube.com/watch?v=iiiiiiiiiii", audio_path=str(audio_path),
+                        audio_digest="0" * 64, stage_results={"youtube-downloader": str(audio_path),
+                                                              "audio-ingest": [], "whisper": {"lyrics": ""}})
+    orchestrator.pipelines.add(pipeline)
+    submitted = []
+    monkeypatch.setattr(orchestrator.engine, "submit", submitted.append)
+    yield pipeline, submitted
+    orchestrator.pipelines.remove("failed")
+
+
+def test_failed_pipeline_resumes_after_its_completed_stages(client, failed_pipeline):
+    pipeline, submitted = failed_pipeline
+    response = client.get("/retry/failed")
+    assert response.status_code == 200, response.text
+    assert submitted == [pipeline]
+    assert set(pipeline.stage_results) == {"youtube-downloader", "audio-ingest", "whisper"}
+
+
+def test_removed_audio_is_downloaded_again(client, failed_pipeline):
+    pipeline, submitted = failed_pipeline
+    os.remove(pipeline.audio_path)
+    response = client.get("/retry/failed")
+    assert response.status_code == 200, response.text
+    assert pipeline.audio_path is None
+    # Only the stages producing the audio run again
+    assert set(pipeline.stage_results) == {"whisper"}
+
+
+def test_removed_upload_cannot_be_retried(client, failed_pipeline):
+    pipeline, submitted = failed_pipeline
+    pipeline.url = None
+    os.remove(pipeline.audio_path)
+    assert client.get("/retry/failed").status_code == 410
+    assert submitted == []
+
+
+def test_only_failed_pipelines_are_retried(orchestrator, client, failed_pipeline):
+    pipeline, submitted = failed_pipeline
+    orchestrator.pipelines.set_status(pipeline, PipelineStatus.RESULT_READY)
+    assert client.get("/retry/failed").status_code == 400
+    assert submitted == []
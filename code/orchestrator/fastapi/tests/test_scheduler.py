@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import os
+import httpx
+import pytest
+from models import Pipeline, PipelineInformation, PipelineStatus
+from scheduler import StageError, StageScheduler
+from transcoding import TranscodingError
+
+ORCHESTRATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def step(identifier: str, *needs: str) -> dict:
+    return {"identifier": identifier, "needs": list(needs)}
+
+
+def recording_handlers(scheduler: StageScheduler, events: list, delays: dict = None, failing: str = None) -> dict:
+    def handler(identifier):
+        async def run(results):
+            events.append(("start", identifier))
+            await asyncio.sleep((delays or {}).get(identifier, 0))
+            if identifier == failing:
+                raise StageError(identifier, f"Error in {identifier}")
+            events.append(("end", identifier))
+            return identifier
+        return run
+    return {identifier: handler(identifier) for identifier in scheduler.steps}
+
+
+def test_steps_start_once_their_needs_are_done():
+    scheduler = StageScheduler([step("download"), step("ingest", "download"), step("lyrics", "ingest"),
+                                step("genre", "ingest"), step("sentiment", "lyrics"),
+                                step("art", "sentiment", "genre")])
+    events = []
+    results = {}
+    asyncio.run(scheduler.run(recording_handlers(scheduler, events, {"lyrics": 0.02}), results))
+
+    for identifier, needs in (("ingest", ["download"]), ("lyrics", ["ingest"]), ("genre", ["ingest"]),
+                              ("sentiment", ["lyrics"]), ("art", ["sentiment", "genre"])):
+        start = events.index(("start", identifier))
+        assert all(events.index(("end", need)) < start for need in needs)
+    # The genre does not wait for the slower lyrics
+    assert events.index(("end", "genre")) < events.index(("end", "lyrics"))
+    assert results == {identifier: identifier for identifier in scheduler.steps}
+
+
+def test_steps_having_a_result_are_skipped():
+    scheduler = StageScheduler([step("download"), step("lyrics", "download"), step("art", "lyrics")])
+    events = []
+    results = {"download": "download", "lyrics": "lyrics"}
+    done = []
+    asyncio.run(scheduler.run(recording_handlers(scheduler, events), results, on_step_done=done.append))
+    assert events == [("start", "art"), ("end", "art")]
+    assert done == ["art"]
+
+
+def test_failure_cancels_running_steps_and_skips_dependents():
+    scheduler = StageScheduler([step("ingest"), step("lyrics", "ingest"), step("genre", "ingest"),
+                                step("art", "lyrics", "genre")])
+    events = []
+    results = {}
+    with pytest.raises(StageError) as error:
+        asyncio.run(scheduler.run(recording_handlers(scheduler, events, {"genre": 1}, failing="lyrics"), results))
+    assert error.value.result_key == "lyrics"
+    assert ("end", "genre") not in events
+    assert ("start", "art") not in events
+    # The completed steps keep their result, so a retry resumes after them
+    assert results == {"ingest": "ingest"}
+
+
+def test_invalid_graphs_are_refused():
+    with pytest.raises(ValueError, match="unknown step"):
+        StageScheduler([step("lyrics", "download")])
+    with pytest.raises(ValueError, match="Cycle"):
+        StageScheduler([step("a", "b"), step("b", "a")])
+
+
+def test_pipeline_ingests_the_audio_before_the_audio_stages():
+    scheduler = StageScheduler.from_file(os.path.join(ORCHESTRATOR_DIR, "pipeline.json"))
+    assert scheduler.steps["audio-ingest"]["needs"] == ["youtube-downloader"]
+    for identifier in ("whisper", "musical-genre-detection"):
+        assert scheduler.steps[identifier]["needs"] == ["audio-ingest"]
+    order = scheduler.order
+    assert order.index("audio-ingest") < order.index("whisper") < order.index("sentiment-analysis")
+    assert order[-1] == "album-cover-art-generation"
+
+
+def ingest(orchestrator, monkeypatch, tmp_path, content: bytes, transcode, audio_format: dict = None):
+    audio_path = tmp_path / "audio.mp3"
+    audio_path.write_bytes(content)
+    pipeline = Pipeline(informations=PipelineInformation(id="ingest", status=PipelineStatus.WAITING),
+                        audio_path=str(audio_path))
+    monkeypatch.setattr(orchestrator, "ffmpeg_available", lambda: True)
+    monkeypatch.setattr(orchestrator, "transcode", transcode)
+    publish_genre_audio_format(orchestrator, monkeypatch, audio_format or {"window": 30000, "inference_mode": "center"})
+    return pipeline, asyncio.run(orchestrator.run_audio_ingest(pipeline, {}))
+
+
+def publish_genre_audio_format(orchestrator, monkeypatch, audio_format: dict | None):
+    # The genre detection service answers with the audio format, or is unreachable if there is none
+    def handle(request):
+        if audio_format is None:
+            raise httpx.ConnectError("unreachable", request=request)
+        assert request.method == "GET" and request.url.path == orchestrator.GENRE_AUDIO_FORMAT_ROUTE
+        return httpx.Response(200, json={"sample_rate": 48000, "channels": 2, **audio_format})
+
+    for replica in orchestrator.clients["genre-detection"].replicas:
+        monkeypatch.setattr(replica, "client", httpx.AsyncClient(base_url=replica.url,
+                                                                 transport=httpx.MockTransport(handle)))
+    monkeypatch.setattr(orchestrator, "genre_audio_format_checked_at", None)
+
+
+def test_audio_ingest_transcodes_for_the_services_without_a_cached_result(orchestrator, monkeypatch, tmp_path):
+    digest = hashlib.sha256(b"cached lyrics").hexdigest()
+    orchestrator.results_cache.put_json("whisper", orchestrator.audio_result_key("whisper", digest), {"lyrics": ""})
+    transcoded = []
+
+    async def transcode(path, renditions, directory):
+        transcoded.extend(renditions)
+        return {service: {"path": path, "content_type": renditions[service].content_type} for service in renditions}
+
+    pipeline, services = ingest(orchestrator, monkeypatch, tmp_path, b"cached lyrics", transcode)
+    assert transcoded == ["genre-detection"]
+    assert services == ["genre-detection"]
+    assert pipeline.renditions["genre-detection"]["content_type"] == "audio/flac"
+
+
+def test_audio_ingest_falls_back_to_the_original_audio(orchestrator, monkeypatch, tmp_path):
+    async def transcode(path, renditions, directory):
+        raise TranscodingError("ffmpeg exited with status 1")
+
+    pipeline, services = ingest(orchestrator, monkeypatch, tmp_path, b"broken audio", transcode)
+    assert services == []
+    assert orchestrator.audio_upload(pipeline, "whisper")["content"].path == pipeline.audio_path
+
+
+def test_genre_rendition_waits_for_the_audio_format_of_the_service(orchestrator, monkeypatch, tmp_path):
+    async def transcode(path, renditions, directory):
+        assert renditions["genre-detection"].sample_rate is None
+        return {service: {"path": path, "content_type": renditions[service].content_type} for service in renditions}
+
+    monkeypatch.setattr(orchestrator, "AUDIO_RENDITIONS", ["genre-detection"])
+    pipeline, services = ingest(orchestrator, monkeypatch, tmp_path, b"new genre", transcode)
+    assert services == ["genre-detection"]
+
+    publish_genre_audio_format(orchestrator, monkeypatch, None)
+    # Without its audio format, the service is sent the original audio
+    assert asyncio.run(orchestrator.run_audio_ingest(pipeline, {})) == []
+
+
+def test_genre_audio_format_mismatch_fails_the_pipeline(orchestrator, monkeypatch, tmp_path):
+    async def transcode(path, renditions, directory):
+        raise AssertionError("transcoded for a service reading another window")
+
+    with pytest.raises(StageError, match="20000 ms window in center mode"):
+        ingest(orchestrator, monkeypatch, tmp_path, b"other genre", transcode,
+               {"window": 20000, "inference_mode": "center"})
+    publish_genre_audio_format(orchestrator, monkeypatch, {"window": 0, "inference_mode": "full"})
+    with pytest.raises(StageError, match="full mode"):
+        asyncio.run(orchestrator.check_genre_audio_format("music_style"))
@@ -0,0 +1,141 @@
+import asyncio
+import collections
+import time
+import httpx
+from resilience import CircuitBreaker, RetryPolicy
+from service_client import LATENCY_MIN_REQUESTS, ServiceClient
+
+
+def stub_client(latencies: dict, statuses: dict = None, errors: dict = None, retries: int = 1,
+                **kwargs) -> tuple[ServiceClient, collections.Counter]:
+    """
+    A client of a service whose replicas are stubs answering after the given latency (in seconds), by URL,
+    with the given status or raising the given error.
+    """
+    calls = collections.Counter()
+
+    def stub(url):
+        async def handle(request):
+            calls[url] += 1
+            await asyncio.sleep(latencies[url])
+            if url in (errors or {}):
+                raise errors[url]("stub error", request=request)
+            return httpx.Response((statuses or {}).get(url, 200), json={"replica": url})
+        return handle
+
+    client = ServiceClient("stub", list(latencies), 1, 10, RetryPolicy(retries=retries, base_backoff=0, max_backoff=0),
+                           CircuitBreaker("stub", failure_threshold=3, reset_timeout=60),
+                           ejection_threshold=3, ejection_time=60, **kwargs)
+    for replica in client.replicas:
+        replica.client = httpx.AsyncClient(base_url=replica.url, transport=httpx.MockTransport(stub(replica.url)))
+    return client, calls
+
+
+async def call(client: ServiceClient) -> httpx.Response:
+    async with client.stream("/process", json={}) as response:
+        await response.aread()
+        return response
+
+
+def test_slow_replica_is_ejected():
+    async def run():
+        client, calls = stub_client({"http://fast-1": 0.01, "http://fast-2": 0.01, "http://slow": 0.2})
+        for _ in range(4 * LATENCY_MIN_REQUESTS):
+            await asyncio.gather(*(call(client) for _ in range(3)))
+        slow = next(replica for replica in client.replicas if replica.url == "http://slow")
+        assert not slow.available(time.monotonic())
+
+        calls.clear()
+        for _ in range(10):
+            await call(client)
+        assert calls["http://slow"] == 0
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_latency_ejection_can_be_disabled():
+    async def run():
+        client, calls = stub_client({"http://fast": 0.01, "http://slow": 0.1}, latency_ejection_factor=0)
+        for _ in range(4 * LATENCY_MIN_REQUESTS):
+            await asyncio.gather(call(client), call(client))
+        calls.clear()
+        await asyncio.gather(*(call(client) for _ in range(4)))
+        assert calls["http://slow"] > 0
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_failing_replica_is_ejected():
+    async def run():
+        client, calls = stub_client({"http://ok": 0, "http://down": 0}, statuses={"http://down": 503})
+        # The replicas are picked randomly, call until the failing one is picked enough times to be ejected
+        while calls["http://down"] < 3:
+            response = await call(client)
+            # Retried on the other replica
+            assert response.status_code == 200
+        calls.clear()
+        for _ in range(10):
+            await call(client)
+        assert calls["http://down"] == 0
+        assert client.breaker.stats()["state"] == "closed"
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_server_errors_open_the_breaker():
+    async def run():
+        client, calls = stub_client({"http://broken": 0}, statuses={"http://broken": 500})
+        for _ in range(3):
+            response = await call(client)
+            assert response.status_code == 500
+        # A 500 is not retried, but counts as a failure of the service
+        assert calls["http://broken"] == 3
+        assert client.breaker.stats()["state"] == "open"
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_broken_connection_is_only_retried_when_idempotent():
+    async def run(idempotent):
+        client, calls = stub_client({"http://replica": 0}, errors={"http://replica": httpx.ReadError},
+                                    idempotent=idempotent)
+        try:
+            await call(client)
+        except httpx.ReadError:
+            pass
+        await client.close()
+        return calls["http://replica"]
+
+    assert asyncio.run(run(False)) == 1
+    assert asyncio.run(run(True)) == 2
+
+
+def test_connect_error_is_retried_when_not_idempotent():
+    async def run():
+        client, calls = stub_client({"http://replica": 0}, errors={"http://replica": httpx.ConnectError})
+        try:
+            await call(client)
+        except httpx.ConnectError:
+            pass
+        await client.close()
+        return calls["http://replica"]
+
+    assert asyncio.run(run()) == 2
+
+
+def test_retries_stop_once_exhausted():
+    async def run():
+        client, calls = stub_client({"http://down-1": 0, "http://down-2": 0},
+                                    statuses={"http://down-1": 503, "http://down-2": 503}, retries=2)
+        response = await call(client)
+        # The last response is returned once the retries are exhausted
+        assert response.status_code == 503
+        assert sum(calls.values()) == 3
+        assert client.stats()["retries"] == 2
+        await client.close()
+
+    asyncio.run(run())
@@ -0,0 +1,24 @@
+import asyncio
+from models import PipelineStatus
+
+
+def test_concurrent_stages_only_move_the_status_forward(orchestrator, client):
+    response = client.post("/create", data={"url": "https://www.youtube.com/watch?v=eeeeeeeeeee"})
+    assert response.status_code == 200, response.text
+    pipeline = orchestrator.get_pipeline_by_id(response.json()["id"])
+
+    async def run():
+        # Music style detection starts, then sentiment analysis once whisper is done
+        await orchestrator.update_pipeline_status(pipeline, PipelineStatus.RUNNING_WHISPER)
+        await orchestrator.update_pipeline_status(pipeline, PipelineStatus.RUNNING_MUSIC_STYLE)
+        await orchestrator.update_pipeline_status(pipeline, PipelineStatus.RUNNING_SENTIMENT)
+
+    asyncio.run(run())
+    assert pipeline.informations.status == PipelineStatus.RUNNING_MUSIC_STYLE
+    # No result until a stage produced it
+    assert not any(pipeline.informations.results.values())
+    assert [event["status"] for event in orchestrator.broker.logs[pipeline.informations.id]][-3:] == \
+        ["running_whisper", "running_music_style", "running_music_style"]
+
+    asyncio.run(orchestrator.update_pipeline_status(pipeline, PipelineStatus.FAILED, "whisper", "Error"))
+    assert pipeline.informations.status == PipelineStatus.FAILED
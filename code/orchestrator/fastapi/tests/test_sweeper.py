@@ -0,0 +1,88 @@
+import asyncio
+import os
+import time
+from models import Pipeline, PipelineInformation, PipelineStatus
+from registry import PipelineRegistry
+from sweeper import StorageSweeper, pipeline_files
+
+
+class Clock:
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        monkeypatch.setattr(time, "time", lambda: self.now)
+
+
+def new_sweeper(tmp_path, ttls: dict = None, max_bytes: int = 1024, orphan_grace: float = 3600):
+    registry = PipelineRegistry()
+
+    def delete_pipeline(pipeline_id):
+        for path in pipeline_files(registry.get(pipeline_id)):
+            os.remove(path)
+        registry.remove(pipeline_id)
+
+    return registry, StorageSweeper(registry, delete_pipeline, [str(tmp_path)], ttls or {}, max_bytes,
+                                    orphan_grace, interval=60)
+
+
+def add_pipeline(registry: PipelineRegistry, tmp_path, pipeline_id: str, status: PipelineStatus,
+                 size: int = 10) -> Pipeline:
+    audio_path = tmp_path / f"{pipeline_id}.mp3"
+    audio_path.write_bytes(b"a" * size)
+    pipeline = Pipeline(informations=PipelineInformation(id=pipeline_id, status=status), audio_path=str(audio_path))
+    registry.add(pipeline)
+    return pipeline
+
+
+def remaining(registry: PipelineRegistry) -> set:
+    return {pipeline.informations.id for pipeline in registry.values()}
+
+
+def test_pipelines_are_removed_once_they_stayed_too_long_in_a_status(tmp_path, monkeypatch):
+    clock = Clock(monkeypatch)
+    registry, sweeper = new_sweeper(tmp_path, ttls={PipelineStatus.FAILED: 60})
+    old = add_pipeline(registry, tmp_path, "old", PipelineStatus.CREATED)
+    add_pipeline(registry, tmp_path, "running", PipelineStatus.RUNNING_WHISPER)
+    registry.set_status(old, PipelineStatus.FAILED)
+    clock.now += 30
+    add_pipeline(registry, tmp_path, "recent", PipelineStatus.FAILED)
+
+    clock.now += 40
+    asyncio.run(sweeper.sweep())
+    assert remaining(registry) == {"running", "recent"}
+    assert not os.path.exists(old.audio_path)
+    assert sweeper.stats()["removed_pipelines"]["ttl"] == 1
+    assert sweeper.stats()["reclaimed_bytes"]["ttl"] == 10
+
+
+def test_oldest_idle_pipelines_are_removed_to_respect_the_budget(tmp_path, monkeypatch):
+    clock = Clock(monkeypatch)
+    registry, sweeper = new_sweeper(tmp_path, max_bytes=25)
+    # Never removed while a worker uses its files, even when it is the oldest
+    add_pipeline(registry, tmp_path, "running", PipelineStatus.RUNNING_WHISPER)
+    for pipeline_id, status in (("finished", PipelineStatus.FINISHED), ("failed", PipelineStatus.FAILED),
+                                ("ready", PipelineStatus.RESULT_READY)):
+        clock.now += 1
+        add_pipeline(registry, tmp_path, pipeline_id, status)
+
+    asyncio.run(sweeper.sweep())
+    assert remaining(registry) == {"running", "ready"}
+    assert sweeper.stats()["usage"] == 20
+    assert sweeper.stats()["removed_pipelines"]["budget"] == 2
+
+
+def test_orphan_files_are_removed_after_a_grace_period(tmp_path, monkeypatch):
+    clock = Clock(monkeypatch)
+    registry, sweeper = new_sweeper(tmp_path, orphan_grace=60)
+    referenced = add_pipeline(registry, tmp_path, "pipeline", PipelineStatus.RESULT_READY)
+    old_orphan = tmp_path / "old.mp3"
+    recent_orphan = tmp_path / "recent.mp3"
+    for path in (old_orphan, recent_orphan, tmp_path / ".gitkeep"):
+        path.write_bytes(b"o" * 5)
+    for path, modified_at in ((referenced.audio_path, 0), (old_orphan, clock.now - 120),
+                              (recent_orphan, clock.now - 30), (tmp_path / ".gitkeep", 0)):
+        os.utime(path, (modified_at, modified_at))
+
+    asyncio.run(sweeper.sweep())
+    assert sorted(os.listdir(tmp_path)) == [".gitkeep", "pipeline.mp3", "recent.mp3"]
+    assert sweeper.stats()["reclaimed_bytes"]["orphan"] == 5
+    assert sweeper.stats()["usage"] == 15
@@ -0,0 +1,39 @@
+import pytest
+from youtube import youtube_video_id
+
+
+@pytest.mark.parametrize("url, video_id", [
+    ("https://www.youtube.com/watch?v=dQw4w9WgXcQ", "dQw4w9WgXcQ"),
+    ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42", "dQw4w9WgXcQ"),
+    ("https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ", "dQw4w9WgXcQ"),
+    ("youtube.com/watch?v=dQw4w9WgXcQ", "dQw4w9WgXcQ"),
+    ("https://youtu.be/dQw4w9WgXcQ", "dQw4w9WgXcQ"),
+    ("https://youtu.be/dQw4w9WgXcQ?si=abc", "dQw4w9WgXcQ"),
+    ("https://www.youtube.com/shorts/aBcDeFgHiJk", "aBcDeFgHiJk"),
+    ("https://youtube.com/shorts/aBcDeFgHiJk?feature=share", "aBcDeFgHiJk"),
+    ("https://www.youtube.com/live/LiVeStReAm1", "LiVeStReAm1"),
+    ("https://www.youtube.com/embed/dQw4w9WgXcQ", "dQw4w9WgXcQ"),
+    ("https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ", "dQw4w9WgXcQ"),
+    ("https://www.youtube.com/v/dQw4w9WgXcQ", "dQw4w9WgXcQ"),
+])
+def test_video_urls(url, video_id):
+    assert youtube_video_id(url) == video_id
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/@SomeChannel",
+    "https://www.youtube.com/channel/UC1234567890",
+    "https://www.youtube.com/user/someone",
+    "https://www.youtube.com/c/SomeChannel/videos",
+    "https://www.youtube.com/shorts",
+    "https://www.youtube.com/watch",
+    "https://www.youtube.com/playlist?list=PL123",
+    "https://example.com/watch?v=dQw4w9WgXcQ",
+])
+def test_other_urls(url):
+    assert youtube_video_id(url) is None
+
+
+def test_distinct_shorts():
+    assert (youtube_video_id("https://www.youtube.com/shorts/aaaaaaaaaaa")
+            != youtube_video_id("https://www.youtube.com/shorts/bbbbbbbbbbb"))
@@ -0,0 +1,130 @@
+"""
+Transcoding of the audio files into the renditions sent to the services, with ffmpeg.
+"""
+
+import asyncio
+import os
+import shutil
+from tempfile import NamedTemporaryFile
+
+FFMPEG = shutil.which("ffmpeg")
+FFPROBE = shutil.which("ffprobe")
+
+
+class TranscodingError(Exception):
+    pass
+
+
+class Rendition:
+    """
+    Format of the audio expected by a service: the file is decoded once by the orchestrator, downmixed and
+    resampled if the service does it the same way, so the service receives a smaller file, in the format its
+    model reads.
+    """
+
+    def __init__(self, suffix: str, content_type: str, codec: list[str], sample_rate: int = None,
+                 channels: int = None, window: float = None):
+        """
+        :param suffix: the extension of the files
+        :type suffix: str
+        :param content_type: the content type sent with the files
+        :type content_type: str
+        :param codec: the ffmpeg options of the encoder
+        :type codec: list[str]
+        :param sample_rate: the sample rate (in Hz), None to keep the one of the audio
+        :type sample_rate: int
+        :param channels: the number of channels, None to keep the ones of the audio
+        :type channels: int
+        :param window: the duration (in seconds) of the window kept at the center of the audio, None to keep it all
+        :type window: float
+        """
+        self.suffix = suffix
+        self.content_type = content_type
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.window = window
+
+    def options(self, duration: float | None) -> list[str]:
+        """
+        Get the ffmpeg options writing the rendition.
+        :param duration: the duration (in seconds) of the audio, None if unknown
+        :type duration: float | None
+        :return: the output options
+        :rtype: list[str]
+        """
+        options = ["-map", "0:a:0", "-vn"]
+        if self.channels is not None:
+            options += ["-ac", str(self.channels)]
+        if self.sample_rate is not None:
+            options += ["-ar", str(self.sample_rate)]
+        if self.window is not None:
+            # Same window as the service would cut from the original audio
+            start = max(0.0, (duration - self.window) / 2) if duration is not None else 0.0
+            options += ["-ss", f"{start:.3f}", "-t", f"{self.window:.3f}"]
+        return options + self.codec
+
+
+def ffmpeg_available() -> bool:
+    return FFMPEG is not None and FFPROBE is not None
+
+
+async def _run(*command: str) -> bytes:
+    process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.DEVNULL,
+                                                   stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise TranscodingError(f"{os.path.basename(command[0])} exited with status {process.returncode}: "
+                               f"{stderr.decode(errors='replace').strip()[-500:]}")
+    return stdout
+
+
+async def probe_duration(path: str) -> float | None:
+    """
+    Get the duration of an audio file.
+    :param path: the path of the audio file
+    :type path: str
+    :return: the duration (in seconds), None if it is not known
+    :rtype: float | None
+    """
+    output = await _run(FFPROBE, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path)
+    try:
+        return float(output.decode().strip())
+    except ValueError:
+        return None
+
+
+async def transcode(path: str, renditions: dict[str, Rendition], directory: str) -> dict[str, dict]:
+    """
+    Write the renditions of an audio file, decoding it once with a single ffmpeg process.
+    :param path: the path of the audio file
+    :type path: str
+    :param renditions: the renditions to write, by service
+    :type renditions: dict[str, Rendition]
+    :param directory: the directory of the renditions
+    :type directory: str
+    :return: the path and the content type of each rendition, by service
+    :rtype: dict[str, dict]
+    :raise TranscodingError: if ffmpeg failed, no rendition is left behind then
+    """
+    duration = await probe_duration(path)
+    outputs = {}
+    for service, rendition in renditions.items():
+        with NamedTemporaryFile(suffix=rendition.suffix, dir=directory, delete=False) as f:
+            outputs[service] = {"path": f.name, "content_type": rendition.content_type}
+
+    command = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-i", path]
+    for service, rendition in renditions.items():
+        command += rendition.options(duration) + [outputs[service]["path"]]
+    try:
+        await _run(*command)
+    except BaseException:
+        for output in outputs.values():
+            os.remove(output["path"])
+        raise
+    return outputs
@@ -0,0 +1,48 @@
+"""
+Helpers for the YouTube URLs given by the clients.
+"""
+
+import re
+from urllib.parse import parse_qs, urlsplit
+
+# Same URL shapes as the ones accepted by the youtube-downloader service
+YOUTUBE_URL_PATTERN = re.compile(
+    r"^((?:https?:)?\/\/)?((?:www|m)\.)?((?:youtube(-nocookie)?\.com|youtu.be))(\/(?:[\w\-]+\?v=|embed\/|v\/)?)([\w\-]+)(\S+)?$"
+)
+
+
+# Paths of a video whose id is the segment following the keyword, e.g. `/shorts/<id>`
+VIDEO_ID_PATHS = ("shorts", "live", "embed", "v")
+VIDEO_ID_PATTERN = re.compile(r"^[\w\-]+$")
+
+
+def youtube_video_id(url: str) -> str | None:
+    """
+    Extract the video id of a YouTube URL: `https://youtu.be/<id>`, `https://www.youtube.com/watch?v=<id>&t=42`,
+    or `https://www.youtube.com/<shorts|live|embed|v>/<id>`.
+    :param url: the YouTube URL
+    :type url: str
+    :return: the video id, None if the URL is not a YouTube URL or does not have one of these shapes
+    (e.g. a channel URL)
+    :rtype: str | None
+    """
+    url = url.strip()
+    match = YOUTUBE_URL_PATTERN.match(url)
+    if match is None:
+        return None
+    parts = urlsplit(url if match.group(1) else "//" + url)
+    segments = [segment for segment in parts.path.split("/") if segment]
+
+    if match.group(3) == "youtu.be":
+        video_id = segments[0] if len(segments) == 1 else None
+    elif segments == ["watch"]:
+        # `v` is not always the first query parameter, e.g. `/watch?feature=share&v=<id>`
+        video_id = parse_qs(parts.query).get("v", [None])[0]
+    elif len(segments) == 2 and segments[0] in VIDEO_ID_PATHS:
+        video_id = segments[1]
+    else:
+        video_id = None
+
+    if video_id is None or VIDEO_ID_PATTERN.match(video_id) is None:
+        return None
+    return video_id
@@ -27,12 +27,15 @@ from compel import Compel
 from diffusers import StableDiffusionPipeline, EulerDiscreteScheduler
 from diffusers.pipelines.stable_diffusion.convert_from_ckpt import download_from_original_stable_diffusion_ckpt
 from io import BytesIO
+from fastapi import Request
+from tracing import KIND_SERVER, Tracer
 
 # Disable warnings
 # import warnings
 # warnings.filterwarnings("ignore")
 
 settings = get_settings()
+tracer = Tracer("art-generation")
 loaded = False
 model_ids = ['stabilityai/stable-diffusion-2-base', 'prompthero/openjourney', './music-cover']
 guidance_scale = 5
@@ -168,22 +171,25 @@ class MyService(Service):
             negative_prompts_multi = [negative_prompts] * nb_images_per_model
 
             print("Prompt embedding...")
-            prompt_embeds = compel(prompt_multi)
-            negative_prompts_embeds = compel(negative_prompts_multi)
+            with tracer.span("preprocess", attributes={"model.index": i}):
+                prompt_embeds = compel(prompt_multi)
+                negative_prompts_embeds = compel(negative_prompts_multi)
 
             print("Image generation...")
-            images = pipe(prompt_embeds=prompt_embeds,
-                          num_inference_steps=nb_steps,
-                          guidance_scale=guidance_scale,
-                          negative_prompt_embeds=negative_prompts_embeds,
-                          ).images
+            with tracer.span("inference", attributes={"model.index": i, "images": nb_images_per_model}):
+                images = pipe(prompt_embeds=prompt_embeds,
+                              num_inference_steps=nb_steps,
+                              guidance_scale=guidance_scale,
+                              negative_prompt_embeds=negative_prompts_embeds,
+                              ).images
             all_cover_images += images
 
         images_bytes = []
-        for image in all_cover_images:
-            image_bytes = BytesIO()
-            image.save(image_bytes, format="PNG")
-            images_bytes.append(image_bytes.getvalue())
+        with tracer.span("serialize"):
+            for image in all_cover_images:
+                image_bytes = BytesIO()
+                image.save(image_bytes, format="PNG")
+                images_bytes.append(image_bytes.getvalue())
 
         return {
             "image1": TaskData(
@@ -322,7 +328,12 @@ class Data(BaseModel):
 
 
 @app.post("/process", tags=['Process'])
-async def handle_process(data: Data):
+async def handle_process(request: Request, data: Data):
+    with tracer.span("POST /process", kind=KIND_SERVER, traceparent=request.headers.get("traceparent")):
+        return generate_archive(data)
+
+
+def generate_archive(data: Data):
     lyrics_analysis = data.lyrics_analysis
     music_style = data.music_style
 
@@ -344,28 +355,29 @@ async def handle_process(data: Data):
     images.append(result["image3"].data)
 
     print("Save images as temp files")
-    image_dir = "images"
-    os.makedirs(image_dir, exist_ok=True)
-    for i, image in enumerate(images):
-        # image is bytes
-        image_path = os.path.join(image_dir, f"image{i}.png")
-        print("image_path", image_path)
-        with open(image_path, "wb") as f:
-            f.write(image)
-
-    # Build an archive containing the images
-    print("Building archive")
-    archive = BytesIO()
-    with zipfile.ZipFile(archive, 'w') as zip_file:
-        for root, dirs, files in os.walk(image_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                zip_file.write(file_path)
-
-    # Save the archive on disk
-    archive_path = "images.zip"
-    with open(archive_path, "wb") as f:
-        f.write(archive.getvalue())
+    with tracer.span("archive"):
+        image_dir = "images"
+        os.makedirs(image_dir, exist_ok=True)
+        for i, image in enumerate(images):
+            # image is bytes
+            image_path = os.path.join(image_dir, f"image{i}.png")
+            print("image_path", image_path)
+            with open(image_path, "wb") as f:
+                f.write(image)
+
+        # Build an archive containing the images
+        print("Building archive")
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for root, dirs, files in os.walk(image_dir):
+                for file in files:
+                    file_path = os.path.join(root, file)
+                    zip_file.write(file_path)
+
+        # Save the archive on disk
+        archive_path = "images.zip"
+        with open(archive_path, "wb") as f:
+            f.write(archive.getvalue())
 
     print("Archive path", archive_path)
 
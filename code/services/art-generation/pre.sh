@@ -0,0 +1,6 @@
+#!/bin/bash
+
+cd $REPO_ROOT
+
+# The tracing module is shared with the orchestrator and the other services
+cp code/common/tracing.py code/services/art-generation/tracing.py
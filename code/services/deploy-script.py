@@ -16,6 +16,7 @@ FRONTEND_PATH: str = "../frontend/MLodImage/"
 FRONTEND_DIR_NAME: str = "MLodImage"
 ORCHESTRATOR_PATH: str = "../orchestrator/fastapi/"
 ORCHESTRATOR_DIR_NAME: str = "fastapi"
+COMMON_PATH: str = "code/common/"
 WEBAPP_PORT: int = 80
 SERVICES_PORT: int = 8000
 
@@ -33,7 +34,8 @@ def get_modified_services() -> list:
     This function returns a list of all services that have been modified in the last commit
     """
     # get list of modified files in the last commit
-    modified_services = os.popen("git diff --name-only HEAD^ HEAD").read().split("\n")
+    modified_files = os.popen("git diff --name-only HEAD^ HEAD").read().split("\n")
+    modified_services = modified_files.copy()
     modified_frontend = modified_services.copy()
     modified_orchestrator = modified_services.copy()
 
@@ -52,6 +54,11 @@ def get_modified_services() -> list:
     modified_frontend = list(set(modified_frontend))
     modified_orchestrator = list(set(modified_orchestrator))
 
+    # the shared modules are copied into the orchestrator and the services, which are all rebuilt
+    if any(x.startswith(COMMON_PATH) for x in modified_files):
+        modified_services = [service for service in os.listdir() if os.path.isdir(service)]
+        modified_orchestrator = [ORCHESTRATOR_DIR_NAME]
+
     return modified_services + modified_frontend + modified_orchestrator
 
 
@@ -66,12 +73,7 @@ def discover_services() -> None:
         if os.path.isdir(service):
             # check if the service has a Dockerfile and is in the list of modified services
             if os.path.isfile(f"{service}/Dockerfile") and service in modified_services:
-                # check if the service has a pre-script to run before building the docker image
-                if os.path.isfile(f"{service}/pre.sh"):
-                    print(f"Running pre-script for {service}...")
-                    status = os.system(f"sh {service}/pre.sh")
-                    if status != 0:
-                        raise Exception(f"Error while running pre-script for {service}")
+                run_pre_script(service)
                 docker_build(service)
                 if os.path.isfile(f"{service}/.build-only"):
                     print(f"Skipping deployment of {service}")
@@ -85,10 +87,22 @@ def discover_services() -> None:
 
     # check if the orchestrator has been modified
     if ORCHESTRATOR_DIR_NAME in modified_services:
+        run_pre_script(ORCHESTRATOR_PATH)
         docker_build(ORCHESTRATOR_PATH)
         deploy_service(ORCHESTRATOR_PATH)
 
 
+def run_pre_script(service_dir: str) -> None:
+    """
+    This function runs the pre-script of a service, if it has one, before building its docker image
+    """
+    if os.path.isfile(f"{service_dir}/pre.sh"):
+        print(f"Running pre-script for {service_dir}...")
+        status = os.system(f"sh {service_dir}/pre.sh")
+        if status != 0:
+            raise Exception(f"Error while running pre-script for {service_dir}")
+
+
 def docker_build(service_dir: str) -> None:
     """
     This function builds the docker image of a service and pushes it to the Container Registry
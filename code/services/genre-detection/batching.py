@@ -0,0 +1,127 @@
+"""
+Dynamic batching of the model inferences: the inputs of concurrent requests are gathered for a few
+milliseconds and run through the model as a single batch.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+
+class InferenceBatcher:
+    """
+    Queue of the inputs waiting for the model. A worker takes the first input waiting, gathers the inputs
+    arriving within a delay, up to a batch size, and runs the model once on all of them in a thread,
+    so the event loop keeps serving requests during the inference.
+    """
+
+    def __init__(self, model, device, max_batch_size: int, max_delay: float):
+        """
+        :param model: the model, in evaluation mode
+        :type model: torch.nn.Module
+        :param device: the device of the model
+        :type device: torch.device
+        :param max_batch_size: the maximum number of inputs of a batch
+        :type max_batch_size: int
+        :param max_delay: the maximum time (in seconds) the first input of a batch waits for other inputs
+        :type max_delay: float
+        """
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.waiting: list[tuple[torch.Tensor, asyncio.Future]] = []
+        self.arrived = asyncio.Event()
+        self.worker: asyncio.Task | None = None
+        # A single thread, the model runs one batch at a time
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    def start(self):
+        """
+        Start the worker on the running event loop.
+        """
+        self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the worker, the inputs still waiting are cancelled.
+        """
+        if self.worker is not None:
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+            self.worker = None
+        for _, future in self.waiting:
+            future.cancel()
+        self.waiting.clear()
+        self.executor.shutdown(wait=False)
+
+    async def infer(self, inputs: torch.Tensor) -> tuple[torch.Tensor, int]:
+        """
+        Run inputs through the model, in a batch with the inputs of the other requests.
+        :param inputs: the inputs, whose first dimension is the batch dimension
+        :type inputs: torch.Tensor
+        :return: the outputs of the model for the inputs and the size of the batch they ran in
+        :rtype: tuple[torch.Tensor, int]
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append((inputs, future))
+        self.arrived.set()
+        return await future
+
+    def _waiting_size(self) -> int:
+        return sum(len(inputs) for inputs, future in self.waiting if not future.done())
+
+    async def _gather(self) -> list[tuple[torch.Tensor, asyncio.Future]]:
+        # Wait for the first input, then for the batch to fill up until the delay is over
+        while not self.waiting:
+            self.arrived.clear()
+            await self.arrived.wait()
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while self._waiting_size() < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+        # Inputs of the requests that went away are dropped, the others are taken in arrival order.
+        # An input that does not fit waits for the next batch, unless it is alone
+        batch, size = [], 0
+        while self.waiting:
+            inputs, future = self.waiting[0]
+            if not future.done():
+                if batch and size + len(inputs) > self.max_batch_size:
+                    break
+                batch.append((inputs, future))
+                size += len(inputs)
+            self.waiting.pop(0)
+        return batch
+
+    def _forward(self, inputs: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model(inputs.to(self.device)).cpu()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._gather()
+            if not batch:
+                continue
+            try:
+                outputs = await loop.run_in_executor(self.executor, self._forward,
+                                                     torch.cat([inputs for inputs, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Fan the outputs out to the requests
+            offset = 0
+            for inputs, future in batch:
+                if not future.done():
+                    future.set_result((outputs[offset:offset + len(inputs)], len(outputs)))
+                offset += len(inputs)
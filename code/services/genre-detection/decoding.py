@@ -0,0 +1,77 @@
+"""
+Decoding of the audio files in memory, without writing them to disk. The files are decoded in-process by
+libsndfile (FLAC, WAV, OGG and MP3), other formats by an ffmpeg process reading and writing pipes only.
+The signal keeps the sample rate and channels of the file, so it is converted by AudioUtils like the
+training samples are.
+"""
+
+import io
+import shutil
+import subprocess
+import soundfile
+import torch
+
+FFMPEG = shutil.which("ffmpeg")
+# Frames read at once by libsndfile, about 20 seconds of audio
+READ_FRAMES = 1 << 20
+
+
+def _decode_soundfile(audio_file: bytes) -> tuple[torch.Tensor, int]:
+    with soundfile.SoundFile(io.BytesIO(audio_file)) as f:
+        # Read by blocks, as the number of frames is unknown in a FLAC file written to a pipe
+        blocks = []
+        while len(block := f.read(READ_FRAMES, dtype="float32", always_2d=True)):
+            # (frames, channels) to a (channels, frames) signal
+            blocks.append(torch.from_numpy(block.T))
+        sample_rate = f.samplerate
+    if not blocks:
+        raise ValueError("Could not decode the audio file: no audio samples")
+    return torch.cat(blocks, dim=1), sample_rate
+
+
+def _wav_chunk(wav: bytes, chunk_id: bytes) -> int:
+    # Offset of the content of a chunk of a WAV file
+    offset = 12
+    while offset + 8 <= len(wav):
+        if wav[offset:offset + 4] == chunk_id:
+            return offset + 8
+        offset += 8 + int.from_bytes(wav[offset + 4:offset + 8], "little")
+    raise ValueError(f"Could not decode the audio file: no {chunk_id.decode().strip()} chunk")
+
+
+def _decode_ffmpeg(audio_file: bytes) -> tuple[torch.Tensor, int]:
+    # The file is piped to ffmpeg, which writes the decoded samples back in a WAV file of 32-bit floats
+    command = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-map", "0:a:0",
+               "-f", "wav", "-acodec", "pcm_f32le", "pipe:1"]
+    process = subprocess.run(command, input=audio_file, capture_output=True)
+    if process.returncode != 0:
+        raise ValueError(f"Could not decode the audio file: {process.stderr.decode(errors='replace').strip()}")
+    wav = process.stdout
+    fmt = _wav_chunk(wav, b"fmt ")
+    channels = int.from_bytes(wav[fmt + 2:fmt + 4], "little")
+    sample_rate = int.from_bytes(wav[fmt + 4:fmt + 8], "little")
+    # The size of the data chunk is unknown when writing to a pipe, the samples go up to the end of the output
+    data = _wav_chunk(wav, b"data")
+    samples = torch.frombuffer(bytearray(wav[data:]), dtype=torch.float32)
+    if len(samples) < channels:
+        raise ValueError("Could not decode the audio file: no audio samples")
+    # Interleaved samples to a (channels, frames) signal
+    samples = samples[:len(samples) - len(samples) % channels]
+    return samples.view(-1, channels).t().contiguous(), sample_rate
+
+
+def decode(audio_file: bytes):
+    """
+    Decode an audio file held in memory, keeping its sample rate and channels.
+    :param audio_file: the content of the audio file
+    :type audio_file: bytes
+    :return: the signal as a tensor and the sample rate
+    :rtype: Tuple[torch.Tensor, int]
+    """
+    try:
+        return _decode_soundfile(audio_file)
+    except soundfile.LibsndfileError:
+        # A format libsndfile does not read (e.g. AAC)
+        if FFMPEG is None:
+            raise
+        return _decode_ffmpeg(audio_file)
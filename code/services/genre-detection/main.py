@@ -28,21 +28,24 @@ from common_code.common.enums import FieldDescriptionType, ExecutionUnitTagName,
 from common_code.common.models import FieldDescription, ExecutionUnitTag
 
 # service specific imports
-from tempfile import NamedTemporaryFile
 from fastapi import HTTPException, UploadFile, File
 from model.audio_cnn import AudioCNN
 from model.audio_utils import AudioUtils
 import yaml
 import torch
 import os
-from pydub import AudioSegment
+from fastapi import Request
+from tracing import KIND_SERVER, Tracer, current_span
+from batching import InferenceBatcher
+from decoding import decode
 
-# support audio : mpeg, ogg
-AUDIO_SUPPORTED = ["audio/mpeg", "audio/ogg"]
+# support audio : mpeg, ogg, flac (the rendition sent by the orchestrator)
+AUDIO_SUPPORTED = ["audio/mpeg", "audio/ogg", "audio/flac"]
 AUDIO_PARAMS = yaml.safe_load(open("params.yaml"))['audio']
 
 CURRENT_PATH = os.getcwd()
 settings = get_settings()
+tracer = Tracer("genre-detection")
 
 # load json file containing the mapping between the genre and the index
 with open('model/id_to_label.json') as f:
@@ -55,6 +58,24 @@ model = AudioCNN.load_from_checkpoint("model/model.ckpt", map_location=device)
 model.eval()
 print("Model loaded successfully, running on device: " + str(device))
 
+# Maximum number of inputs run through the model at once, and time (in milliseconds) a request waits
+# for other requests to batch with
+INFERENCE_BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", "16"))
+INFERENCE_BATCH_DELAY = float(os.environ.get("INFERENCE_BATCH_DELAY", "5"))
+batcher = InferenceBatcher(model, device, INFERENCE_BATCH_SIZE, INFERENCE_BATCH_DELAY / 1000)
+
+# Windows of the audio run through the model: "center" for the window at the center of the audio, as in
+# training, "full" for overlapping windows covering the whole audio (at most INFERENCE_MAX_WINDOWS, spread
+# over the audio), whose outputs are averaged, "cascade" for the center window, then the full windows
+# if the two most probable genres of the center window are less than INFERENCE_CASCADE_MARGIN apart
+INFERENCE_MODES = ["center", "full", "cascade"]
+INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "center")
+INFERENCE_WINDOW_OVERLAP = float(os.environ.get("INFERENCE_WINDOW_OVERLAP", "0.5"))
+INFERENCE_MAX_WINDOWS = int(os.environ.get("INFERENCE_MAX_WINDOWS", "16"))
+INFERENCE_CASCADE_MARGIN = float(os.environ.get("INFERENCE_CASCADE_MARGIN", "0.2"))
+if INFERENCE_MODE not in INFERENCE_MODES:
+    raise ValueError(f"Unknown inference mode {INFERENCE_MODE}, expected one of {INFERENCE_MODES}")
+
 
 class MyService(Service):
     """
@@ -75,7 +96,8 @@ class MyService(Service):
             description=api_description,
             status=ServiceStatus.AVAILABLE,
             data_in_fields=[
-                FieldDescription(name="audio", type=[FieldDescriptionType.AUDIO_MP3, FieldDescriptionType.AUDIO_OGG]),
+                FieldDescription(name="audio", type=[FieldDescriptionType.AUDIO_MP3, FieldDescriptionType.AUDIO_OGG,
+                                                     FieldDescriptionType.AUDIO_FLAC]),
             ],
             data_out_fields=[
                 FieldDescription(name="result", type=[FieldDescriptionType.APPLICATION_JSON]),
@@ -96,45 +118,138 @@ class MyService(Service):
         self.device = device
 
     def process(self, data):
-        # load and preprocess the audio file
-        audio_file = data['audio'].data
+        audio = self.load(data['audio'].data)
+        outputs, windows_used = self.infer(audio, lambda inputs: (self.model(inputs.to(self.device)), len(inputs)))
+        return self.serialize(outputs, windows_used)
+
+    def load(self, audio_file: bytes):
+        """
+        Decode an audio file to the sample rate and number of channels read by the model.
+        :param audio_file: the content of the audio file
+        :type audio_file: bytes
+        :return: the audio, composed of the signal and the sample rate
+        :rtype: Tuple[torch.Tensor, int]
+        """
         try:
-            with NamedTemporaryFile(dir="./audio/", delete=True) as f:
-                f.write(audio_file)
-                AudioSegment.from_file(f.name).export(f.name, format="wav")
-                audio = AudioUtils.open(f.name)
+            with tracer.span("decode", attributes={"audio.bytes": len(audio_file)}):
+                audio = decode(audio_file)
                 audio = AudioUtils.rechannel(audio, AUDIO_PARAMS["nb_channels"])
-                audio = AudioUtils.resample(audio, AUDIO_PARAMS["sample_rate"])
-                audio = AudioUtils.pad_truncate(audio, AUDIO_PARAMS["audio_duration"])
-                mel_spectrogram = AudioUtils.mel_spectrogram(audio)
+                return AudioUtils.resample(audio, AUDIO_PARAMS["sample_rate"])
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-        # inference
-        inputs = mel_spectrogram.unsqueeze(0)
-        inputs = inputs.to(self.device)
-        outputs = self.model(inputs)
-        _, prediction = torch.max(outputs.data, 1)
-
-        # convert the prediction to a genre
-        genre = self.mapping[str(prediction.item())]
-
-        outputs_list = outputs.data.tolist()[0]
-
-        genres_probs = {self.mapping[str(i)]: round(outputs_list[i], 4) for i in range(len(self.mapping))}
-
-        print(genres_probs)
-
-        # return the result
-        json_result = {"genre_top": genre,
-                       "genres": genres_probs}
-
-        return {
-            "result": TaskData(
-                data=json.dumps(json_result),
-                type=FieldDescriptionType.APPLICATION_JSON
-            )
-        }
+    def preprocess(self, audio, first_pass: bool):
+        """
+        Compute the mel spectrograms of the windows of the audio read by the model.
+        :param audio: the audio, composed of the signal and the sample rate
+        :type audio: Tuple[torch.Tensor, int]
+        :param first_pass: whether the windows are the first ones run (the center window in cascade mode),
+        or the ones run after escalating
+        :type first_pass: bool
+        :return: the mel spectrograms, the first dimension being the window
+        :rtype: torch.Tensor
+        """
+        full = INFERENCE_MODE == "full" or (INFERENCE_MODE == "cascade" and not first_pass)
+        try:
+            with tracer.span("preprocess") as span:
+                if full:
+                    if audio[0].shape[1] <= audio[1] // 1000 * AUDIO_PARAMS["audio_duration"]:
+                        # e.g. the orchestrator only sent the center window (its GENRE_AUDIO_DURATION)
+                        print(f"Warning: the audio is not longer than a window in {INFERENCE_MODE} mode, "
+                              f"only its center window is read")
+                    mel_spectrograms = AudioUtils.mel_spectrogram_windows(audio, AUDIO_PARAMS["audio_duration"],
+                                                                          INFERENCE_WINDOW_OVERLAP,
+                                                                          INFERENCE_MAX_WINDOWS)
+                else:
+                    audio = AudioUtils.pad_truncate(audio, AUDIO_PARAMS["audio_duration"])
+                    mel_spectrograms = AudioUtils.mel_spectrogram(audio).unsqueeze(0)
+                span.set_attribute("inference.windows", len(mel_spectrograms))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        return mel_spectrograms
+
+    def infer(self, audio, run):
+        """
+        Run the windows of the audio through the model, the center window first in cascade mode, then the
+        whole audio if the center window is not decisive.
+        :param audio: the audio, composed of the signal and the sample rate
+        :type audio: Tuple[torch.Tensor, int]
+        :param run: the function running inputs through the model, returning the outputs and the size of
+        the batch they ran in
+        :type run: Callable[[torch.Tensor], Tuple[torch.Tensor, int]]
+        :return: the outputs of the model for the last windows run and the number of windows run
+        :rtype: Tuple[torch.Tensor, int]
+        """
+        with torch.no_grad():
+            inputs = self.preprocess(audio, first_pass=True)
+            with tracer.span("inference") as span:
+                outputs, batch_size = run(inputs)
+                span.set_attribute("inference.batch_size", batch_size)
+                escalate = self.escalate(outputs)
+            windows_used = len(inputs)
+
+            # run the whole audio if the center window is not decisive
+            if escalate:
+                inputs = self.preprocess(audio, first_pass=False)
+                with tracer.span("inference") as span:
+                    outputs, batch_size = run(inputs)
+                    span.set_attribute("inference.batch_size", batch_size)
+                windows_used += len(inputs)
+        return outputs, windows_used
+
+    def escalate(self, outputs) -> bool:
+        """
+        Check whether the outputs of the center window are not decisive enough in cascade mode, i.e. whether
+        the difference between the two highest probabilities is below INFERENCE_CASCADE_MARGIN.
+        :param outputs: the outputs of the model for the center window, of shape (1, number of genres)
+        :type outputs: torch.Tensor
+        :return: whether the whole audio must be run through the model
+        :rtype: bool
+        """
+        if INFERENCE_MODE != "cascade":
+            return False
+        probabilities = torch.softmax(outputs.data.mean(dim=0), dim=0)
+        top = torch.topk(probabilities, 2).values
+        margin = (top[0] - top[1]).item()
+        span = current_span.get()
+        if span is not None:
+            span.set_attribute("inference.margin", round(margin, 4))
+        return margin < INFERENCE_CASCADE_MARGIN
+
+    def serialize(self, outputs, windows_used: int):
+        """
+        Convert the outputs of the model for the windows of an audio file to the result of the service.
+        :param outputs: the outputs of the model, of shape (number of windows, number of genres)
+        :type outputs: torch.Tensor
+        :param windows_used: the number of windows run through the model for the audio file
+        :type windows_used: int
+        :return: the result
+        :rtype: dict
+        """
+        with tracer.span("serialize"):
+            # average the outputs of the windows
+            outputs = outputs.mean(dim=0, keepdim=True)
+            _, prediction = torch.max(outputs.data, 1)
+            # convert the prediction to a genre
+            genre = self.mapping[str(prediction.item())]
+
+            outputs_list = outputs.data.tolist()[0]
+
+            genres_probs = {self.mapping[str(i)]: round(outputs_list[i], 4) for i in range(len(self.mapping))}
+
+            print(genres_probs)
+
+            # return the result
+            json_result = {"genre_top": genre,
+                           "genres": genres_probs,
+                           "windows_used": windows_used}
+
+            return {
+                "result": TaskData(
+                    data=json.dumps(json_result),
+                    type=FieldDescriptionType.APPLICATION_JSON
+                )
+            }
 
 
 api_summary = """
@@ -145,6 +260,7 @@ api_description = """
 Detect the musical genre of a song. Returns a JSON object with the following fields:
 - `genre_top': the top genre of the song
 - `genres': a dictionary of the genres of the song with their probabilities
+- `windows_used': the number of windows of the song run through the model
 """
 
 # Define the FastAPI application with information
@@ -184,25 +300,46 @@ service_service: ServiceService | None = None
 
 
 @app.post('/process', tags=['Process'])
-async def handle_process(audio: UploadFile = File(...)):
+async def handle_process(request: Request, audio: UploadFile = File(...)):
     """
     Route to perform the musical genre detection on an audio file.
     """
+    with tracer.span("POST /process", kind=KIND_SERVER, traceparent=request.headers.get("traceparent")):
+        return await detect_genre(audio)
+
+
+@app.get('/audio-format', tags=['Process'])
+async def audio_format():
+    """
+    Returns the audio read by the model, so clients sending a rendition of the audio cut the same window:
+    the sample rate and channels the audio is converted to, the duration (in ms) of a window, the inference
+    mode and the window read at the center of the audio (0 when the whole audio is read)
+    """
+    return {
+        "sample_rate": AUDIO_PARAMS["sample_rate"],
+        "channels": AUDIO_PARAMS["nb_channels"],
+        "audio_duration": AUDIO_PARAMS["audio_duration"],
+        "inference_mode": INFERENCE_MODE,
+        "window": AUDIO_PARAMS["audio_duration"] if INFERENCE_MODE == "center" else 0,
+    }
+
+
+async def detect_genre(audio: UploadFile):
     # Check if audio file is given
     if audio is None:
         raise HTTPException(status_code=400, detail="No audio file given")
     # Check if audio file is valid
     if audio.content_type not in AUDIO_SUPPORTED:
         raise HTTPException(status_code=400, detail="Invalid audio file given")
-    # Get audio file type
-    if audio.content_type == "audio/mpeg":
-        AUDIO_TYPE = FieldDescriptionType.AUDIO_MP3
-    else:
-        AUDIO_TYPE = FieldDescriptionType.AUDIO_OGG
     # convert audio to bytes
     audio_bytes = await audio.read()
-    # call service to process audio
-    result = MyService().process({"audio": TaskData(data=audio_bytes, type=AUDIO_TYPE)})
+    service = MyService()
+    # decode and preprocess the audio in a thread, the model runs in a batch with the concurrent requests
+    loop = asyncio.get_running_loop()
+    audio = await asyncio.to_thread(service.load, audio_bytes)
+    outputs, windows_used = await asyncio.to_thread(
+        service.infer, audio, lambda inputs: asyncio.run_coroutine_threadsafe(batcher.infer(inputs), loop).result())
+    result = service.serialize(outputs, windows_used)
     # Return the result
     data = json.loads(result["result"].data)
     return data
@@ -229,6 +366,9 @@ async def startup_event():
     # Start the tasks service
     tasks_service.start()
 
+    # Start batching the inferences of the process route
+    batcher.start()
+
     async def announce():
         retries = settings.engine_announce_retries
         for engine_url in settings.engine_urls:
@@ -253,3 +393,4 @@ async def shutdown_event():
     my_service = MyService()
     for engine_url in settings.engine_urls:
         await service_service.graceful_shutdown(my_service, engine_url)
+    await batcher.stop()
@@ -9,4 +9,7 @@ envsubst < .dvc/config > .dvc/config.local
 
 cp code/models/genre_detector/src/model/* code/services/genre-detection/model/
 
-cp code/models/genre_detector/params.yaml code/services/genre-detection/params.yaml
\ No newline at end of file
+cp code/models/genre_detector/params.yaml code/services/genre-detection/params.yaml
+
+# The tracing module is shared with the orchestrator and the other services
+cp code/common/tracing.py code/services/genre-detection/tracing.py
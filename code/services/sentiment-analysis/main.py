@@ -31,9 +31,12 @@ from spacy.language import Language
 from spacy_langdetect import LanguageDetector
 from operator import itemgetter
 from pysentimiento import create_analyzer
+from fastapi import Request
+from tracing import KIND_SERVER, Tracer
 
 stop_words = set(stopwords.words('english'))
 settings = get_settings()
+tracer = Tracer("sentiment-analysis")
 
 
 @Language.factory("custom_language_detector")
@@ -157,8 +160,10 @@ class MyService(Service):
         # Convert bytes to string
         text = text.decode("utf-8")
         # Get the language and sentiments
-        language, sentiments = get_metadata(text)
-        top_words = get_top_n(get_text_tf_idf_score(text), 10)
+        with tracer.span("inference", attributes={"text.length": len(text)}):
+            language, sentiments = get_metadata(text)
+        with tracer.span("top-words"):
+            top_words = get_top_n(get_text_tf_idf_score(text), 10)
 
         # https://stackoverflow.com/a/57915246
         class NpEncoder(json.JSONEncoder):
@@ -177,12 +182,13 @@ class MyService(Service):
             "top_words": top_words,
         }
 
-        return {
-            "result": TaskData(
-                data=json.dumps(json_result, cls=NpEncoder),
-                type=FieldDescriptionType.APPLICATION_JSON
-            )
-        }
+        with tracer.span("serialize"):
+            return {
+                "result": TaskData(
+                    data=json.dumps(json_result, cls=NpEncoder),
+                    type=FieldDescriptionType.APPLICATION_JSON
+                )
+            }
 
 
 api_summary = """
@@ -238,11 +244,12 @@ class Data(BaseModel):
 
 
 @app.post("/process", tags=['Process'])
-def handle_process(data: Data):
-    result = MyService().process({"text": TaskData(data=data.text, type=FieldDescriptionType.TEXT_PLAIN)})
+def handle_process(request: Request, data: Data):
+    with tracer.span("POST /process", kind=KIND_SERVER, traceparent=request.headers.get("traceparent")):
+        result = MyService().process({"text": TaskData(data=data.text, type=FieldDescriptionType.TEXT_PLAIN)})
 
-    data = json.loads(result["result"].data)
-    return data
+        data = json.loads(result["result"].data)
+        return data
 
 
 @app.on_event("startup")
@@ -32,10 +32,12 @@ import os
 import torch
 import whisper
 from tempfile import NamedTemporaryFile
-from fastapi import UploadFile, File, HTTPException
+from fastapi import Request, UploadFile, File, HTTPException
 from whisper import Whisper
+from tracing import KIND_SERVER, Tracer
 
 settings = get_settings()
+tracer = Tracer("whisper")
 
 model: Whisper
 audio_supported = ["audio/mpeg", "audio/ogg"]
@@ -86,9 +88,13 @@ class MyService(Service):
         # Save the audio file to the audio folder
         try:
             with NamedTemporaryFile(dir="./audio/", delete=True) as f:
-                f.write(audio)
-                # Do the speech recognition
-                result = my_service.model.transcribe(f.name)
+                with tracer.span("decode", attributes={"audio.bytes": len(audio)}):
+                    f.write(audio)
+                    f.flush()
+                    samples = whisper.load_audio(f.name)
+                # Do the speech recognition, the mel spectrogram is computed by transcribe
+                with tracer.span("inference"):
+                    result = my_service.model.transcribe(samples)
                 print("Transcription: " + result["text"])
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -194,10 +200,15 @@ async def shutdown_event():
 
 
 @app.post('/process', tags=['Process'])
-async def process(audio: UploadFile = File(...)):
+async def process(request: Request, audio: UploadFile = File(...)):
     """
     Route to do the speech recognition on the audio file given in the request
     """
+    with tracer.span("POST /process", kind=KIND_SERVER, traceparent=request.headers.get("traceparent")):
+        return await transcribe(audio)
+
+
+async def transcribe(audio: UploadFile):
     # Check if audio file is given
     if audio is None:
         raise HTTPException(status_code=400, detail="No audio file given")
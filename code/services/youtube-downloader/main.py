@@ -23,7 +23,9 @@ import re
 import tempfile
 from io import BytesIO
 from pytube import YouTube
+from fastapi import Request
 from fastapi.exceptions import HTTPException
+from tracing import KIND_SERVER, Tracer
 
 
 def youtube2mp3(url):
@@ -46,6 +48,7 @@ def youtube2mp3(url):
 
 
 settings = get_settings()
+tracer = Tracer("youtube-downloader")
 
 
 class MyService(Service):
@@ -91,7 +94,8 @@ class MyService(Service):
         ):
             raise Exception("Invalid URL, use a youtube.com URL")
 
-        file: BytesIO = youtube2mp3(text)
+        with tracer.span("download"):
+            file: BytesIO = youtube2mp3(text)
         if not file:
             raise Exception("Download failed.")
         file_bytes = file.read()
@@ -149,15 +153,16 @@ service_service: ServiceService | None = None
 
 
 @app.post("/process", tags=['Process'], response_class=FileResponse)
-def handle_process(url: str):
-    try:
-        result = MyService().process({"url": TaskData(data=url, type=FieldDescriptionType.TEXT_PLAIN)})
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file.write(result["result"].data)
-            temp_file.flush()
-            return FileResponse(temp_file.name, media_type="audio/mpeg", filename="result.mp3")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+def handle_process(request: Request, url: str):
+    with tracer.span("POST /process", kind=KIND_SERVER, traceparent=request.headers.get("traceparent")):
+        try:
+            result = MyService().process({"url": TaskData(data=url, type=FieldDescriptionType.TEXT_PLAIN)})
+            with tracer.span("serialize"), tempfile.NamedTemporaryFile(delete=False) as temp_file:
+                temp_file.write(result["result"].data)
+                temp_file.flush()
+                return FileResponse(temp_file.name, media_type="audio/mpeg", filename="result.mp3")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.on_event("startup")